@@ -0,0 +1,16 @@
+from setuptools import setup
+
+setup(
+    name="envisakit",
+    version="1.0.0",
+    description="Control an Ademco/Honeywell alarm panel through an Envisalink TPI or the EZMobile portal",
+    license="Apache License 2.0",
+    package_dir={"": "src"},
+    packages=["ademco", "ezmobile"],
+    python_requires=">=2.7, <3",
+    entry_points={
+        "console_scripts": [
+            "envisakit = ademco.cli:main",
+        ],
+    },
+)
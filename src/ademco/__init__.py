@@ -0,0 +1,4 @@
+import logging
+
+# The library only logs; handlers and levels are up to the application
+logging.getLogger(__name__).addHandler(logging.NullHandler())
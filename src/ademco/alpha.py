@@ -0,0 +1,176 @@
+import collections
+import threading
+import re
+
+# Panels cycle through a few dozen distinct texts; this comfortably holds them all
+ALPHA_CACHE_SIZE = 256
+
+ALPHA_MODE_DISARMED = "disarmed"
+ALPHA_MODE_AWAY = "away"
+ALPHA_MODE_STAY = "stay"
+ALPHA_MODE_NIGHT = "night"
+ALPHA_MODE_INSTANT = "instant"
+ALPHA_MODE_MAX = "max"
+ALPHA_MODE_ARMED = "armed"
+ALPHA_MODE_FAULT = "fault"
+ALPHA_MODE_BYPASS = "bypass"
+ALPHA_MODE_ALARM = "alarm"
+ALPHA_MODE_CHECK = "check"
+ALPHA_MODE_FIRE = "fire"
+
+# Checked in order against the text after "ARMED"; NIGHT-STAY is night, not stay
+ARMED_MODES = (
+    ("NIGHT", ALPHA_MODE_NIGHT),
+    ("AWAY", ALPHA_MODE_AWAY),
+    ("STAY", ALPHA_MODE_STAY),
+    ("INSTANT", ALPHA_MODE_INSTANT),
+    ("MAX", ALPHA_MODE_MAX),
+)
+
+# Keypad words that put a zone number and its label on the display
+ZONE_MODES = {
+    "FAULT": ALPHA_MODE_FAULT,
+    "BYPAS": ALPHA_MODE_BYPASS,
+    "BYPASS": ALPHA_MODE_BYPASS,
+    "ALARM": ALPHA_MODE_ALARM,
+    "CHECK": ALPHA_MODE_CHECK,
+    "TRBL": ALPHA_MODE_CHECK,
+    "FIRE": ALPHA_MODE_FIRE,
+}
+
+# Pattern, trouble kind
+TROUBLE_PATTERNS = (
+    (re.compile(r"\bAC\s+LOSS\b"), "ac-loss"),
+    (re.compile(r"\bLO(W)?\s+BAT"), "low-battery"),
+    (re.compile(r"\bCOMM\.?\s+FAIL"), "comm-failure"),
+    (re.compile(r"\bTAMPER\b"), "tamper"),
+)
+
+ZONE_PATTERN = re.compile(r"^(FAULT|BYPASS|BYPAS|ALARM|CHECK|TRBL|FIRE)\s+(\d{1,3})\b\s*(.*)$")
+COUNTDOWN_PATTERN = re.compile(r"EXIT\s+NOW\s*(\d{1,3})\b")
+
+
+def classify(text):
+    '''
+
+    Turns the 32-character alpha text of a keypad update into a dict with
+    "mode" (what the display shows, e.g. "away", "night", "fault", or
+    None), "zone" and "label" for zone messages, "trouble" (e.g.
+    "ac-loss", "low-battery") and "countdown", the seconds of exit delay
+    left, each None when the text does not carry it.
+
+    '''
+    upper = " ".join(text.upper().split())
+    classified = {"mode": None, "zone": None, "label": None, "trouble": None, "countdown": None}
+
+    if "DISARMED" in upper:
+        classified["mode"] = ALPHA_MODE_DISARMED
+
+    elif upper.startswith("ARMED"):
+        classified["mode"] = ALPHA_MODE_ARMED
+        for (word, mode) in ARMED_MODES:
+            if word in upper:
+                classified["mode"] = mode
+                break
+
+    else:
+        match = ZONE_PATTERN.match(upper)
+        if match is not None:
+            classified["mode"] = ZONE_MODES[match.group(1)]
+            classified["zone"] = int(match.group(2))
+            # The label keeps the panel's spelling, with the two display lines joined
+            label = " ".join(text.split()[2:])
+            classified["label"] = label or None
+            if classified["mode"] == ALPHA_MODE_CHECK:
+                classified["trouble"] = "zone-trouble"
+
+    for (pattern, kind) in TROUBLE_PATTERNS:
+        if pattern.search(upper):
+            classified["trouble"] = kind
+            break
+
+    match = COUNTDOWN_PATTERN.search(upper)
+    if match is not None:
+        classified["countdown"] = int(match.group(1))
+
+    return classified
+
+
+class AdemcoAlphaClassifier:
+    '''
+
+    Memoizes classify() in a bounded LRU keyed by the raw text. The dicts
+    it returns are shared between callers and must not be modified.
+
+    '''
+
+    def __init__(self, size=ALPHA_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, text):
+        with self.lock:
+            classified = self.cache.pop(text, None)
+            if classified is not None:
+                # Re-inserting moves the text to the most recently used end
+                self.cache[text] = classified
+                self.hits += 1
+                return classified
+
+        classified = classify(text)
+
+        with self.lock:
+            self.misses += 1
+            self.cache[text] = classified
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+        return classified
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+
+class AdemcoZoneDirectory:
+    '''
+
+    Zone labels learned from one panel's FAULT, BYPAS, ALARM and CHECK
+    messages, so zone numbers from other frames can be named.
+
+    '''
+
+    def __init__(self):
+        self.labels = {}
+
+    def learn(self, classified):
+        '''
+
+        Records the label of a zone message. Returns True if the
+        directory changed.
+
+        '''
+        zone = classified["zone"]
+        label = classified["label"]
+        if zone is None or label is None or self.labels.get(zone) == label:
+            return False
+
+        self.labels[zone] = label
+        return True
+
+    def label(self, zone):
+        return self.labels.get(zone)
+
+    def state(self):
+        return dict([(str(i), j) for (i, j) in self.labels.items()])
+
+    def restore(self, state):
+        for (zone, label) in (state or {}).items():
+            self.labels[int(zone)] = label
+
+
+# Shared by every response; panels repeat the same texts
+ALPHA = AdemcoAlphaClassifier()
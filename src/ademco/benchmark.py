@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+import subprocess
+import tempfile
+import platform
+import getopt
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+from ademco.connection import AdemcoServerConnection
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorPanel
+from ademco.metrics import METRICS
+from ademco.stats import summarize
+from ademco.common import QuietStderr
+
+BENCHMARK_UPDATE = '%00,01,1C08,08,00,****DISARMED****  Ready to Arm  $'
+BENCHMARK_FRAMES = (
+    BENCHMARK_UPDATE,
+    '%00,01,8C04,08,00,ARMED ***AWAY***You may exit now$',
+    '%01,0500000000000000$',
+    '%02,0100000000000000$',
+)
+
+BENCHMARK_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_CLI = os.path.join(BENCHMARK_SRC, "ademco.py")
+
+# What the installed envisakit command runs
+BENCHMARK_ENTRY_POINT = "from ademco.cli import main; main()"
+
+# Modules timed on their own, each in a fresh interpreter
+BENCHMARK_STARTUP_MODULES = ("ademco.cli", "ademco.server", "ademco.command", "ademco.router", "ademco.monitor")
+BENCHMARK_STARTUP_RUNS = 15
+BENCHMARK_PIN = "1234"
+BENCHMARK_PASSWORD = "user"
+
+BETTER_LOWER = "lower"
+BETTER_HIGHER = "higher"
+
+# Absolute limits; a result outside of them is flagged even without a baseline
+BENCHMARK_THRESHOLDS = {
+    "parse.us": 50.0,
+    "parse_metrics.us": 60.0,
+    "update_dict.us": 50.0,
+    "update_summary.us": 50.0,
+    "process_response.us": 100.0,
+    "framing.frames_per_second": 20000.0,
+    "e2e.status.p50_ms": 1500.0,
+    "e2e.arm.p50_ms": 1500.0,
+    "e2e.disarm.p50_ms": 1500.0,
+    "startup.help_overhead_ms": 40.0,
+}
+
+# Allowed slowdown relative to a baseline run before a result is flagged
+BENCHMARK_TOLERANCE = 0.25
+
+
+def measure(function, iterations):
+    '''
+
+    Returns the best mean time per call (seconds) over three rounds.
+
+    '''
+    best = None
+    for round_number in range(3):
+        began = time.time()
+        for i in xrange(iterations):
+            function()
+        elapsed = (time.time() - began) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(value, unit, better=BETTER_LOWER):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def benchmark_micro(iterations):
+    results = {}
+    parsed = AdemcoResponse()
+
+    with QuietStderr():
+        parsed.parse(BENCHMARK_UPDATE)
+
+        def parse():
+            AdemcoResponse().parse(BENCHMARK_UPDATE)
+
+        server = AdemcoServer()
+        frames = BENCHMARK_FRAMES
+        counter = [0]
+
+        def process_response():
+            counter[0] += 1
+            server._process_response(frames[counter[0] % len(frames)])
+
+        results["parse.us"] = result(measure(parse, iterations) * 1e6, "us")
+
+        # The same parse with instrumentation on shows what the hooks cost
+        METRICS.enable()
+        try:
+            results["parse_metrics.us"] = result(measure(parse, iterations) * 1e6, "us")
+        finally:
+            METRICS.enable(False)
+            METRICS.reset()
+
+        results["update_dict.us"] = result(measure(parsed.update_dict, iterations) * 1e6, "us")
+        results["update_summary.us"] = result(measure(parsed.update_summary, iterations) * 1e6, "us")
+        results["process_response.us"] = result(measure(process_response, iterations) * 1e6, "us")
+
+    return results
+
+
+def benchmark_framing(frame_count, seed=1):
+    '''
+
+    Feeds a burst of frames through connection framing, cut at random
+    boundaries the way large socket reads arrive.
+
+    '''
+    generator = random.Random(seed)
+    data = ''.join([generator.choice(BENCHMARK_FRAMES) + '\r\n' for i in xrange(frame_count)])
+
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        size = generator.randint(1, 4096)
+        chunks.append(data[offset:offset + size])
+        offset += size
+
+    connection = AdemcoServerConnection(None, None, None)
+    began = time.time()
+    for chunk in chunks:
+        connection._receive_data(chunk)
+    elapsed = time.time() - began
+
+    framed = len(connection.pop_responses())
+    return {"framing.frames_per_second": result(framed / elapsed, "frames/s", BETTER_HIGHER)}
+
+
+def benchmark_end_to_end(runs):
+    '''
+
+    Runs the CLI against a loopback simulator and times status, arm and disarm.
+
+    '''
+    panel = AdemcoSimulatorPanel(code=BENCHMARK_PIN)
+    simulator = AdemcoSimulator(password=BENCHMARK_PASSWORD, panel=panel, update_interval=1.0)
+    loop = simulator.start()
+    directory = tempfile.mkdtemp()
+
+    config_path = os.path.join(directory, "envisakit-config.json")
+    with open(config_path, 'w') as config_file:
+        json.dump({"host": "127.0.0.1", "port": simulator.address[1], "password": BENCHMARK_PASSWORD}, config_file)
+
+    samples = {"status": [], "arm": [], "disarm": []}
+    results = {}
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for i in range(runs):
+                for command in ("status", "arm", "disarm"):
+                    began = time.time()
+                    code = subprocess.call([sys.executable, BENCHMARK_CLI, command, "-p", BENCHMARK_PIN, "-c", config_path],
+                                           stdout=devnull, stderr=devnull)
+                    if code != 0:
+                        raise Exception("'%s' exited with %d" % (command, code))
+                    samples[command].append(time.time() - began)
+    finally:
+        loop.stop()
+        shutil.rmtree(directory)
+
+    for command in samples:
+        stats = summarize(samples[command], scale=1000.0)
+        results["e2e.%s.p50_ms" % command] = result(stats["p50"], "ms")
+        results["e2e.%s.max_ms" % command] = result(stats["max"], "ms")
+
+    return results
+
+
+def benchmark_startup(runs):
+    '''
+
+    Times fresh interpreters: a bare one, one per module that only imports
+    it, and the CLI entry point running help. help_overhead is the time
+    the CLI adds on top of the interpreter, which is what each HomeKit
+    request pays. Bytecode is written by a first untimed run and reused,
+    as it is after an install.
+
+    '''
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    environment["PYTHONPATH"] = BENCHMARK_SRC
+
+    cases = [("startup.interpreter_ms", ["-c", "pass"]),
+             ("startup.help_ms", ["-c", BENCHMARK_ENTRY_POINT, "help"])]
+    cases += [("startup.import.%s_ms" % i, ["-c", "import " + i]) for i in BENCHMARK_STARTUP_MODULES]
+
+    samples = dict([(i[0], []) for i in cases])
+    with open(os.devnull, 'w') as devnull:
+        for run in range(runs + 1):
+            for (name, arguments) in cases:
+                began = time.time()
+                subprocess.call([sys.executable] + arguments, stdout=devnull, stderr=devnull, env=environment)
+                if run > 0:
+                    samples[name].append(time.time() - began)
+
+    results = {}
+    for name in samples:
+        results[name] = result(summarize(samples[name], scale=1000.0)["p50"], "ms")
+
+    overhead = results["startup.help_ms"]["value"] - results["startup.interpreter_ms"]["value"]
+    results["startup.help_overhead_ms"] = result(max(0.0, overhead), "ms")
+    return results
+
+
+def compare(results, thresholds, baseline, tolerance):
+    '''
+
+    Returns a list of human-readable regressions.
+
+    '''
+    regressions = []
+
+    for name in sorted(results):
+        value = results[name]["value"]
+        higher = results[name]["better"] == BETTER_HIGHER
+
+        limit = thresholds.get(name)
+        if limit is not None and ((higher and value < limit) or (not higher and value > limit)):
+            regressions.append("%s = %.2f %s is past the threshold %.2f" % (name, value, results[name]["unit"], limit))
+
+        previous = baseline.get(name, {}).get("value") if baseline is not None else None
+        if previous:
+            change = (previous - value) / previous if higher else (value - previous) / previous
+            if change > tolerance:
+                regressions.append("%s = %.2f %s is %.0f%% worse than the baseline %.2f" % (
+                    name, value, results[name]["unit"], change * 100, previous))
+
+    return regressions
+
+
+def usage(exit_code):
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Usage: %(script)s [-o results.json] [-b baseline.json] [-t thresholds.json] [-T tolerance] [-n iterations] [-r e2e_runs] [--skip-e2e] [--skip-startup]" % {'script': sys.argv[0]}
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Benchmarks parsing, state decoding, framing, CLI startup and end-to-end CLI latency."
+    print >> sys.stderr, "Exits with 1 if any result is past its threshold or regressed against the baseline."
+    sys.exit(exit_code)
+
+
+def main():
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:b:t:T:n:r:", ["skip-e2e", "skip-startup"])
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(2)
+
+    output_path = None
+    baseline = None
+    thresholds = dict(BENCHMARK_THRESHOLDS)
+    tolerance = BENCHMARK_TOLERANCE
+    iterations = 20000
+    runs = 5
+    end_to_end = True
+    startup = True
+
+    try:
+        for option, value in opts:
+            if option == "-o":
+                output_path = value
+            elif option == "-b":
+                baseline = json.load(open(value))["results"]
+            elif option == "-t":
+                thresholds.update(json.load(open(value)))
+            elif option == "-T":
+                tolerance = float(value)
+            elif option == "-n":
+                iterations = int(value)
+            elif option == "-r":
+                runs = int(value)
+            elif option == "--skip-e2e":
+                end_to_end = False
+            elif option == "--skip-startup":
+                startup = False
+            else:
+                usage(2)
+    except (IOError, ValueError, KeyError) as e:
+        print >> sys.stderr, "Error: " + str(e)
+        usage(2)
+
+    results = {}
+    results.update(benchmark_micro(iterations))
+    results.update(benchmark_framing(iterations * 5))
+    if startup:
+        results.update(benchmark_startup(BENCHMARK_STARTUP_RUNS))
+    if end_to_end:
+        results.update(benchmark_end_to_end(runs))
+
+    regressions = compare(results, thresholds, baseline, tolerance)
+
+    report = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+        "regressions": regressions,
+    }
+
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    for name in sorted(results):
+        print "%-32s %12.2f %s" % (name, results[name]["value"], results[name]["unit"])
+
+    for regression in regressions:
+        print >> sys.stderr, "[Regression] " + regression
+
+    sys.exit(1 if len(regressions) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import bisect
+
+from ademco.common import monotonic
+
+# Upper bounds of the keypad update gap histogram, in seconds; the last bucket is open
+CADENCE_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0, 300.0, 600.0)
+
+# Until enough gaps have been seen, a panel is stale after this long without an update
+STALE_THRESHOLD_DEFAULT = 30.0
+STALE_THRESHOLD_MINIMUM = 5.0
+STALE_MULTIPLIER = 2.0
+CADENCE_LEARNING_SAMPLES = 20
+
+# Counts are halved at this total so the threshold follows a panel whose cadence changes
+CADENCE_DECAY_TOTAL = 1000
+
+CADENCE_PERCENTILE = 0.99
+
+
+class AdemcoUpdateCadence:
+    '''
+
+    Tracks the gaps between keypad updates from one panel, and learns how
+    long a silence has to last before the cached state should not be trusted.
+
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(CADENCE_BUCKETS) + 1)
+        self.total = 0
+        self.updates = 0
+        self.longest_gap = 0.0
+        self.last_update = None
+
+    def observe(self, received_at=None):
+        '''
+
+        Records a keypad update. Returns the gap since the previous one, if any.
+
+        '''
+        received_at = received_at if received_at is not None else monotonic()
+
+        if self.last_update is not None:
+            gap = max(0.0, received_at - self.last_update)
+            self.counts[bisect.bisect_left(CADENCE_BUCKETS, gap)] += 1
+            self.total += 1
+            self.longest_gap = max(self.longest_gap, gap)
+
+            if self.total >= CADENCE_DECAY_TOTAL:
+                self.counts = [i / 2 for i in self.counts]
+                self.total = sum(self.counts)
+        else:
+            gap = None
+
+        self.last_update = received_at
+        self.updates += 1
+        return gap
+
+    def gap_percentile(self, fraction):
+        '''
+
+        Returns the upper bound of the bucket holding the given fraction of
+        gaps, or the longest gap seen if it falls in the open bucket.
+
+        '''
+        if self.total == 0:
+            return None
+
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= fraction * self.total:
+                if index < len(CADENCE_BUCKETS):
+                    return CADENCE_BUCKETS[index]
+                break
+
+        return self.longest_gap
+
+    def threshold(self):
+        if self.total < CADENCE_LEARNING_SAMPLES:
+            return STALE_THRESHOLD_DEFAULT
+        return max(STALE_THRESHOLD_MINIMUM, self.gap_percentile(CADENCE_PERCENTILE) * STALE_MULTIPLIER)
+
+    def age(self, now=None):
+        if self.last_update is None:
+            return None
+        now = now if now is not None else monotonic()
+        return max(0.0, now - self.last_update)
+
+    def is_stale(self, now=None):
+        age = self.age(now)
+        return age is not None and age > self.threshold()
+
+    def state(self):
+        return {"counts": list(self.counts), "total": self.total, "updates": self.updates,
+                "longest-gap": self.longest_gap}
+
+    def restore(self, state):
+        '''
+
+        Restores what state() returned, so a restarted process keeps the
+        learned threshold. A state from a different bucket layout is ignored.
+
+        '''
+        if not state or len(state.get("counts", [])) != len(self.counts):
+            return
+
+        self.counts = list(state["counts"])
+        self.total = state.get("total", sum(self.counts))
+        self.updates = state.get("updates", 0)
+        self.longest_gap = state.get("longest-gap", 0.0)
+
+    def histogram(self):
+        bounds = [str(i) for i in CADENCE_BUCKETS] + ["+Inf"]
+        return dict(zip(bounds, self.counts))
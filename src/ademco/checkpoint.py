@@ -0,0 +1,82 @@
+import logging
+import json
+import os
+
+from ademco.common import monotonic
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 30.0
+
+# Bumped when the layout of a panel's state changes; older files are ignored
+CHECKPOINT_FORMAT = 1
+
+
+class AdemcoCheckpoint:
+    '''
+
+    A file holding the decoded state of one or more panels, keyed by
+    panel, as returned by AdemcoServer.checkpoint_state. A restarted
+    process loads it to answer status straight away instead of after the
+    next keypad update.
+
+    '''
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.next_save = monotonic() + interval
+
+    def load(self):
+        '''
+
+        Returns {panel: state}, or {} if there is no usable checkpoint.
+
+        '''
+        try:
+            with open(self.path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except IOError:
+            return {}
+        except ValueError as e:
+            logger.warning("Ignoring unreadable checkpoint %s: %s", self.path, e)
+            return {}
+
+        if not isinstance(checkpoint, dict) or checkpoint.get("format") != CHECKPOINT_FORMAT:
+            logger.warning("Ignoring checkpoint %s in an unknown format", self.path)
+            return {}
+
+        return checkpoint.get("panels", {})
+
+    def due(self, now=None):
+        '''
+
+        Returns True once per interval.
+
+        '''
+        now = now if now is not None else monotonic()
+        if now < self.next_save:
+            return False
+
+        self.next_save = now + self.interval
+        return True
+
+    def save(self, panels):
+        '''
+
+        Replaces the checkpoint with panels, {panel: state}. The file is
+        written aside and renamed, so a crash mid-save leaves the previous
+        checkpoint in place.
+
+        '''
+        temporary_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(temporary_path, "w") as checkpoint_file:
+                json.dump({"format": CHECKPOINT_FORMAT, "panels": panels}, checkpoint_file, separators=(",", ":"))
+            os.rename(temporary_path, self.path)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save checkpoint to %s: %s", self.path, e)
+
+
+def checkpoint_key(host, port):
+    return "%s:%s" % (host, port)
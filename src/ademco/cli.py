@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+
+# The CLI is started for every HomeKit request, so only what every command
+# needs is imported here; each command imports the rest when it runs
+
+from ademco.server import AdemcoServer
+from ademco.trace import TRACE
+from ademco.common import RUNLOOP_INTERVAL_RAPID, DEFAULT_HTTP_HOST, DEFAULT_HTTP_PORT
+from ademco.command import AdemcoCommandRun, AdemcoArmingWatch, arming_text
+from ademco.command import EXIT_SUCCESS, EXIT_BAD_REQUEST, EXIT_KEYBOARD, EXIT_NETWORK_FAILURE, EXIT_ALARM_NOT_READY
+
+import logging
+import signal
+import getopt
+import json
+import time
+import sys
+import os
+
+CONFIG_FILE_NAME = "envisakit-config.json"
+
+# Where the configuration is read from when -c is not given, before the working directory
+CONFIG_ENVIRONMENT_VARIABLE = "ENVISAKIT_CONFIG"
+
+
+def main():
+
+    # Help needs neither a configuration nor a connection
+    if len(sys.argv) < 2 or sys.argv[1] in ("help", "-h", "--help"):
+        usage(EXIT_BAD_REQUEST)
+
+    # Create the ademco server object
+    conn = AdemcoServer()
+
+    # Process command line arguments
+    command = process_cli_arguments(conn)
+
+    if conn.command_requires_parameter(command) and len(conn.config_param) < 1:
+        print >> sys.stderr, "Selected command requires parameter (use -x ####)"
+        usage(EXIT_BAD_REQUEST)
+
+    if command == AdemcoServer.COMMAND_HELP:
+        usage(EXIT_BAD_REQUEST)
+
+    # Commands that work from recorded history do not need a connection
+    if command == AdemcoServer.COMMAND_HISTORY:
+        sys.exit(process_history_command(conn))
+    elif command == AdemcoServer.COMMAND_REPLAY:
+        sys.exit(process_replay_command(conn))
+
+    # Dump the recent frames and decisions on demand
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: TRACE.dump(reason="SIGUSR1"))
+
+    # Only the long-running serve command has anyone to read /metrics
+    if command == AdemcoServer.COMMAND_SERVE:
+        from ademco.metrics import METRICS
+        METRICS.enable()
+
+    # Record traffic to the journal, if configured
+    if conn.config_journal:
+        import atexit
+        from ademco.journal import AdemcoJournal
+        journal = AdemcoJournal(conn.config_journal)
+        atexit.register(journal.close)
+        conn.set_journal(journal)
+
+    # Let the router pick between the TPI and EZMobile
+    if conn.config_route:
+        sys.exit(process_routed_command(conn, command))
+
+    # A restarted server answers from the last checkpoint until the panel speaks
+    checkpoint = None
+    if conn.config_checkpoint and command == AdemcoServer.COMMAND_SERVE:
+        from ademco.checkpoint import AdemcoCheckpoint, checkpoint_key
+        checkpoint = AdemcoCheckpoint(conn.config_checkpoint)
+        panel = checkpoint_key(conn.config_host, conn.config_port)
+        state = checkpoint.load().get(panel)
+        if state is not None:
+            conn.restore_checkpoint(state)
+
+        # Deploys stop the server with SIGTERM; exit through the final save
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(EXIT_SUCCESS))
+
+    # Use configuration file to configure connection
+    conn.connect(conn.config_host, conn.config_port, conn.config_password)
+
+    # Wait for the panel to be ready, issue the command, then wait for the panel to confirm it
+    run = AdemcoCommandRun(conn, command)
+
+    try:
+        while run.step() is None:
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save({panel: conn.checkpoint_state()})
+            time.sleep(RUNLOOP_INTERVAL_RAPID)
+    except KeyboardInterrupt:
+        print >> sys.stderr, "Detected keyboard interrupt - closing connection"
+        conn.disconnect()
+        sys.exit(EXIT_KEYBOARD)
+    finally:
+        if checkpoint is not None:
+            checkpoint.save({panel: conn.checkpoint_state()})
+
+    if run.message is not None:
+        print >> sys.stderr, run.message
+
+    # An arm command confirmed at the start of the exit delay reports the countdown
+    if run.arming is not None and run.arming["state"] == "arming":
+        report_arming(conn, run.arming)
+        if conn.config_stream_arming:
+            sys.exit(process_arming_watch(conn, run.arming))
+
+    sys.exit(run.result)
+
+
+def report_arming(ademcoServer, status):
+
+    if ademcoServer.config_use_json:
+        print json.dumps(status, sort_keys=True)
+    else:
+        print arming_text(status)
+    sys.stdout.flush()
+
+
+def process_arming_watch(ademcoServer, arming):
+
+    watch = AdemcoArmingWatch(ademcoServer, arming, lambda status: report_arming(ademcoServer, status))
+
+    try:
+        while watch.step() is None:
+            time.sleep(RUNLOOP_INTERVAL_RAPID)
+    except KeyboardInterrupt:
+        ademcoServer.disconnect()
+        return EXIT_KEYBOARD
+
+    if watch.message is not None:
+        print >> sys.stderr, watch.message
+    return watch.result
+
+
+def usage(exit_code):
+    '''
+
+    Displays usage information and quits with exit_code.
+
+    '''
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Usage: %(script)s COMMAND [-p PIN] [-c config_file] [-f] [-x extra-parameter] [-j] [-l [host:]port] [-s since] [-u until] [-R] [-w] [-v]" % {'script': sys.argv[0]}
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Available commands: " + ", ".join([i[1] for i in AdemcoServer.ADEMCO_COMMANDS])
+    print >> sys.stderr, ""
+    print >> sys.stderr, "* [-p PIN]: Provide your 4-digit security PIN (required for most commands)"
+    print >> sys.stderr, "* [-c config_file]: Specify a configuration file (default: $%s, or %s)" % (
+        CONFIG_ENVIRONMENT_VARIABLE, CONFIG_FILE_NAME)
+    print >> sys.stderr, "* [-f]: Force command to be sent without first checking for READY"
+    print >> sys.stderr, "* [-x extra_parameter]: Provide a parameter for the command (e.g., bypass zone #)"
+    print >> sys.stderr, "* [-j]: Output JSON (used for status and arming only)"
+    print >> sys.stderr, "* [-l [host:]port]: HTTP listen address (used for serve only, default: %s:%d)" % (DEFAULT_HTTP_HOST, DEFAULT_HTTP_PORT)
+    print >> sys.stderr, "* [-s since] [-u until]: Time range for history (YYYY-MM-DD[THH:MM[:SS]] or epoch seconds)"
+    print >> sys.stderr, "  history queries (-x): summary, last:FLAG, transitions:FLAG, durations:FLAG, faults"
+    print >> sys.stderr, "  replay speed (-x): max (default), or a multiple of real time, e.g. 1 or 60"
+    print >> sys.stderr, "* [-R]: Route status to the faster healthy backend, and commands to the TPI unless it is failing (TPI or the configured \"ezmobile\" portal)"
+    print >> sys.stderr, "* [-w]: After an arm command, keep reporting the exit delay until the panel is armed"
+    print >> sys.stderr, "* [-v]: Log connection progress; repeat (-v -v) to log every frame"
+    sys.exit(exit_code)
+
+
+def process_cli_arguments(ademcoServer):
+
+    # Get any options on the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "jfp:c:x:l:s:u:vRw", ["pin", "config"])
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(EXIT_BAD_REQUEST)
+
+    # Default configuration file name
+    config_file_name = os.environ.get(CONFIG_ENVIRONMENT_VARIABLE, CONFIG_FILE_NAME)
+
+    # Default HTTP listen address, filled in by serve
+    ademcoServer.config_listen = None
+
+    # Default history range (everything)
+    ademcoServer.config_since = None
+    ademcoServer.config_until = None
+
+    # Connect to the TPI directly, unless -R is given
+    ademcoServer.config_route = False
+
+    # Exit once an arm command is confirmed, unless -w is given
+    ademcoServer.config_stream_arming = False
+
+    # Warnings only, unless -v is given
+    log_level = logging.WARNING
+
+    # Change configuration file name if specified
+    for option, value in opts:
+
+        if option == "-p":
+            if len(value) != 4:
+                assert False, "PIN must be 4 digits"
+            ademcoServer.code = value
+
+        elif option == "-x":
+            assert len(value) >= 1, "Parameter must be provided"
+
+            ademcoServer.config_param = value
+
+        elif option == "-f":
+            ademcoServer.config_force = True
+
+        elif option == "-j":
+            ademcoServer.config_use_json = True
+
+        elif option == "-c":
+            config_file_name = value
+
+        elif option == "-l":
+            from ademco.httpapi import parse_listen_address
+            try:
+                ademcoServer.config_listen = parse_listen_address(value)
+            except ValueError:
+                print >> sys.stderr, "Error: Invalid listen address: " + value
+                usage(EXIT_BAD_REQUEST)
+
+        elif option in ("-s", "-u"):
+            from ademco.history import parse_history_time
+            try:
+                if option == "-s":
+                    ademcoServer.config_since = parse_history_time(value)
+                else:
+                    ademcoServer.config_until = parse_history_time(value)
+            except ValueError as e:
+                print >> sys.stderr, "Error: " + str(e)
+                usage(EXIT_BAD_REQUEST)
+
+        elif option == "-R":
+            ademcoServer.config_route = True
+
+        elif option == "-w":
+            ademcoServer.config_stream_arming = True
+
+        elif option == "-v":
+            log_level = logging.INFO if log_level == logging.WARNING else logging.DEBUG
+
+        else:
+            assert False, "unknown option"
+
+    logging.basicConfig(stream=sys.stderr, level=log_level, format="[%(levelname)s] %(message)s")
+
+    # Open configuration file
+    try:
+        config = json.load(open(config_file_name))
+    except IOError:
+        print >> sys.stderr, "Error: Failed to open %s - use -c to specify a custom config file." % config_file_name
+        usage(EXIT_BAD_REQUEST)
+
+    # Load configuration
+    try:
+        ademcoServer.config_host = config["host"]
+        ademcoServer.config_port = config["port"]
+        ademcoServer.config_password = config["password"]
+    except KeyError:
+        print >> sys.stderr, "Error: Missing required key. Ensure you have specified: host, port, password"
+        usage(EXIT_BAD_REQUEST)
+
+    # Load optional configuration
+    ademcoServer.config_journal = config.get("journal")
+    ademcoServer.config_ezmobile = config.get("ezmobile")
+    ademcoServer.config_router_race = config.get("router-race-status", False)
+    ademcoServer.config_router_stats = config.get("router-stats")
+    ademcoServer.config_checkpoint = config.get("checkpoint")
+    ademcoServer.config_confirm_exit_delay = config.get("confirm-exit-delay", True)
+
+    # Validate commands
+    if len(sys.argv) < 2:
+        usage(EXIT_BAD_REQUEST)
+    if sys.argv[1].startswith('-'):
+        usage(EXIT_BAD_REQUEST)
+
+    possible_commands = dict([(i[1], i[0]) for i in AdemcoServer.ADEMCO_COMMANDS])
+
+    try:
+        selected_command = possible_commands[sys.argv[1]]
+    except KeyError:
+        print >> sys.stderr, "Unexpected command: " + str(sys.argv[1])
+        usage(EXIT_BAD_REQUEST)
+
+    return selected_command
+
+
+def process_history_command(ademcoServer):
+
+    from ademco.history import AdemcoHistory
+
+    if not ademcoServer.config_journal:
+        print >> sys.stderr, "Error: history requires a \"journal\" path in the configuration file"
+        return EXIT_BAD_REQUEST
+
+    try:
+        history = AdemcoHistory.from_journal(ademcoServer.config_journal)
+        result = history.query(ademcoServer.config_param or "summary",
+                               ademcoServer.config_since, ademcoServer.config_until)
+    except ValueError as e:
+        print >> sys.stderr, "Error: " + str(e)
+        return EXIT_BAD_REQUEST
+
+    if ademcoServer.config_use_json:
+        print json.dumps(result)
+    else:
+        print json.dumps(result, indent=2, sort_keys=True)
+
+    return EXIT_SUCCESS
+
+
+def process_replay_command(ademcoServer):
+
+    from ademco.replay import AdemcoReplay, parse_replay_speed
+
+    if not ademcoServer.config_journal:
+        print >> sys.stderr, "Error: replay requires a \"journal\" path in the configuration file"
+        return EXIT_BAD_REQUEST
+
+    try:
+        speed = parse_replay_speed(ademcoServer.config_param)
+    except ValueError as e:
+        print >> sys.stderr, "Error: Invalid replay speed: " + str(e)
+        return EXIT_BAD_REQUEST
+
+    replay = AdemcoReplay(ademcoServer.config_journal, speed, ademcoServer)
+    report = replay.run(ademcoServer.config_since, ademcoServer.config_until)
+
+    if ademcoServer.config_use_json:
+        print json.dumps(report)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+    return EXIT_SUCCESS
+
+
+def process_routed_command(ademcoServer, command_id):
+
+    from ademco.router import build_router, AdemcoBackendError, AdemcoPanelNotReady, ROUTER_STATS_PATH
+
+    if command_id == AdemcoServer.COMMAND_SERVE:
+        print >> sys.stderr, "Error: serve holds the TPI session and cannot be routed"
+        return EXIT_BAD_REQUEST
+
+    if command_id != AdemcoServer.COMMAND_STATUS and ademcoServer.code is None:
+        print >> sys.stderr, "Selected command requires a PIN (use -p ####)"
+        return EXIT_BAD_REQUEST
+
+    router = build_router(ademcoServer.config_host, ademcoServer.config_port, ademcoServer.config_password,
+                          ademcoServer.config_ezmobile, ademcoServer.config_router_race, ademcoServer.journal)
+
+    # Rolling latency and success rates carry over between runs
+    stats_path = ademcoServer.config_router_stats
+    if stats_path is None:
+        stats_path = ROUTER_STATS_PATH
+    if stats_path:
+        router.load_stats(stats_path)
+
+    try:
+        if command_id == AdemcoServer.COMMAND_STATUS:
+            status = router.status()
+            if ademcoServer.config_use_json:
+                print json.dumps(status)
+            else:
+                print "%s (via %s)" % (status["text"], status["backend"])
+        else:
+            backend = router.command(command_id, ademcoServer.code, ademcoServer.config_param)
+            print >> sys.stderr, "Command confirmed via %s" % backend
+
+    except AdemcoPanelNotReady as e:
+        print >> sys.stderr, str(e)
+        return EXIT_ALARM_NOT_READY
+
+    except AdemcoBackendError as e:
+        print >> sys.stderr, "Error: " + str(e)
+        return EXIT_NETWORK_FAILURE
+
+    finally:
+        sys.stdout.flush()
+        if stats_path:
+            router.settle()
+            router.save_stats(stats_path)
+
+    return EXIT_SUCCESS
+
+
+if __name__ == "__main__":
+    main()
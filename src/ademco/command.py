@@ -0,0 +1,348 @@
+import json
+import sys
+
+from ademco.connection import AdemcoServerConnection
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer, ARM_COMMANDS
+from ademco.alpha import ALPHA_MODE_DISARMED
+from ademco.common import monotonic, DEFAULT_HTTP_HOST, DEFAULT_HTTP_PORT
+
+EXIT_INTERNAL_FAILURE = 254
+EXIT_NETWORK_FAILURE = 253
+EXIT_SUCCESS = 0
+EXIT_BAD_REQUEST = 1
+EXIT_KEYBOARD = 2
+EXIT_ALARM_NOT_READY = 10
+EXIT_TIMEOUT = 11
+
+COMMAND_TIMEOUT = 20
+
+# How long past the last reported countdown an exit delay may run before a watch gives up
+ARMING_GRACE = 10.0
+
+# Exit delay length assumed when the keypad does not show a countdown
+ARMING_DEFAULT_DELAY = 60.0
+
+
+def status_dict(server):
+    '''
+
+    Returns the last keypad update as a dict, with its staleness, or None.
+
+    '''
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+    if last_update is None:
+        return None
+
+    status = last_update.update_dict()
+    status["stale"] = server.state_stale
+    status["provisional"] = server.state_provisional
+    status["age-ms"] = server.update_age_ms()
+    return status
+
+
+def arming_status(server):
+    '''
+
+    Returns {"state": "armed"} once the panel reports it is armed, or
+    {"state": "arming", "remaining": seconds} while the panel is in its
+    exit delay, as shown by the partition state or by a countdown in the
+    keypad text. remaining is None if the keypad shows no countdown.
+    Otherwise returns None. Only frames received since the command was
+    issued are considered.
+
+    '''
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+    if last_update is not None and last_update.update_is_armed():
+        return {"state": "armed"}
+
+    countdown = last_update.update_alpha()["countdown"] if last_update is not None else None
+    in_exit_delay = countdown is not None
+
+    partition_state = server.last_response_of_type(AdemcoResponse.RESPONSE_PARTITION_STATE)
+    if partition_state is not None:
+        partition = int(last_update.response_data[AdemcoResponse.INDEX_UPDATE_PARTITION]) if last_update else 1
+        state = partition_state.partition_state_values().get(partition)
+        in_exit_delay = in_exit_delay or state == AdemcoResponse.PARTITION_STATE_EXIT_DELAY
+
+    if not in_exit_delay:
+        return None
+    return {"state": "arming", "remaining": countdown}
+
+
+def arming_text(status):
+    if status["state"] == "armed":
+        return "Armed"
+    if status.get("remaining") is None:
+        return "Arming"
+    return "Arming, %d seconds remaining" % status["remaining"]
+
+
+def handler_status(server, sec):
+
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+    if last_update is not None:
+
+        if server.config_use_json:
+            print json.dumps(status_dict(server))
+        else:
+            print last_update.update_summary()
+
+        return True
+    else:
+        return None
+
+
+def handler_update_received(server, sec):
+
+    if server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE) is None:
+        return None
+    return True
+
+
+def handler_ensure_armed(server, sec):
+
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+
+    if last_update is None:
+        return None
+    else:
+        if last_update.update_is_armed():
+            return True
+        # The start of the exit delay shows the panel accepted the command
+        elif server.config_confirm_exit_delay and arming_status(server) is not None:
+            return True
+        else:
+            if sec < COMMAND_TIMEOUT:
+                return None
+            else:
+                return False
+
+
+def handler_ensure_disarmed(server, sec):
+
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+
+    if last_update is None:
+        return None
+    else:
+        if not last_update.update_is_armed():
+            return True
+        else:
+            if sec < COMMAND_TIMEOUT:
+                return None
+            else:
+                return False
+
+
+def handler_ensure_bypass(server, sec):
+
+    last_update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+
+    if last_update is None:
+        return None
+    else:
+        if last_update.update_is_bypass():
+            return True
+        else:
+            if sec < COMMAND_TIMEOUT:
+                return None
+            else:
+                return False
+
+
+def handler_none(server, sec):
+    return True
+
+
+def handler_serve(server, sec):
+
+    # Start the HTTP status API once; the runloop keeps feeding it state
+    if getattr(server, "http_server", None) is None:
+        # Imported here so that one-shot commands do not load the HTTP server
+        from ademco.httpapi import AdemcoHTTPServer
+        if getattr(server, "config_listen", None) is None:
+            server.config_listen = (DEFAULT_HTTP_HOST, DEFAULT_HTTP_PORT)
+        server.http_server = AdemcoHTTPServer(server.config_listen, server)
+        server.http_server.start()
+        print >> sys.stderr, "Serving status on http://%s:%d/status" % server.config_listen
+
+    return None
+
+
+COMMAND_HANDLERS = (
+    (AdemcoServer.COMMAND_ARM_AWAY, handler_ensure_armed),
+    (AdemcoServer.COMMAND_ARM_STAY, handler_ensure_armed),
+    (AdemcoServer.COMMAND_ARM_NIGHT, handler_ensure_armed),
+    (AdemcoServer.COMMAND_ARM_INSTANT, handler_ensure_armed),
+    (AdemcoServer.COMMAND_ARM_MAX, handler_ensure_armed),
+    (AdemcoServer.COMMAND_DISARM, handler_ensure_disarmed),
+    (AdemcoServer.COMMAND_BYPASS, handler_ensure_bypass),
+    (AdemcoServer.COMMAND_TOGGLE_CHIME, handler_none),
+    (AdemcoServer.COMMAND_TEST, handler_none),
+)
+
+
+class AdemcoCommandRun:
+    '''
+
+    Runs one command against one connected panel: waits until the panel
+    is ready for it, issues it, then asks the command's handler each step
+    whether the panel has confirmed it. step() never blocks, so one thread
+    can advance many runs.
+
+    handler replaces the command's own post-command handler; with a
+    handler, status-only runs issue nothing. timeout, in seconds, bounds
+    the whole run. After a successful arm command, arming holds its
+    arming_status.
+
+    '''
+
+    def __init__(self, server, command, handler=None, timeout=None):
+        self.server = server
+        self.command = command
+        self.handler = handler
+        self.timeout = timeout
+        self.started = monotonic()
+        self.issued = False
+        self.callback = None
+        self.result = None
+        self.message = None
+        self.arming = None
+
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def _finish(self, result, message=None):
+        self.result = result
+        self.message = message
+        return result
+
+    def _issue(self):
+        handlers = dict(COMMAND_HANDLERS)
+
+        if self.command == AdemcoServer.COMMAND_STATUS:
+            return self.handler or handler_status
+
+        elif self.command == AdemcoServer.COMMAND_SERVE:
+            return self.handler or handler_serve
+
+        try:
+            handler = self.handler or handlers[self.command]
+        except KeyError:
+            raise Exception("Command not implemented")
+
+        self.server.issue_command(self.command, self.server.config_param)
+        self.server.clear_responses()
+        self.issued = True
+        return handler
+
+    def step(self):
+        '''
+
+        Advances the run by one runloop iteration. Returns None while it
+        is in progress, then its exit code.
+
+        '''
+        if self.result is not None:
+            return self.result
+
+        server = self.server
+        state = server.connection_state()
+
+        if state == AdemcoServerConnection.STATE_DISCONNECTED:
+            return self._finish(EXIT_NETWORK_FAILURE, "Connection terminated")
+
+        elif state != AdemcoServerConnection.STATE_CONNECTED:
+            return self._finish(EXIT_INTERNAL_FAILURE, "Unexpected error - unexpected state")
+
+        # Send/receive data in queue and process responses
+        server.process_connection()
+        server.process_queue()
+        server.check_staleness()
+
+        # If we have not issued any commands
+        if self.callback is None:
+
+            ready = server.is_ready_for_command(self.command)
+            if ready is True or server.config_force:
+                # Issue the command and determine the post-command handling
+                self.callback = self._issue()
+            elif ready is False:
+                return self._finish(EXIT_ALARM_NOT_READY, "Error: System not ready for this command.")
+
+        # If we have already issued a command
+        else:
+            # Ask the post-command handler if we are ready to terminate
+            term = self.callback(server, self.elapsed())
+            if term is True:
+                if self.issued and self.command in ARM_COMMANDS:
+                    self.arming = arming_status(server) or {"state": "armed"}
+                return self._finish(EXIT_SUCCESS)
+            elif term is False:
+                return self._finish(EXIT_ALARM_NOT_READY, "Error: Command was not confirmed by the panel.")
+
+        if self.timeout is not None and self.elapsed() > self.timeout:
+            return self._finish(EXIT_TIMEOUT, "Error: No answer within %g seconds." % self.timeout)
+
+        return None
+
+
+class AdemcoArmingWatch:
+    '''
+
+    Follows a panel through its exit delay after an arm command was
+    confirmed early. step() calls report with each new arming_status
+    (a new countdown, then "armed"), and never blocks.
+
+    '''
+
+    def __init__(self, server, arming, report):
+        self.server = server
+        self.report = report
+        self.last = arming
+        self.deadline = monotonic() + (arming.get("remaining") or ARMING_DEFAULT_DELAY) + ARMING_GRACE
+        self.result = None
+        self.message = None
+
+    def _finish(self, result, message=None):
+        self.result = result
+        self.message = message
+        return result
+
+    def step(self):
+        '''
+
+        Returns None while the exit delay runs, then an exit code.
+
+        '''
+        if self.result is not None:
+            return self.result
+
+        server = self.server
+        if server.connection_state() != AdemcoServerConnection.STATE_CONNECTED:
+            return self._finish(EXIT_NETWORK_FAILURE, "Connection terminated")
+
+        server.process_connection()
+        server.process_queue()
+
+        status = arming_status(server)
+        if status is not None and status != self.last:
+            self.last = status
+            if status.get("remaining") is not None:
+                self.deadline = monotonic() + status["remaining"] + ARMING_GRACE
+            self.report(status)
+
+        if status is not None and status["state"] == "armed":
+            return self._finish(EXIT_SUCCESS)
+
+        if status is None:
+            # Neither arming nor armed any more: the exit delay was cancelled
+            update = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+            if update is not None and update.update_alpha()["mode"] == ALPHA_MODE_DISARMED:
+                return self._finish(EXIT_ALARM_NOT_READY, "Error: The exit delay ended without the panel arming.")
+
+        if monotonic() > self.deadline:
+            return self._finish(EXIT_TIMEOUT, "Error: The panel did not arm by the end of its exit delay.")
+
+        return None
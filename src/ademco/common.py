@@ -1,4 +1,34 @@
 
+import os
+import sys
+
 RUNLOOP_INTERVAL_RAPID = 0.05
 RUNLOOP_INTERVAL_NORMAL = 0.1
-RUNLOOP_INTERVAL_SLOW = 0.3
\ No newline at end of file
+RUNLOOP_INTERVAL_SLOW = 0.3
+
+DEFAULT_HTTP_HOST = "127.0.0.1"
+DEFAULT_HTTP_PORT = 8025
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library; wall time is the closest
+    from time import time as monotonic
+
+
+class QuietStderr:
+    '''
+
+    Sends stderr to /dev/null for the duration of a with block, to keep
+    the connection's own error logging out of benchmark and test output.
+
+    '''
+
+    def __enter__(self):
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        return self
+
+    def __exit__(self, *args):
+        sys.stderr.close()
+        sys.stderr = self.stderr
@@ -1,8 +1,18 @@
+import logging
 import socket
 import select
-import sys
+import time
 
-from ademco.common import RUNLOOP_INTERVAL_NORMAL
+from ademco.common import RUNLOOP_INTERVAL_NORMAL, monotonic
+from ademco.metrics import METRICS
+from ademco.trace import AdemcoTrace, TRACE, TRACE_SESSION_SIZE, TRACE_RECEIVED, TRACE_SENT, TRACE_EVENT
+
+logger = logging.getLogger(__name__)
+
+LOGIN_TIMEOUT = 10.0
+LOGIN_LINE_LIMIT = 64
+RECEIVE_BUFFER_LIMIT = 16384
+RESPONSE_QUEUE_LIMIT = 4096
 
 
 class AdemcoServerConnection:
@@ -18,6 +28,19 @@ class AdemcoServerConnection:
         self.state = self.STATE_PENDING
         self.commands = []
         self.responses = []
+        self.receive_buffer = ''
+        self.received_at = None
+        self.journal = kwargs.get("journal")
+
+        # Called with each command once it has been sent
+        self.command_sent = None
+
+        # This session's frames and events; codes are masked as in TRACE
+        self.trace = AdemcoTrace(TRACE_SESSION_SIZE, secrets=TRACE.secrets)
+
+    def _trace(self, kind, text, *args):
+        TRACE.record(kind, text, *args)
+        self.trace.record(kind, text, *args)
 
     def add_command(self, command):
         if command is None:
@@ -25,9 +48,51 @@ class AdemcoServerConnection:
         self.commands.insert(0, command)
 
     def _add_response(self, response):
-        self.responses.insert(0, response)
+        if self.journal is not None and len(response) > 0:
+            self.journal.record_received(response)
+        self._trace(TRACE_RECEIVED, response)
+        self.responses.append(response)
+
+        if METRICS.enabled:
+            METRICS.increment("ademco_frames_received_total")
+
+        # Nobody is draining the queue; drop the oldest responses rather than grow
+        if len(self.responses) > RESPONSE_QUEUE_LIMIT:
+            if METRICS.enabled:
+                METRICS.increment("ademco_frames_dropped_total", len(self.responses) - RESPONSE_QUEUE_LIMIT)
+            del self.responses[:len(self.responses) - RESPONSE_QUEUE_LIMIT]
+
+    def _receive_data(self, data):
+
+        # Frames are stamped with the time of the read that completed them
+        self.received_at = monotonic()
+
+        # A frame may be split across reads; keep the unterminated tail for next time
+        lines = (self.receive_buffer + data).split('\r\n')
+        self.receive_buffer = lines.pop()
+
+        if len(self.receive_buffer) > RECEIVE_BUFFER_LIMIT:
+            logger.warning("Discarding %d bytes without a line terminator", len(self.receive_buffer))
+            self._trace(TRACE_EVENT, "discarded %d unterminated bytes", len(self.receive_buffer))
+            self.receive_buffer = ''
+
+        for response_line in lines:
+            response_line = response_line.strip()
+            if len(response_line) > 0:
+                self._add_response(response_line)
+
+    def _read_login_line(self):
+        # Read byte by byte so no frame sent right after the handshake is consumed here
+        line = ''
+        while not line.endswith('\n'):
+            data = self.sock.recv(1)
+            if len(data) == 0 or len(line) > LOGIN_LINE_LIMIT:
+                break
+            line += data
+        return line.strip()
 
     def pop_responses(self):
+        # Oldest first, in the order the frames arrived
         responses = list(self.responses)
         self.responses = []
         return responses
@@ -41,13 +106,17 @@ class AdemcoServerConnection:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         # Connect to envisalink
-        print >> sys.stderr, "Connecting to %s:%s" % (self.host, str(self.port))
+        logger.info("Connecting to %s:%s", self.host, self.port)
+        self._trace(TRACE_EVENT, "connecting to %s:%s", self.host, self.port)
         server_address = (self.host, self.port)
+        self.sock.settimeout(LOGIN_TIMEOUT)
+        began = time.time()
         self.sock.connect(server_address)
+        connected = time.time()
 
         # Verify challenge
-        data = self.sock.recv(8)
-        if data.strip().lower() != 'login:'.lower():
+        data = self._read_login_line()
+        if data.lower() != 'login:'.lower():
             raise Exception("Connection failed - Invalid challenge")
 
         # Send login
@@ -55,14 +124,28 @@ class AdemcoServerConnection:
         self.sock.sendall(login_phrase)
 
         # Determine response
-        data = self.sock.recv(4)
-
-        if data.strip().lower() == 'OK'.lower():
-            print >> sys.stderr, "Connected"
+        data = self._read_login_line()
+
+        if data.lower() == 'OK'.lower():
+            logger.info("Connected")
+            self._trace(TRACE_EVENT, "logged in")
+            if METRICS.enabled:
+                METRICS.observe("ademco_connect_seconds", connected - began, stage="tcp")
+                METRICS.observe("ademco_connect_seconds", time.time() - connected, stage="login")
             self.connection_cycle()
         else:
             raise Exception("Connection failed - Invalid code")
 
+    def _wait_readable(self, timeout):
+        # poll() has no FD_SETSIZE limit, which matters once many panels are open
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(self.sock, select.POLLIN)
+            return len(poller.poll(timeout * 1000)) > 0
+
+        ready = select.select([self.sock], [], [], timeout)
+        return len(ready[0]) > 0
+
     def connection_cycle(self):
 
         # Make socket non-blocking
@@ -75,29 +158,47 @@ class AdemcoServerConnection:
             # Receive data
             data = ''
             sending_commands = (len(self.commands) > 0)
-            ready = select.select([self.sock], [], [], RUNLOOP_INTERVAL_NORMAL)
-            if ready[0]:
+            if self._wait_readable(RUNLOOP_INTERVAL_NORMAL):
                 data = self.sock.recv(4096)
 
+                # Readable with nothing to read means the panel closed the session
+                if len(data) == 0:
+                    logger.warning("Connection closed by remote host")
+                    self._trace(TRACE_EVENT, "closed by remote host")
+                    self.disconnect()
+                    return
+
             if data is None:
                 return
 
             elif len(data) > 0:
-                # print >> sys.stderr, "Received %d bytes from server" % len(data)
-                for response_line in data.split('\r\n'):
-                    self._add_response(response_line.strip())
+                if METRICS.enabled:
+                    METRICS.increment("ademco_bytes_received_total", len(data))
+                self._receive_data(data)
 
             # Send data
             if sending_commands:
-                print >> sys.stderr, "Sending command: " + self.commands[-1]
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Sending command: %s", TRACE.mask(self.commands[-1]))
+                self._trace(TRACE_SENT, self.commands[-1])
                 self.sock.sendall(self.commands[-1] + '\r\n')
+                if self.journal is not None:
+                    self.journal.record_sent(self.commands[-1])
+                if METRICS.enabled:
+                    METRICS.increment("ademco_commands_sent_total")
+                if self.command_sent is not None:
+                    self.command_sent(self.commands[-1])
                 self.commands.pop()
 
         except Exception as e:
-            print >> sys.stderr, "Network exception: " + str(e)
+            logger.error("Network exception: %s", e)
+            self._trace(TRACE_EVENT, "network exception: %s", e)
+            self.trace.log(logger, "network exception on %s:%s" % (self.host, self.port), logging.DEBUG)
             self.disconnect()
 
     def disconnect(self):
+        if METRICS.enabled and self.state == self.STATE_CONNECTED:
+            METRICS.increment("ademco_disconnects_total")
         self.state = self.STATE_DISCONNECTED
         self.sock.close()
         
@@ -105,5 +206,9 @@ class AdemcoServerConnection:
         try:
             self.connect_and_login()
         except Exception as e:
-            print >> sys.stderr, "Connection failed: " + str(e)
+            logger.error("Connection failed: %s", e)
+            self._trace(TRACE_EVENT, "connection failed: %s", e)
+            self.trace.log(logger, "connection to %s:%s failed" % (self.host, self.port), logging.DEBUG)
+            if METRICS.enabled:
+                METRICS.increment("ademco_connect_failures_total")
             self.state = self.STATE_DISCONNECTED
\ No newline at end of file
@@ -0,0 +1,266 @@
+import collections
+import threading
+import logging
+import Queue
+
+from ademco.events import AdemcoStateEvent, compact_state
+from ademco.metrics import METRICS
+from ademco.common import monotonic
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_WORKERS = 4
+DISPATCH_QUEUE_LIMIT = 64
+
+# With DISPATCH_BLOCK, the runloop waits at most this long for room before dropping the event
+DISPATCH_BLOCK_TIMEOUT = 0.05
+
+# What happens to an event when a callback's queue is full
+DISPATCH_COMPACT = "compact"            # merge into the newest queued event; the callback still sees the final state
+DISPATCH_DROP_OLDEST = "drop-oldest"
+DISPATCH_DROP_NEWEST = "drop-newest"
+DISPATCH_BLOCK = "block"                # hold up the producer briefly, then drop the new event
+
+DISPATCH_POLICIES = (DISPATCH_COMPACT, DISPATCH_DROP_OLDEST, DISPATCH_DROP_NEWEST, DISPATCH_BLOCK)
+
+
+class AdemcoCallbackQueue:
+    '''
+
+    The pending events of one callback. At most one worker runs a given
+    callback at a time, so it sees its events in order; other callbacks
+    carry on in parallel on the remaining workers.
+
+    '''
+
+    def __init__(self, callback, name, policy, limit):
+        if policy not in DISPATCH_POLICIES:
+            raise ValueError("Unknown dispatch policy: %s" % policy)
+
+        self.callback = callback
+        self.name = name
+        self.policy = policy
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.events = collections.deque()
+        self.scheduled = False
+
+        self.calls = 0
+        self.failures = 0
+        self.dropped = 0
+        self.compacted = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def push(self, event):
+        '''
+
+        Queues event, applying the policy if the queue is full. Returns
+        True if the queue has to be handed to a worker.
+
+        '''
+        queued_at = monotonic()
+
+        with self.condition:
+            if len(self.events) >= self.limit:
+                if self.policy == DISPATCH_BLOCK:
+                    deadline = monotonic() + DISPATCH_BLOCK_TIMEOUT
+                    while len(self.events) >= self.limit and monotonic() < deadline:
+                        self.condition.wait(deadline - monotonic())
+
+                if len(self.events) >= self.limit:
+                    if self.policy == DISPATCH_COMPACT:
+                        (newest, queued_at) = self.events.pop()
+                        event = newest.merge(event)
+                        self.compacted += 1
+                    elif self.policy == DISPATCH_DROP_OLDEST:
+                        self.events.popleft()
+                        self._dropped()
+                    else:
+                        self._dropped()
+                        return False
+
+            self.events.append((event, queued_at))
+
+            if self.scheduled:
+                return False
+            self.scheduled = True
+            return True
+
+    def _dropped(self):
+        self.dropped += 1
+        if METRICS.enabled:
+            METRICS.increment("ademco_callback_dropped_total", callback=self.name)
+
+    def run_one(self):
+        '''
+
+        Runs the callback on the oldest event. Returns True if more
+        events are waiting, in which case the queue stays scheduled.
+
+        '''
+        with self.condition:
+            (event, queued_at) = self.events.popleft()
+            self.condition.notify_all()
+
+        began = monotonic()
+        failed = False
+        try:
+            self.callback(event)
+        except Exception as e:
+            # A failing callback must not take a worker down with it
+            failed = True
+            logger.warning("Event callback %s failed: %s", self.name, e, exc_info=True)
+        elapsed = monotonic() - began
+
+        if METRICS.enabled:
+            METRICS.observe("ademco_callback_seconds", elapsed, callback=self.name)
+
+        with self.condition:
+            self.calls += 1
+            self.failures += 1 if failed else 0
+            self.busy_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.max_wait_seconds = max(self.max_wait_seconds, began - queued_at)
+
+            if len(self.events) > 0:
+                return True
+            self.scheduled = False
+            self.condition.notify_all()
+            return False
+
+    def stats(self):
+        with self.condition:
+            return {
+                "policy": self.policy,
+                "queued": len(self.events),
+                "calls": self.calls,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "compacted": self.compacted,
+                "busy-seconds": round(self.busy_seconds, 6),
+                "max-seconds": round(self.max_seconds, 6),
+                "max-wait-seconds": round(self.max_wait_seconds, 6),
+            }
+
+
+class AdemcoEventDispatcher:
+    '''
+
+    Hands state changes to callbacks on a fixed pool of worker threads,
+    so a slow callback (a webhook, a database write) never holds up the
+    TPI runloop. The runloop only compares the state and enqueues; each
+    callback has a bounded queue with its own overflow policy.
+
+    Callbacks receive an AdemcoStateEvent, the same as /events clients.
+
+    '''
+
+    def __init__(self, ademco_server, workers=DISPATCH_WORKERS):
+        self.ademco_server = ademco_server
+        self.workers = workers
+        self.ready = Queue.Queue()
+        self.threads = []
+        self.queues = []
+        self.queues_lock = threading.Lock()
+        self.last_state = None
+        ademco_server.add_state_observer(self.state_changed)
+
+    def add_callback(self, callback, name=None, policy=DISPATCH_COMPACT, queue_limit=DISPATCH_QUEUE_LIMIT):
+        '''
+
+        Registers callback. name labels its stats (default: the function
+        name); policy says what to do when queue_limit events are waiting.
+
+        '''
+        queue = AdemcoCallbackQueue(callback, name or getattr(callback, "__name__", repr(callback)),
+                                    policy, queue_limit)
+        with self.queues_lock:
+            self.queues.append(queue)
+        return queue
+
+    def remove_callback(self, queue):
+        with self.queues_lock:
+            if queue in self.queues:
+                self.queues.remove(queue)
+
+    def start(self):
+        for index in range(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self._work, name="ademco-dispatch-%d" % len(self.threads))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        '''
+
+        Lets the workers finish what is queued, then stops them.
+
+        '''
+        self.wait_idle(timeout)
+        for thread in self.threads:
+            self.ready.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _work(self):
+        while True:
+            queue = self.ready.get()
+            if queue is None:
+                return
+
+            # One event at a time, so a busy callback takes turns with the others
+            if queue.run_one():
+                self.ready.put(queue)
+
+    def dispatch(self, event):
+        with self.queues_lock:
+            queues = list(self.queues)
+
+        for queue in queues:
+            if queue.push(event):
+                self.ready.put(queue)
+
+    def state_changed(self, version):
+        # Runs on the TPI runloop; only compares and enqueues
+        snapshot = self.ademco_server.state_snapshot()
+        state = compact_state(snapshot)
+
+        if state == self.last_state:
+            return
+
+        event = AdemcoStateEvent(snapshot["version"], self.last_state, state)
+        self.last_state = state
+        self.dispatch(event)
+
+    def wait_idle(self, timeout=None):
+        '''
+
+        Waits until every queued event has been handled. Returns False
+        if timeout seconds passed first.
+
+        '''
+        deadline = monotonic() + timeout if timeout is not None else None
+
+        with self.queues_lock:
+            queues = list(self.queues)
+
+        for queue in queues:
+            with queue.condition:
+                while queue.scheduled:
+                    if deadline is None:
+                        queue.condition.wait(1.0)
+                        continue
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                    queue.condition.wait(remaining)
+
+        return True
+
+    def stats(self):
+        with self.queues_lock:
+            queues = list(self.queues)
+        return dict([(i.name, i.stats()) for i in queues])
@@ -0,0 +1,174 @@
+import collections
+import threading
+import json
+
+SUBSCRIBER_BUFFER_LIMIT = 32
+
+TROUBLE_FLAGS = ("low-battery", "system-trouble")
+
+
+def compact_state(snapshot):
+    '''
+
+    Reduces a server state snapshot to the fields that event subscribers
+    care about: arm mode, ready, alarm, open zones, trouble flags and
+    whether the state is stale or only restored from a checkpoint.
+
+    '''
+    update = snapshot["update"] or {}
+
+    trouble = [i for i in TROUBLE_FLAGS if update.get(i)]
+    if update and not update.get("ac-present"):
+        trouble.append("ac-loss")
+
+    return {
+        "arm-mode": update.get("arm-mode"),
+        "ready": update.get("ready"),
+        "alarm": update.get("in_alarm"),
+        "fire": update.get("fire"),
+        "zones": list(snapshot["zones"]["open"]),
+        "trouble": trouble,
+        "stale": snapshot.get("stale", False),
+        "provisional": snapshot.get("provisional", False),
+    }
+
+
+class AdemcoStateEvent:
+
+    def __init__(self, version, previous, state):
+        self.version = version
+        self.previous = previous
+        self.state = state
+        self.compacted = 0
+
+    def merge(self, later):
+        # Collapse two consecutive transitions into one spanning both
+        merged = AdemcoStateEvent(later.version, self.previous, later.state)
+        merged.compacted = self.compacted + later.compacted + 1
+        return merged
+
+    def event_dict(self):
+        previous = self.previous or {}
+        previous_zones = set(previous.get("zones", []))
+        zones = set(self.state["zones"])
+
+        event = {
+            "version": self.version,
+            "changed": sorted([i for i in self.state if previous.get(i) != self.state[i]]),
+            "state": self.state,
+        }
+
+        if zones != previous_zones:
+            event["zones-opened"] = sorted(zones - previous_zones)
+            event["zones-closed"] = sorted(previous_zones - zones)
+
+        if self.compacted > 0:
+            event["compacted"] = self.compacted
+
+        return event
+
+    def event_json(self):
+        return json.dumps(self.event_dict(), separators=(',', ':'))
+
+
+class AdemcoEventSubscriber:
+
+    def __init__(self, limit=SUBSCRIBER_BUFFER_LIMIT):
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.events = collections.deque()
+        self.closed = False
+
+    def push(self, event):
+        '''
+
+        Queues an event without ever blocking the caller. When the buffer
+        is full, the two oldest events are merged so the subscriber still
+        sees the final state, just without every intermediate step.
+
+        '''
+        with self.condition:
+            self.events.append(event)
+
+            if len(self.events) > self.limit:
+                oldest = self.events.popleft()
+                self.events[0] = oldest.merge(self.events[0])
+
+            self.condition.notify()
+
+    def pop(self, timeout):
+        '''
+
+        Returns the next event, or None if none arrived within timeout seconds.
+
+        '''
+        with self.condition:
+            if len(self.events) == 0 and not self.closed:
+                self.condition.wait(timeout)
+
+            if len(self.events) == 0:
+                return None
+
+            return self.events.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class AdemcoEventBroker:
+
+    def __init__(self, ademco_server, buffer_limit=SUBSCRIBER_BUFFER_LIMIT):
+        self.ademco_server = ademco_server
+        self.buffer_limit = buffer_limit
+        self.subscribers_lock = threading.Lock()
+        self.subscribers = []
+        self.last_version = None
+        self.last_state = None
+        ademco_server.add_state_observer(self.state_changed)
+
+    def subscribe(self):
+        '''
+
+        Registers a new subscriber. The first event it receives is the
+        current state, so clients do not have to fetch it separately.
+
+        '''
+        subscriber = AdemcoEventSubscriber(self.buffer_limit)
+
+        # Holding the lock keeps a concurrent change from slipping between
+        # the initial event and the registration
+        with self.subscribers_lock:
+            if self.last_state is None:
+                snapshot = self.ademco_server.state_snapshot()
+                self.last_version = snapshot["version"]
+                self.last_state = compact_state(snapshot)
+
+            subscriber.push(AdemcoStateEvent(self.last_version, None, self.last_state))
+            self.subscribers.append(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+
+        with self.subscribers_lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def state_changed(self, version):
+        # Runs on the TPI runloop; only compares and enqueues
+        with self.subscribers_lock:
+            snapshot = self.ademco_server.state_snapshot()
+            state = compact_state(snapshot)
+
+            if state == self.last_state:
+                return
+
+            event = AdemcoStateEvent(snapshot["version"], self.last_state, state)
+            self.last_version = snapshot["version"]
+            self.last_state = state
+
+            for subscriber in self.subscribers:
+                subscriber.push(event)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+from multiprocessing.pool import ThreadPool
+import logging
+import getopt
+import json
+import time
+import sys
+
+from ademco.server import AdemcoServer
+from ademco.connection import AdemcoServerConnection
+from ademco.command import AdemcoCommandRun, status_dict, handler_update_received
+from ademco.command import EXIT_SUCCESS, EXIT_BAD_REQUEST, EXIT_NETWORK_FAILURE, EXIT_ALARM_NOT_READY, EXIT_TIMEOUT
+from ademco.command import COMMAND_TIMEOUT
+from ademco.common import RUNLOOP_INTERVAL_RAPID, monotonic
+from ademco.inventory import AdemcoInventory
+
+FLEET_CONCURRENCY = 64
+
+# Per panel, from the start of its login to the panel confirming the command
+FLEET_DEADLINE = COMMAND_TIMEOUT + 10.0
+
+# Exit code when any panel did not carry out the command
+EXIT_FLEET_INCOMPLETE = 12
+
+FLEET_COMMANDS = ("arm", "partial", "night", "instant", "max", "disarm", "bypass", "togglechime", "test", "status")
+
+RESULT_NAMES = {
+    EXIT_SUCCESS: "ok",
+    EXIT_NETWORK_FAILURE: "network-failure",
+    EXIT_ALARM_NOT_READY: "not-ready",
+    EXIT_TIMEOUT: "timeout",
+}
+
+
+class AdemcoFleet:
+    '''
+
+    Runs one command on many panels at once, at most concurrency at a
+    time. Each panel gets the same treatment as a single CLI run (wait
+    for READY, issue, wait for the handler to confirm), bounded by a
+    deadline of its own.
+
+    Panels are dicts with "host", "port" and "password", and optionally
+    "name" and "code" (which override the fleet-wide code), as read from
+    an inventory.
+
+    Arm commands count as done once the exit delay starts, with the
+    countdown in the result's "arming"; with wait_armed, each panel is
+    held until it is armed.
+
+    '''
+
+    def __init__(self, panels, concurrency=FLEET_CONCURRENCY, deadline=FLEET_DEADLINE, wait_armed=False):
+        self.panels = panels
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.wait_armed = wait_armed
+
+    def run_panel(self, panel, command, code=None, parameter="", force=False):
+        '''
+
+        Runs command on one panel and returns its result as a dict.
+
+        '''
+        began = monotonic()
+        result = {"panel": panel_name(panel)}
+
+        server = AdemcoServer()
+        server.code = panel.get("code", code)
+        server.config_param = parameter or ""
+        server.config_force = force
+        server.config_confirm_exit_delay = not self.wait_armed
+
+        try:
+            server.connect(panel["host"], panel["port"], panel["password"])
+            if server.connection_state() != AdemcoServerConnection.STATE_CONNECTED:
+                exit_code, message, issued = EXIT_NETWORK_FAILURE, "Could not log in", False
+            else:
+                handler = handler_update_received if command == AdemcoServer.COMMAND_STATUS else None
+                run = AdemcoCommandRun(server, command, handler=handler,
+                                       timeout=max(0.0, self.deadline - (monotonic() - began)))
+                while run.step() is None:
+                    time.sleep(RUNLOOP_INTERVAL_RAPID)
+                exit_code, message, issued = run.result, run.message, run.issued
+
+                if command == AdemcoServer.COMMAND_STATUS and exit_code == EXIT_SUCCESS:
+                    result["status"] = status_dict(server)
+                if run.arming is not None:
+                    result["arming"] = run.arming
+
+        except Exception as e:
+            exit_code, message, issued = EXIT_NETWORK_FAILURE, str(e), False
+
+        finally:
+            if getattr(server, "connection", None) is not None:
+                server.disconnect()
+
+        result["result"] = RESULT_NAMES.get(exit_code, "failed")
+        result["exit-code"] = exit_code
+        result["issued"] = issued
+        result["seconds"] = round(monotonic() - began, 3)
+        if message is not None:
+            result["message"] = message
+        return result
+
+    def run(self, command, code=None, parameter="", force=False, callback=None):
+        '''
+
+        Runs command on every panel. callback, if given, is called with
+        each panel's result as soon as it is known. Returns the summary.
+
+        '''
+        began = monotonic()
+        results = []
+
+        if len(self.panels) > 0:
+            pool = ThreadPool(max(1, min(self.concurrency, len(self.panels))))
+            try:
+                runs = pool.imap_unordered(lambda panel: self.run_panel(panel, command, code, parameter, force),
+                                           self.panels)
+                for result in runs:
+                    results.append(result)
+                    if callback is not None:
+                        callback(result)
+            finally:
+                pool.close()
+                pool.join()
+
+        return summarize(results, monotonic() - began)
+
+
+def panel_name(panel):
+    return panel.get("name", "%s:%s" % (panel.get("host"), panel.get("port")))
+
+
+def summarize(results, seconds):
+    '''
+
+    Returns counts by result, the failed panels, and the median and
+    longest panel times along with the wall time.
+
+    '''
+    counts = {}
+    for result in results:
+        counts[result["result"]] = counts.get(result["result"], 0) + 1
+
+    durations = sorted([i["seconds"] for i in results])
+    slowest = durations[-1] if durations else None
+    median = durations[len(durations) / 2] if durations else None
+
+    return {
+        "panels": len(results),
+        "results": counts,
+        "failed": sorted([i["panel"] for i in results if i["result"] != "ok"]),
+        "seconds": round(seconds, 3),
+        "panel-seconds": {"median": median, "max": slowest},
+    }
+
+
+def load_panels(path, tags=()):
+    '''
+
+    Reads the panels from an inventory file (see AdemcoInventory),
+    keeping only those that carry every one of tags.
+
+    '''
+    return AdemcoInventory.load(path).tagged(*tags)
+
+
+def usage(exit_code):
+    print >> sys.stderr, "Usage: %s COMMAND -F fleet_file [-t tag] [-p PIN] [-x parameter] [-n concurrency] [-d deadline] [-f] [-w]" % sys.argv[0]
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Commands: " + ", ".join(FLEET_COMMANDS)
+    print >> sys.stderr, ""
+    print >> sys.stderr, "-F: JSON inventory of panels (host, port, password, optional id, code and tags)"
+    print >> sys.stderr, "-t: Only panels with this tag (repeatable)"
+    print >> sys.stderr, "-n: Panels handled at once (default: %d)" % FLEET_CONCURRENCY
+    print >> sys.stderr, "-d: Seconds each panel has, from login to confirmation (default: %g)" % FLEET_DEADLINE
+    print >> sys.stderr, "-f: Send the command without first checking for READY"
+    print >> sys.stderr, "-w: Wait for each panel to finish its exit delay, not just start it"
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Prints one JSON line per panel as it finishes, then a summary line."
+    sys.exit(exit_code)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
+        usage(EXIT_BAD_REQUEST)
+
+    commands = dict([(i[1], i[0]) for i in AdemcoServer.ADEMCO_COMMANDS])
+    if sys.argv[1] not in FLEET_COMMANDS:
+        print >> sys.stderr, "Unexpected command: " + sys.argv[1]
+        usage(EXIT_BAD_REQUEST)
+    command = commands[sys.argv[1]]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "hF:t:p:x:n:d:fw")
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(EXIT_BAD_REQUEST)
+
+    fleet_file = None
+    tags = []
+    code = None
+    parameter = ""
+    concurrency = FLEET_CONCURRENCY
+    deadline = FLEET_DEADLINE
+    force = False
+    wait_armed = False
+
+    for option, value in opts:
+        if option == "-h":
+            usage(EXIT_SUCCESS)
+        elif option == "-F":
+            fleet_file = value
+        elif option == "-t":
+            tags.append(value)
+        elif option == "-p":
+            code = value
+        elif option == "-x":
+            parameter = value
+        elif option == "-n":
+            concurrency = int(value)
+        elif option == "-d":
+            deadline = float(value)
+        elif option == "-f":
+            force = True
+        elif option == "-w":
+            wait_armed = True
+
+    if fleet_file is None:
+        usage(EXIT_BAD_REQUEST)
+
+    if AdemcoServer().command_requires_parameter(command) and len(parameter) < 1:
+        print >> sys.stderr, "Selected command requires parameter (use -x ####)"
+        usage(EXIT_BAD_REQUEST)
+
+    # A panel that cannot be reached is reported in its result line; keep the log quiet
+    logging.basicConfig(stream=sys.stderr, level=logging.CRITICAL)
+
+    try:
+        panels = load_panels(fleet_file, tags)
+    except (IOError, ValueError) as e:
+        print >> sys.stderr, "Error: %s" % e
+        sys.exit(EXIT_BAD_REQUEST)
+
+    if command != AdemcoServer.COMMAND_STATUS and code is None and not all(["code" in i for i in panels]):
+        print >> sys.stderr, "Selected command requires a PIN (use -p ####, or \"code\" in the fleet file)"
+        sys.exit(EXIT_BAD_REQUEST)
+
+    def report(result):
+        print json.dumps(result, sort_keys=True)
+        sys.stdout.flush()
+
+    summary = AdemcoFleet(panels, concurrency, deadline, wait_armed).run(command, code, parameter, force, callback=report)
+    print json.dumps({"summary": summary}, sort_keys=True)
+
+    sys.exit(EXIT_SUCCESS if len(summary["failed"]) == 0 else EXIT_FLEET_INCOMPLETE)
+
+
+if __name__ == "__main__":
+    main()
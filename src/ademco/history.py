@@ -0,0 +1,276 @@
+import bisect
+import struct
+import array
+import time
+
+from ademco.response import AdemcoResponse
+from ademco import journal
+
+#
+# Named flags that can be queried, and the update bits that make them true
+#
+
+HISTORY_FLAGS = {
+    "armed": (AdemcoResponse.UPDATE_FLAG_ARMED, AdemcoResponse.UPDATE_FLAG_ARMED_AWAY, AdemcoResponse.UPDATE_FLAG_ARMED_STAY),
+    "ready": (AdemcoResponse.UPDATE_FLAG_READY,),
+    "alarm": (AdemcoResponse.UPDATE_FLAG_IN_ALARM, AdemcoResponse.UPDATE_FLAG_ALARM_FIRE, AdemcoResponse.UPDATE_FLAG_FIRE),
+    "ac-present": (AdemcoResponse.UPDATE_FLAG_AC_PRESENT,),
+    "low-battery": (AdemcoResponse.UPDATE_FLAG_LOWBAT,),
+    "system-trouble": (AdemcoResponse.UPDATE_FLAG_SYSTEM_TROUBLE,),
+    "bypassed": (AdemcoResponse.UPDATE_FLAG_BYPASS,),
+    "chime": (AdemcoResponse.UPDATE_FLAG_CHIME,),
+}
+
+
+HISTORY_QUERIES = ("summary", "last", "transitions", "durations", "faults")
+
+HISTORY_TIME_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+
+def parse_history_time(value):
+    '''
+
+    Parses epoch seconds or a local YYYY-MM-DD[THH:MM[:SS]] time.
+
+    '''
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    for time_format in HISTORY_TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, time_format))
+        except ValueError:
+            continue
+
+    raise ValueError("Invalid time: " + value)
+
+
+def flag_mask(flag):
+    try:
+        masks = HISTORY_FLAGS[flag]
+    except KeyError:
+        raise ValueError("Unknown flag: %s (use one of %s)" % (flag, ", ".join(sorted(HISTORY_FLAGS))))
+
+    mask = 0
+    for i in masks:
+        mask |= i
+    return mask
+
+
+class AdemcoHistory:
+
+    def __init__(self):
+
+        # Keypad updates, one entry per journal record
+        self.update_times = array.array('d')
+        self.update_bitfields = array.array('H')
+        self.update_zones = array.array('H')
+
+        # Zone open/close transitions decoded from zone change frames
+        self.zone_times = array.array('d')
+        self.zone_numbers = array.array('B')
+        self.zone_opened = array.array('b')
+
+    @classmethod
+    def from_journal(cls, path):
+        '''
+
+        Loads the keypad updates and zone changes of a journal into columns.
+        Only the fixed-width fields are decoded; keypad alpha text is never read.
+
+        '''
+        history = cls()
+        reader = journal.AdemcoJournalReader(path)
+        record_struct = struct.Struct(journal.RECORD_FORMAT)
+        open_zones = set()
+
+        try:
+            for number in xrange(len(reader)):
+                fields = record_struct.unpack_from(reader.records, number * journal.RECORD_SIZE)
+                time_ms, repeat, direction, record_type, partition, beep, bitfield, zone, text_id = fields
+
+                if direction != journal.DIRECTION_RECEIVED:
+                    continue
+
+                if record_type == journal.RECORD_TYPE_UPDATE:
+                    history.update_times.append(time_ms / 1000.0)
+                    history.update_bitfields.append(bitfield)
+                    history.update_zones.append(zone)
+
+                elif record_type == int(AdemcoResponse.RESPONSE_ZONE_CHANGE, 16):
+                    response = AdemcoResponse()
+                    response.response_data = [AdemcoResponse.RESPONSE_ZONE_CHANGE, reader.strings[text_id]]
+                    try:
+                        zones = set(response.zone_change_open_zones())
+                    except ValueError:
+                        continue
+
+                    for zone_number in sorted(zones ^ open_zones):
+                        history.zone_times.append(time_ms / 1000.0)
+                        history.zone_numbers.append(zone_number)
+                        history.zone_opened.append(1 if zone_number in zones else 0)
+                    open_zones = zones
+        finally:
+            reader.close()
+
+        return history
+
+    def _update_range(self, start, end):
+        first = bisect.bisect_left(self.update_times, start) if start is not None else 0
+        last = bisect.bisect_left(self.update_times, end) if end is not None else len(self.update_times)
+        return first, last
+
+    def time_range(self):
+        if len(self.update_times) == 0:
+            return (None, None)
+        return (self.update_times[0], self.update_times[-1])
+
+    def transitions(self, flag, start=None, end=None):
+        '''
+
+        Returns (timestamp, value) for every change of flag within [start, end).
+        The first entry is the state at the start of the range.
+
+        '''
+        mask = flag_mask(flag)
+        first, last = self._update_range(start, end)
+        bitfields = self.update_bitfields
+        times = self.update_times
+
+        result = []
+        previous = None
+        for i in xrange(first, last):
+            value = (bitfields[i] & mask) != 0
+            if value != previous:
+                result.append((times[i], value))
+                previous = value
+
+        return result
+
+    def last_transition(self, flag, value, start=None, end=None):
+        '''
+
+        Returns the timestamp at which flag last became value, or None.
+
+        '''
+        mask = flag_mask(flag)
+        first, last = self._update_range(start, end)
+        bitfields = self.update_bitfields
+
+        for i in xrange(last - 1, first - 1, -1):
+            if ((bitfields[i] & mask) != 0) != value:
+                continue
+            if i == first or ((bitfields[i - 1] & mask) != 0) != value:
+                return self.update_times[i]
+
+        return None
+
+    def durations(self, flag, start=None, end=None):
+        '''
+
+        Returns the seconds spent with flag true and false within [start, end).
+        Each update's state holds until the next update.
+
+        '''
+        mask = flag_mask(flag)
+        first, last = self._update_range(start, end)
+        totals = {True: 0.0, False: 0.0}
+
+        if first >= last:
+            return totals
+
+        times = self.update_times
+        bitfields = self.update_bitfields
+        range_end = end if end is not None else times[last - 1]
+
+        # The state in force when the range opens comes from the update before it
+        if first > 0 and start is not None:
+            totals[(bitfields[first - 1] & mask) != 0] += times[first] - start
+
+        for i in xrange(first, last):
+            until = times[i + 1] if i + 1 < last else range_end
+            totals[(bitfields[i] & mask) != 0] += max(0.0, until - times[i])
+
+        return totals
+
+    def zone_fault_counts(self, start=None, end=None):
+        '''
+
+        Returns {zone: number of times the zone faulted} within [start, end).
+        Zone change frames are used when the journal has them; otherwise each
+        zone shown as faulted on the keypad counts once per not-ready period.
+
+        '''
+        counts = {}
+
+        if len(self.zone_times) > 0:
+            first = bisect.bisect_left(self.zone_times, start) if start is not None else 0
+            last = bisect.bisect_left(self.zone_times, end) if end is not None else len(self.zone_times)
+            for i in xrange(first, last):
+                if self.zone_opened[i]:
+                    counts[self.zone_numbers[i]] = counts.get(self.zone_numbers[i], 0) + 1
+            return counts
+
+        fault_mask = flag_mask("ready") | flag_mask("armed") | flag_mask("alarm") | AdemcoResponse.UPDATE_FLAG_ALARM_IN_MEMORY
+        first, last = self._update_range(start, end)
+        seen = set()
+
+        for i in xrange(first, last):
+            bitfield = self.update_bitfields[i]
+            if bitfield & fault_mask:
+                # Ready, armed or in alarm: the fault period is over
+                seen = set()
+                continue
+
+            zone = self.update_zones[i]
+            if zone not in seen:
+                seen.add(zone)
+                counts[zone] = counts.get(zone, 0) + 1
+
+        return counts
+
+    def summary(self, start=None, end=None):
+        first_time, last_time = self.time_range()
+        first, last = self._update_range(start, end)
+
+        return {
+            "first-update": first_time,
+            "last-update": last_time,
+            "updates": last - first,
+            "last-armed": self.last_transition("armed", True, start, end),
+            "last-disarmed": self.last_transition("armed", False, start, end),
+            "ac-lost-seconds": self.durations("ac-present", start, end)[False],
+            "low-battery-seconds": self.durations("low-battery", start, end)[True],
+            "zone-faults": self.zone_fault_counts(start, end),
+        }
+
+    def query(self, query, start=None, end=None):
+        '''
+
+        Runs a CLI query of the form NAME[:FLAG] and returns a JSON-able result.
+
+        '''
+        name, _, flag = query.partition(':')
+
+        if name == "summary":
+            return self.summary(start, end)
+
+        elif name == "faults":
+            return self.zone_fault_counts(start, end)
+
+        elif name == "last":
+            return {
+                "true": self.last_transition(flag, True, start, end),
+                "false": self.last_transition(flag, False, start, end),
+            }
+
+        elif name == "transitions":
+            return [{"time": i[0], "value": i[1]} for i in self.transitions(flag, start, end)]
+
+        elif name == "durations":
+            totals = self.durations(flag, start, end)
+            return {"true": totals[True], "false": totals[False]}
+
+        raise ValueError("Unknown query: %s (use one of %s)" % (name, ", ".join(HISTORY_QUERIES)))
@@ -0,0 +1,183 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import urlparse
+import socket
+import json
+import os
+import time
+
+from ademco.events import AdemcoEventBroker
+from ademco.metrics import METRICS
+from ademco.trace import TRACE
+from ademco.common import DEFAULT_HTTP_HOST
+
+LONGPOLL_TIMEOUT_DEFAULT = 30.0
+LONGPOLL_TIMEOUT_MAX = 300.0
+
+EVENTS_KEEPALIVE_INTERVAL = 15.0
+
+
+def parse_listen_address(value):
+    '''
+
+    Parses a [host:]port listen address into a (host, port) tuple.
+
+    '''
+    if ':' in value:
+        host, port = value.rsplit(':', 1)
+    else:
+        host, port = DEFAULT_HTTP_HOST, value
+
+    return (host or DEFAULT_HTTP_HOST, int(port))
+
+
+class AdemcoHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Polling clients would otherwise flood stderr with one line per request
+        pass
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+
+        if url.path == "/status":
+            self._send_status(self.server.status_body())
+
+        elif url.path == "/status/wait":
+            self._send_status(self._wait_for_status(query))
+
+        elif url.path == "/events":
+            self._stream_events()
+
+        elif url.path == "/metrics":
+            self._send_body(200, "text/plain; version=0.0.4", METRICS.render())
+
+        elif url.path == "/trace":
+            self._send_body(200, "text/plain", "\n".join(TRACE.lines()) + "\n")
+
+        else:
+            self._send_body(404, "application/json", json.dumps({"error": "not found"}))
+
+    def _wait_for_status(self, query):
+
+        # The version to wait on comes from ?version=N, or from the client's ETag
+        version = None
+        try:
+            version = int(query["version"][0])
+        except (KeyError, ValueError):
+            version = self.server.version_from_etag(self.headers.get("If-None-Match"))
+
+        try:
+            timeout = float(query["timeout"][0])
+        except (KeyError, ValueError):
+            timeout = LONGPOLL_TIMEOUT_DEFAULT
+        timeout = max(0.0, min(timeout, LONGPOLL_TIMEOUT_MAX))
+
+        if version is not None:
+            self.server.ademco_server.wait_for_state_change(version, timeout)
+
+        return self.server.status_body()
+
+    def _stream_events(self):
+        broker = self.server.event_broker
+        subscriber = broker.subscribe()
+
+        # The stream has no length, so the connection ends with it
+        self.close_connection = 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        try:
+            while True:
+                event = subscriber.pop(EVENTS_KEEPALIVE_INTERVAL)
+                if event is None:
+                    self.wfile.write(": keepalive\n\n")
+                else:
+                    self.wfile.write("id: %d\nevent: state\ndata: %s\n\n" % (event.version, event.event_json()))
+                self.wfile.flush()
+        except socket.error:
+            pass
+        finally:
+            broker.unsubscribe(subscriber)
+
+    def _send_status(self, status):
+        version, body = status
+        etag = self.server.etag_for_version(version)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self._send_body(200, "application/json", body, etag)
+
+    def _send_body(self, code, content_type, body, etag=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AdemcoHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, ademco_server):
+        BaseHTTPServer.HTTPServer.__init__(self, address, AdemcoHTTPRequestHandler)
+        self.ademco_server = ademco_server
+        self.event_broker = AdemcoEventBroker(ademco_server)
+
+        # Versions restart at zero with the process; the epoch keeps old ETags from matching
+        self.etag_epoch = "%x%x" % (int(time.time()), os.getpid())
+
+        # The JSON body is only rebuilt when the state version moves
+        self.cache_lock = threading.Lock()
+        self.cached_version = None
+        self.cached_snapshot = None
+
+    def etag_for_version(self, version):
+        return '"%s-%d"' % (self.etag_epoch, version)
+
+    def version_from_etag(self, etag):
+        if etag is None:
+            return None
+
+        try:
+            epoch, version = etag.strip('"').rsplit('-', 1)
+            if epoch != self.etag_epoch:
+                return None
+            return int(version)
+        except ValueError:
+            return None
+
+    def status_body(self):
+        with self.cache_lock:
+            if self.cached_version != self.ademco_server.state_version:
+                self.cached_snapshot = self.ademco_server.state_snapshot()
+                self.cached_version = self.cached_snapshot["version"]
+
+            version, snapshot = (self.cached_version, dict(self.cached_snapshot))
+
+        # The snapshot is only rebuilt when the state changes; the age moves on within a version
+        snapshot["age-ms"] = self.ademco_server.update_age_ms()
+        return (version, json.dumps(snapshot))
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="ademco-http")
+        thread.daemon = True
+        thread.start()
+        return thread
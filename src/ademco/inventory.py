@@ -0,0 +1,169 @@
+import json
+import os
+
+DEFAULT_TPI_PORT = 4025
+
+# Keys that decide the TPI session; a change to any other key does not reconnect
+CONNECTION_KEYS = ("host", "port", "password")
+
+# Top-level keys that apply to every panel lacking them
+INHERITED_KEYS = ("port", "password", "code")
+
+
+class AdemcoInventory:
+    '''
+
+    Panels indexed by id and by tag. The file is a JSON list of panels, or
+    an object with the list under "panels" and defaults for "port",
+    "password" and "code". Each panel has "host" and "password", and
+    optionally "id" (default "host:port"), "port", "code", "partitions"
+    and "tags".
+
+    '''
+
+    def __init__(self, panels=()):
+        self.by_id = {}
+        self.by_tag = {}
+        self.order = []
+        for panel in panels:
+            self._add(panel)
+
+    @classmethod
+    def from_dict(cls, inventory):
+        if isinstance(inventory, list):
+            inventory = {"panels": inventory}
+        if not isinstance(inventory, dict):
+            raise ValueError("Inventory must be a list of panels or an object with \"panels\"")
+
+        panels = []
+        for (index, panel) in enumerate(inventory.get("panels", [])):
+            panel = dict(panel)
+            for key in INHERITED_KEYS:
+                if key not in panel and key in inventory:
+                    panel[key] = inventory[key]
+            panel.setdefault("port", DEFAULT_TPI_PORT)
+
+            if "host" not in panel or "password" not in panel:
+                raise ValueError("Panel %d needs host and password" % index)
+
+            panel.setdefault("id", "%s:%s" % (panel["host"], panel["port"]))
+            panel.setdefault("name", panel["id"])
+            panel["tags"] = sorted(set(panel.get("tags", [])))
+            panels.append(panel)
+
+        return cls(panels)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as inventory_file:
+            return cls.from_dict(json.load(inventory_file))
+
+    def _add(self, panel):
+        panel_id = panel["id"]
+        if panel_id in self.by_id:
+            raise ValueError("Duplicate panel id: %s" % panel_id)
+
+        self.by_id[panel_id] = panel
+        self.order.append(panel_id)
+        for tag in panel.get("tags", []):
+            self.by_tag.setdefault(tag, set()).add(panel_id)
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, panel_id):
+        return self.by_id.get(panel_id)
+
+    def panels(self):
+        return [self.by_id[i] for i in self.order]
+
+    def tagged(self, *tags):
+        '''
+
+        Returns the panels that carry every one of tags, in file order.
+
+        '''
+        if len(tags) == 0:
+            return self.panels()
+
+        ids = None
+        for tag in tags:
+            tagged = self.by_tag.get(tag, set())
+            ids = tagged if ids is None else ids & tagged
+
+        return [self.by_id[i] for i in self.order if i in ids]
+
+    def diff(self, other):
+        '''
+
+        Compares this inventory with a newer one. Returns (added, removed,
+        reconnect, updated): ids only in other, ids only in this one, ids
+        whose TPI session has to be reopened, and ids whose other details
+        (tags, partitions, code...) changed.
+
+        '''
+        added = [i for i in other.order if i not in self.by_id]
+        removed = [i for i in self.order if i not in other.by_id]
+        reconnect = []
+        updated = []
+
+        for panel_id in other.order:
+            old = self.by_id.get(panel_id)
+            new = other.by_id[panel_id]
+            if old is None or old == new:
+                continue
+            if connection_key(old) != connection_key(new):
+                reconnect.append(panel_id)
+            else:
+                updated.append(panel_id)
+
+        return (added, removed, reconnect, updated)
+
+
+def connection_key(panel):
+    return tuple([panel.get(i) for i in CONNECTION_KEYS])
+
+
+class AdemcoInventoryWatcher:
+    '''
+
+    Notices when the inventory file changes. check() stats the file,
+    and parses it only when its modification time or size moved.
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def load(self):
+        '''
+
+        Loads the file whether or not it changed. Raises IOError if it
+        is missing and ValueError if it cannot be parsed.
+
+        '''
+        self.signature = self._signature()
+        return AdemcoInventory.load(self.path)
+
+    def check(self):
+        '''
+
+        Returns the new inventory if the file changed since the last
+        call, otherwise None. Raises ValueError or IOError if the file
+        changed but cannot be loaded; the next change is tried again.
+
+        '''
+        signature = self._signature()
+        if signature is None or signature == self.signature:
+            return None
+
+        self.signature = signature
+        return AdemcoInventory.load(self.path)
@@ -0,0 +1,403 @@
+import threading
+import logging
+import Queue
+import struct
+import mmap
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+#
+# Record layout (little-endian, fixed width):
+#
+# timestamp (ms), repeat count, direction, type, partition, beep, bitfield, zone, text id
+#
+
+RECORD_FORMAT = '<QHBBBBHHI'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+INDEX_FORMAT = '<QQ'
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+INDEX_STRIDE = 256
+
+STRING_LENGTH_FORMAT = '<H'
+STRING_LENGTH_SIZE = struct.calcsize(STRING_LENGTH_FORMAT)
+
+DIRECTION_RECEIVED = 0
+DIRECTION_SENT = 1
+
+RECORD_TYPE_UPDATE = 0x00
+RECORD_TYPE_COMMAND = 0xFD
+RECORD_TYPE_RAW = 0xFE
+
+TEXT_NONE = 0xFFFFFFFF
+
+REPEAT_MAX = 0xFFFF
+
+JOURNAL_QUEUE_LIMIT = 10000
+JOURNAL_FLUSH_INTERVAL = 300.0
+
+
+def journal_paths(path):
+    return (path, path + '.str', path + '.idx')
+
+
+class JournalRecord:
+
+    def __init__(self, fields, text):
+        (self.time_ms, self.repeat, self.direction, self.record_type, self.partition,
+            self.beep, self.bitfield, self.zone, self.text_id) = fields
+        self.text = text
+
+    def timestamp(self):
+        return self.time_ms / 1000.0
+
+    def frame(self):
+        '''
+
+        Reconstructs the TPI line (or masked command) this record was encoded from.
+
+        '''
+        if self.direction == DIRECTION_SENT or self.record_type == RECORD_TYPE_RAW:
+            return self.text
+
+        if self.record_type == RECORD_TYPE_UPDATE:
+            return '%%00,%02d,%04X,%02d,%02d,%s$' % (self.partition, self.bitfield, self.zone, self.beep, self.text)
+
+        return '%%%02X,%s$' % (self.record_type, self.text)
+
+
+def encode_frame(line):
+    '''
+
+    Encodes a received TPI line into (type, partition, beep, bitfield, zone, text).
+    Lines that would not reconstruct byte-for-byte are kept whole as raw records.
+
+    '''
+    raw = (RECORD_TYPE_RAW, 0, 0, 0, 0, line)
+
+    if not line.startswith('%') or not line.endswith('$'):
+        return raw
+
+    fields = line[1:-1].split(',', 1)
+    if len(fields) != 2:
+        return raw
+
+    try:
+        record_type = int(fields[0], 16)
+
+        if record_type == RECORD_TYPE_UPDATE:
+            partition, bitfield, zone, beep, text = fields[1].split(',', 4)
+            encoded = (record_type, int(partition), int(beep), int(bitfield, 16), int(zone), text)
+        else:
+            encoded = (record_type, 0, 0, 0, 0, fields[1])
+
+        if record_type in (RECORD_TYPE_COMMAND, RECORD_TYPE_RAW):
+            return raw
+
+        # Every field must fit its slot in the fixed-width record
+        limits = (0xFF, 0xFF, 0xFF, 0xFFFF, 0xFFFF)
+        for value, limit in zip(encoded[:5], limits):
+            if value < 0 or value > limit:
+                return raw
+
+        record = JournalRecord((0, 0, DIRECTION_RECEIVED) + encoded[:5] + (0,), encoded[5])
+        if record.frame() != line:
+            return raw
+
+        return encoded
+    except (ValueError, OverflowError, struct.error):
+        return raw
+
+
+class AdemcoJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.records_path, self.strings_path, self.index_path = journal_paths(path)
+
+        self.secrets = []
+        self.dropped = 0
+        self.queue = Queue.Queue(JOURNAL_QUEUE_LIMIT)
+
+        self._open_files()
+
+        self.run = None
+        self.run_flushed_at = 0
+
+        self.thread = threading.Thread(target=self._run, name="ademco-journal")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _open_files(self):
+        # Rebuild the string table so ids keep pointing at the same text
+        self.strings = {}
+        strings_end = 0
+        if os.path.exists(self.strings_path):
+            strings, strings_end = read_string_table(self.strings_path)
+            for text in strings:
+                self.strings[text] = len(self.strings)
+
+        self.records_file = open(self.records_path, 'ab')
+        self.strings_file = open(self.strings_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+
+        # Drop a partially written trailing string and record left by a crash;
+        # new strings must start where the last complete one ends
+        if os.path.getsize(self.strings_path) > strings_end:
+            self.strings_file.truncate(strings_end)
+
+        size = os.path.getsize(self.records_path)
+        if size % RECORD_SIZE != 0:
+            self.records_file.truncate(size - size % RECORD_SIZE)
+        self.record_count = size / RECORD_SIZE
+
+        self._reconcile_index()
+
+    def _reconcile_index(self):
+        '''
+
+        Makes the index hold exactly one entry per INDEX_STRIDE records.
+        After a crash it can be torn, short of entries, or point past the
+        records that survived; it is then rebuilt from the records.
+
+        '''
+        expected = (self.record_count + INDEX_STRIDE - 1) / INDEX_STRIDE
+        if os.path.getsize(self.index_path) == expected * INDEX_SIZE:
+            return
+
+        logger.warning("Rebuilding journal index %s", self.index_path)
+        self.index_file.truncate(0)
+        with open(self.records_path, 'rb') as records_file:
+            for number in range(0, self.record_count, INDEX_STRIDE):
+                records_file.seek(number * RECORD_SIZE)
+                time_ms = struct.unpack(RECORD_FORMAT, records_file.read(RECORD_SIZE))[0]
+                self.index_file.write(struct.pack(INDEX_FORMAT, time_ms, number))
+        self.index_file.flush()
+
+    def add_secret(self, secret):
+        '''
+
+        Registers a keypad code that must never be written in sent commands.
+
+        '''
+        if secret and secret not in self.secrets:
+            self.secrets.append(secret)
+
+    def record_received(self, line):
+        self._enqueue(DIRECTION_RECEIVED, line)
+
+    def record_sent(self, command):
+        for secret in self.secrets:
+            command = command.replace(secret, '*' * len(secret))
+        self._enqueue(DIRECTION_SENT, command)
+
+    def _enqueue(self, direction, line):
+        # Called from the runloop: never block on disk
+        try:
+            self.queue.put_nowait((int(time.time() * 1000), direction, line))
+        except Queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=JOURNAL_FLUSH_INTERVAL)
+            except Queue.Empty:
+                item = ()
+
+            if item is None:
+                self._flush_run()
+                self._flush_files()
+                self.records_file.close()
+                self.strings_file.close()
+                self.index_file.close()
+                return
+
+            try:
+                if item:
+                    self._write(*item)
+
+                # Keep a long run of identical updates from living only in memory
+                if self.run is not None and time.time() - self.run_flushed_at > JOURNAL_FLUSH_INTERVAL:
+                    self._flush_run()
+
+                if self.queue.empty():
+                    self._flush_files()
+            except (IOError, OSError, struct.error) as e:
+                logger.warning("Journal write failed: %s", e)
+
+    def _write(self, time_ms, direction, line):
+        if direction == DIRECTION_SENT:
+            encoded = (RECORD_TYPE_COMMAND, 0, 0, 0, 0, line)
+        else:
+            encoded = encode_frame(line)
+
+        record_type, partition, beep, bitfield, zone, text = encoded
+        fields = [time_ms, 0, direction, record_type, partition, beep, bitfield, zone, self._intern(text)]
+
+        # Run-length encode consecutive identical keypad updates. The first
+        # frame of a run is written at once so changes are durable; repeats
+        # are folded into one continuation record per flush interval.
+        if self.run is not None:
+            if fields[2:] == self.run[2:]:
+                if self.run[1] is None:
+                    self.run[0] = time_ms
+                    self.run[1] = 0
+                else:
+                    self.run[1] += 1
+
+                if self.run[1] >= REPEAT_MAX:
+                    self._flush_run()
+                return
+
+            self._flush_run()
+            self.run = None
+
+        self._append(fields)
+
+        if record_type == RECORD_TYPE_UPDATE and direction == DIRECTION_RECEIVED:
+            self.run = list(fields)
+            self.run[1] = None
+            self.run_flushed_at = time.time()
+
+    def _flush_run(self):
+        # A record stands for repeat + 1 identical frames starting at its timestamp
+        if self.run is not None and self.run[1] is not None:
+            self._append(self.run)
+            self.run[1] = None
+            self.run_flushed_at = time.time()
+
+    def _append(self, fields):
+        if self.record_count % INDEX_STRIDE == 0:
+            self.index_file.write(struct.pack(INDEX_FORMAT, fields[0], self.record_count))
+
+        self.records_file.write(struct.pack(RECORD_FORMAT, *fields))
+        self.record_count += 1
+
+    def _intern(self, text):
+        if text is None:
+            return TEXT_NONE
+
+        try:
+            return self.strings[text]
+        except KeyError:
+            text_id = len(self.strings)
+            self.strings[text] = text_id
+            self.strings_file.write(struct.pack(STRING_LENGTH_FORMAT, len(text)) + text)
+            return text_id
+
+    def _flush_files(self):
+        # Strings first, so a record never refers to text that is not on disk
+        self.strings_file.flush()
+        self.records_file.flush()
+        self.index_file.flush()
+
+
+def read_string_table(path):
+    '''
+
+    Returns the complete strings in the file and the offset at which the
+    last of them ends; anything past it is a torn write.
+
+    '''
+    with open(path, 'rb') as strings_file:
+        data = strings_file.read()
+
+    strings = []
+    offset = 0
+    while offset + STRING_LENGTH_SIZE <= len(data):
+        length = struct.unpack_from(STRING_LENGTH_FORMAT, data, offset)[0]
+        if offset + STRING_LENGTH_SIZE + length > len(data):
+            break
+        offset += STRING_LENGTH_SIZE
+        strings.append(data[offset:offset + length])
+        offset += length
+
+    return (strings, offset)
+
+
+def read_strings(path):
+    return read_string_table(path)[0]
+
+
+def _map_file(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+
+    with open(path, 'rb') as mapped_file:
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class AdemcoJournalReader:
+
+    def __init__(self, path):
+        records_path, strings_path, index_path = journal_paths(path)
+
+        self.records = _map_file(records_path)
+        self.index = _map_file(index_path)
+        self.strings = read_strings(strings_path) if os.path.exists(strings_path) else []
+
+        self.record_count = len(self.records) / RECORD_SIZE if self.records is not None else 0
+        self.index_count = len(self.index) / INDEX_SIZE if self.index is not None else 0
+
+    def __len__(self):
+        return self.record_count
+
+    def fields(self, number):
+        return struct.unpack_from(RECORD_FORMAT, self.records, number * RECORD_SIZE)
+
+    def record(self, number):
+        fields = self.fields(number)
+        text_id = fields[-1]
+        text = self.strings[text_id] if text_id != TEXT_NONE else None
+        return JournalRecord(fields, text)
+
+    def seek(self, timestamp):
+        '''
+
+        Returns the number of the first record at or after timestamp (seconds).
+        Binary search over the mapped index, then a scan of one index stride.
+
+        '''
+        time_ms = int(timestamp * 1000)
+
+        low, high = 0, self.index_count
+        while low < high:
+            middle = (low + high) / 2
+            if struct.unpack_from(INDEX_FORMAT, self.index, middle * INDEX_SIZE)[0] < time_ms:
+                low = middle + 1
+            else:
+                high = middle
+
+        # The target lies after the last index entry below it
+        if low > 0:
+            number = struct.unpack_from(INDEX_FORMAT, self.index, (low - 1) * INDEX_SIZE)[1]
+        else:
+            number = 0
+
+        while number < self.record_count and self.fields(number)[0] < time_ms:
+            number += 1
+
+        return number
+
+    def iter_records(self, start=None, end=None):
+        number = self.seek(start) if start is not None else 0
+        end_ms = int(end * 1000) if end is not None else None
+
+        while number < self.record_count:
+            record = self.record(number)
+            if end_ms is not None and record.time_ms >= end_ms:
+                return
+            yield record
+            number += 1
+
+    def close(self):
+        for mapped in (self.records, self.index):
+            if mapped is not None:
+                mapped.close()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import resource
+import getopt
+import random
+import select
+import array
+import json
+import time
+import sys
+
+from ademco.server import AdemcoServer
+from ademco.connection import AdemcoServerConnection
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorLoop, AdemcoSimulatorPanel, alpha_text
+from ademco.soak import resident_memory
+from ademco.stats import summarize
+from ademco.common import QuietStderr
+
+LOADGEN_PASSWORD = "user"
+LOADGEN_STEPS = (10, 50, 100, 250, 500, 1000)
+LOADGEN_STEP_DURATION = 10.0
+LOADGEN_UPDATE_INTERVAL = 1.0
+
+# Average seconds between random zone or alarm events on each panel
+LOADGEN_ACTIVITY_INTERVAL = 20.0
+
+# Seconds spent draining frames queued during login before measuring
+LOADGEN_WARMUP = 2.0
+
+# Thousands of panels do not need the single-simulator 5 ms tick
+LOADGEN_TICK_INTERVAL = 0.05
+
+LOADGEN_ALPHA_PREFIX = "LOADGEN"
+
+
+def raise_file_limit():
+    '''
+
+    Raises the open file limit to the hard limit; each panel needs a
+    socket on both ends of the loopback connection plus a listener.
+
+    '''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, resource.error):
+            pass
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def update_sent_time(update):
+    '''
+
+    Returns the send time stamped into a load generator keypad update, or None.
+
+    '''
+    text = update.update_text()
+    if not text.startswith(LOADGEN_ALPHA_PREFIX):
+        return None
+    try:
+        return float(text[len(text) / 2:])
+    except ValueError:
+        return None
+
+
+class AdemcoLoadPanel(AdemcoSimulatorPanel):
+
+    def alpha(self, now):
+        # The send time lets the monitoring side measure event-to-handler latency
+        return alpha_text(LOADGEN_ALPHA_PREFIX, "%.4f" % time.time())
+
+
+class AdemcoLoadSimulator(AdemcoSimulator):
+
+    def __init__(self, seed, update_interval, activity_interval):
+        AdemcoSimulator.__init__(self, password=LOADGEN_PASSWORD, panel=AdemcoLoadPanel(),
+                                 update_interval=update_interval)
+        self.random = random.Random(seed)
+        self.activity_interval = activity_interval
+        self.last_tick = None
+
+    def _random_event(self, now):
+        panel = self.panel
+        choice = self.random.random()
+
+        if choice < 0.8:
+            zone = self.random.randint(1, 16)
+            if zone in panel.open_zones:
+                panel.open_zones.discard(zone)
+            else:
+                panel.open_zones.add(zone)
+        else:
+            panel.in_alarm = not panel.in_alarm
+            panel.alarm_in_memory = panel.alarm_in_memory or panel.in_alarm
+
+        self.broadcast_state(now)
+
+    def tick(self, now):
+        elapsed = now - self.last_tick if self.last_tick is not None else 0.0
+        self.last_tick = now
+
+        if self.random.random() < elapsed / self.activity_interval:
+            self._random_event(now)
+
+        AdemcoSimulator.tick(self, now)
+
+
+def run_fleet(count, update_interval, activity_interval, seed, pipe):
+    '''
+
+    Serves count simulated panels from one poll loop until told to stop.
+    Runs in its own process so its CPU time is kept apart from the monitor's.
+
+    '''
+    raise_file_limit()
+    generator = random.Random(seed)
+    loop = AdemcoSimulatorLoop(tick_interval=LOADGEN_TICK_INTERVAL)
+    addresses = []
+
+    for i in range(count):
+        # Spread the cadences so the panels do not all report in lockstep
+        interval = update_interval * (0.5 + generator.random())
+        simulator = AdemcoLoadSimulator(generator.random(), interval, activity_interval)
+        loop.add(simulator)
+        addresses.append(simulator.address)
+
+    pipe.send(addresses)
+    began = cpu_time()
+
+    while not pipe.poll():
+        loop.run_once()
+
+    pipe.recv()
+    pipe.send(cpu_time() - began)
+    loop.stop()
+
+
+class AdemcoLoadStep:
+
+    def __init__(self, count, duration, update_interval, activity_interval, seed):
+        self.count = count
+        self.duration = duration
+        self.update_interval = update_interval
+        self.activity_interval = activity_interval
+        self.seed = seed
+
+        self.servers = {}
+        self.frames = 0
+        self.disconnects = 0
+        self.latencies = array.array('d')
+        self.measure_from = None
+
+    def _observe(self, server):
+        def observer(version):
+            if server.state_update is None:
+                return
+            sent = update_sent_time(server.state_update)
+            # Frames queued while the fleet was still logging in are not a measure of load
+            if sent is not None and self.measure_from is not None and sent >= self.measure_from:
+                self.latencies.append(time.time() - sent)
+        return observer
+
+    def _connect(self, addresses):
+        for (host, port) in addresses:
+            server = AdemcoServer()
+            server.connect(host, port, LOADGEN_PASSWORD)
+            if server.connection_state() != AdemcoServerConnection.STATE_CONNECTED:
+                raise Exception("Could not log in to the simulated panel on port %d" % port)
+            server.add_state_observer(self._observe(server))
+            self.servers[server.connection.sock.fileno()] = server
+
+    def _drive(self, poller, duration):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            for fd, event in poller.poll(100):
+                server = self.servers[fd]
+
+                # The socket is readable, so the cycle does not wait
+                server.process_connection()
+                self.frames += len(server.connection.responses)
+                server.process_queue()
+
+                if server.connection_state() == AdemcoServerConnection.STATE_DISCONNECTED:
+                    poller.unregister(fd)
+                    del self.servers[fd]
+                    self.disconnects += 1
+
+    def run(self):
+        parent_pipe, child_pipe = multiprocessing.Pipe()
+        fleet = multiprocessing.Process(target=run_fleet, args=(self.count, self.update_interval,
+                                                                self.activity_interval, self.seed, child_pipe))
+        fleet.daemon = True
+        fleet.start()
+
+        try:
+            addresses = parent_pipe.recv()
+
+            memory_began = resident_memory()
+            with QuietStderr():
+                self._connect(addresses)
+            memory_per_panel = (resident_memory() - memory_began) / float(self.count)
+
+            poller = select.poll()
+            for fd in self.servers:
+                poller.register(fd, select.POLLIN)
+
+            with QuietStderr():
+                self._drive(poller, LOADGEN_WARMUP)
+                self.frames = 0
+                self.measure_from = time.time()
+
+                cpu_began = cpu_time()
+                wall_began = time.time()
+                self._drive(poller, self.duration)
+            elapsed = time.time() - wall_began
+            cpu = cpu_time() - cpu_began
+
+            parent_pipe.send("stop")
+            fleet_cpu = parent_pipe.recv()
+        finally:
+            for server in self.servers.values():
+                server.disconnect()
+            fleet.join(5.0)
+            if fleet.is_alive():
+                fleet.terminate()
+
+        return {
+            "panels": self.count,
+            "seconds": elapsed,
+            "frames": self.frames,
+            "frames-per-second": self.frames / elapsed,
+            "monitor-cpu-percent": cpu / elapsed * 100.0,
+            "cpu-ms-per-panel-second": cpu / elapsed / self.count * 1000.0,
+            "memory-bytes-per-panel": memory_per_panel,
+            "fleet-cpu-percent": fleet_cpu / elapsed * 100.0,
+            "disconnects": self.disconnects,
+            "latency-ms": summarize(self.latencies, scale=1000.0),
+        }
+
+
+class AdemcoLoadGenerator:
+
+    def __init__(self, steps=LOADGEN_STEPS, duration=LOADGEN_STEP_DURATION, update_interval=LOADGEN_UPDATE_INTERVAL,
+                 activity_interval=LOADGEN_ACTIVITY_INTERVAL, seed=1):
+        self.steps = steps
+        self.duration = duration
+        self.update_interval = update_interval
+        self.activity_interval = activity_interval
+        self.seed = seed
+
+    def run(self, progress=None):
+        '''
+
+        Runs one step per panel count and returns the capacity curve.
+        Stops early if a step cannot open its connections.
+
+        '''
+        file_limit = raise_file_limit()
+        curve = []
+
+        for count in self.steps:
+            if count + 16 > file_limit:
+                print >> sys.stderr, "[Warning] Skipping %d panels: the open file limit is %d" % (count, file_limit)
+                break
+
+            point = AdemcoLoadStep(count, self.duration, self.update_interval,
+                                   self.activity_interval, self.seed + count).run()
+            curve.append(point)
+            if progress is not None:
+                progress(point)
+
+        return curve
+
+
+def print_point(point):
+    latency = point["latency-ms"]
+    print "%7d %12.1f %10.1f %12.3f %14.0f %10.2f %10.2f %8d" % (
+        point["panels"], point["frames-per-second"], point["monitor-cpu-percent"], point["cpu-ms-per-panel-second"],
+        point["memory-bytes-per-panel"], latency.get("p50", 0.0), latency.get("p99", 0.0), point["disconnects"])
+    sys.stdout.flush()
+
+
+def usage(exit_code):
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Usage: %(script)s [-n count,count,...] [-d step_seconds] [-u update_interval] [-a activity_interval] [-S seed] [-o curve.json]" % {'script': sys.argv[0]}
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Monitors a growing fleet of simulated panels on loopback and reports frames/s,"
+    print >> sys.stderr, "CPU and memory per panel and event-to-handler latency at each fleet size."
+    sys.exit(exit_code)
+
+
+def main():
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:d:u:a:S:o:")
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(2)
+
+    steps = LOADGEN_STEPS
+    duration = LOADGEN_STEP_DURATION
+    update_interval = LOADGEN_UPDATE_INTERVAL
+    activity_interval = LOADGEN_ACTIVITY_INTERVAL
+    seed = 1
+    output_path = None
+
+    try:
+        for option, value in opts:
+            if option == "-n":
+                steps = [int(i) for i in value.split(',')]
+            elif option == "-d":
+                duration = float(value)
+            elif option == "-u":
+                update_interval = float(value)
+            elif option == "-a":
+                activity_interval = float(value)
+            elif option == "-S":
+                seed = int(value)
+            elif option == "-o":
+                output_path = value
+            else:
+                usage(2)
+    except ValueError as e:
+        print >> sys.stderr, "Error: " + str(e)
+        usage(2)
+
+    print "%7s %12s %10s %12s %14s %10s %10s %8s" % (
+        "panels", "frames/s", "cpu %", "cpu ms/p/s", "bytes/panel", "p50 ms", "p99 ms", "drops")
+
+    generator = AdemcoLoadGenerator(steps, duration, update_interval, activity_interval, seed)
+    curve = generator.run(progress=print_point)
+
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump({"time": time.time(), "update-interval": update_interval, "curve": curve},
+                      output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
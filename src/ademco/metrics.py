@@ -0,0 +1,127 @@
+import threading
+import bisect
+
+# Upper bounds in seconds: frame parsing is microseconds, logins and command confirmation are seconds
+HISTOGRAM_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+METRIC_COUNTER = "counter"
+METRIC_HISTOGRAM = "histogram"
+
+# Name, type, help text
+METRIC_DEFINITIONS = (
+    ("ademco_connect_seconds", METRIC_HISTOGRAM, "TPI connection setup time by stage (tcp, login)"),
+    ("ademco_connect_failures_total", METRIC_COUNTER, "Failed TPI connection attempts"),
+    ("ademco_disconnects_total", METRIC_COUNTER, "TPI sessions that ended"),
+    ("ademco_first_update_seconds", METRIC_HISTOGRAM, "Time from login to the first keypad update"),
+    ("ademco_update_interval_seconds", METRIC_HISTOGRAM, "Time between consecutive keypad updates"),
+    ("ademco_bytes_received_total", METRIC_COUNTER, "Bytes read from the TPI socket"),
+    ("ademco_frames_received_total", METRIC_COUNTER, "TPI frames received"),
+    ("ademco_frames_dropped_total", METRIC_COUNTER, "TPI frames dropped because the response queue was full"),
+    ("ademco_commands_sent_total", METRIC_COUNTER, "Keypad commands written to the TPI socket"),
+    ("ademco_command_confirm_seconds", METRIC_HISTOGRAM, "Time from sending a command to the panel showing its effect, by command"),
+    ("ademco_parse_seconds", METRIC_HISTOGRAM, "Time to parse one frame, by response type"),
+    ("ademco_parse_errors_total", METRIC_COUNTER, "Frames rejected by the parser"),
+    ("ademco_process_seconds", METRIC_HISTOGRAM, "Time to parse and apply one frame to the state, by response type"),
+    ("ademco_state_changes_total", METRIC_COUNTER, "Decoded state changes, by response type"),
+    ("ademco_callback_seconds", METRIC_HISTOGRAM, "Time an event callback took, by callback"),
+    ("ademco_callback_dropped_total", METRIC_COUNTER, "Events dropped because a callback's queue was full, by callback"),
+)
+
+
+class AdemcoMetrics:
+    '''
+
+    Counters and latency histograms for the hot paths. Callers check
+    enabled before timing anything, so a disabled registry costs one
+    attribute lookup per hook.
+
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.definitions = dict([(i[0], (i[1], i[2])) for i in METRIC_DEFINITIONS])
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then the sum
+                histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1) + [0.0]
+                self.histograms[key] = histogram
+            histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def counter_value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_count(self, name, **labels):
+        histogram = self.histograms.get((name, tuple(sorted(labels.items()))))
+        return sum(histogram[:-1]) if histogram is not None else 0
+
+    def render(self):
+        '''
+
+        Returns every metric in the Prometheus text exposition format.
+
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict([(i, list(j)) for (i, j) in self.histograms.items()])
+
+        lines = []
+        for name, metric_type, help_text in METRIC_DEFINITIONS:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+
+            if metric_type == METRIC_COUNTER:
+                for key in sorted([i for i in counters if i[0] == name]):
+                    lines.append("%s%s %s" % (name, format_labels(key[1]), format_value(counters[key])))
+                continue
+
+            for key in sorted([i for i in histograms if i[0] == name]):
+                histogram = histograms[key]
+                cumulative = 0
+                for bound, count in zip(HISTOGRAM_BUCKETS + (None,), histogram[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound is None else repr(bound)
+                    lines.append("%s_bucket%s %d" % (name, format_labels(key[1] + (("le", le),)), cumulative))
+                lines.append("%s_sum%s %s" % (name, format_labels(key[1]), format_value(histogram[-1])))
+                lines.append("%s_count%s %d" % (name, format_labels(key[1]), cumulative))
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = [(i, str(j).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (i, j) in labels]
+    return "{" + ",".join(['%s="%s"' % i for i in escaped]) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# Shared by the connection, parser and server; the serve command enables it
+METRICS = AdemcoMetrics()
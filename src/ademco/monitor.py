@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+from multiprocessing.pool import ThreadPool
+import logging
+import getopt
+import select
+import signal
+import threading
+import errno
+import json
+import sys
+
+from ademco.server import AdemcoServer
+from ademco.connection import AdemcoServerConnection
+from ademco.inventory import AdemcoInventory, AdemcoInventoryWatcher
+from ademco.checkpoint import AdemcoCheckpoint, CHECKPOINT_INTERVAL
+from ademco.common import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Logins block, so sessions are opened on a pool of this many threads, away from the poll loop
+MONITOR_CONNECT_WORKERS = 32
+
+# How long start() waits for the first logins
+MONITOR_START_TIMEOUT = 60.0
+
+MONITOR_RELOAD_INTERVAL = 2.0
+MONITOR_RECONNECT_INTERVAL = 30.0
+MONITOR_POLL_INTERVAL = 0.1
+MONITOR_STALENESS_INTERVAL = 1.0
+
+
+class AdemcoFleetMonitor:
+    '''
+
+    Keeps a TPI session open to every panel in an inventory, driven from
+    one thread with poll(). apply() moves the monitor to a new inventory,
+    opening and closing only the sessions whose panel was added, removed
+    or had its host, port or password changed. Every other session keeps
+    running with its state intact.
+
+    Logins run on a pool of connect_workers threads; run_once() picks up
+    the sessions that finished logging in, so a slow or unreachable host
+    never holds up the others.
+
+    With a checkpoint, each session starts from the panel's saved state,
+    and the state of panels without a session is kept until they return.
+
+    '''
+
+    def __init__(self, inventory=None, connect_workers=MONITOR_CONNECT_WORKERS, checkpoint=None):
+        self.inventory = inventory if inventory is not None else AdemcoInventory()
+        self.connect_workers = connect_workers
+        self.checkpoint = checkpoint
+        self.restored = {}
+        self.servers = {}
+        self.fds = {}
+        self.retry_at = {}
+        self.poller = select.poll()
+        self.pool = None
+        self.connecting = {}
+        self.connect_count = 0
+        self.logged_in = []
+        self.logged_in_lock = threading.Condition()
+        self.opened = 0
+        self.closed = 0
+
+    def _connect(self, panel, token, restored):
+        # Runs on the connect pool
+        server = AdemcoServer()
+        server.code = panel.get("code")
+        if restored is not None:
+            server.restore_checkpoint(restored)
+        try:
+            server.connect(panel["host"], panel["port"], panel["password"])
+        except Exception as e:
+            logger.warning("Could not log in to %s: %s", panel["id"], e)
+            server = None
+
+        with self.logged_in_lock:
+            self.logged_in.append((panel["id"], token, server))
+            self.logged_in_lock.notify_all()
+
+    def _open(self, panel_ids):
+        '''
+
+        Starts logging in to panel_ids on the connect pool.
+
+        '''
+        if len(panel_ids) == 0:
+            return
+
+        if self.pool is None:
+            self.pool = ThreadPool(self.connect_workers)
+
+        for panel_id in panel_ids:
+            self.retry_at.pop(panel_id, None)
+            self.connect_count += 1
+            self.connecting[panel_id] = self.connect_count
+            self.pool.apply_async(self._connect,
+                                  (self.inventory.get(panel_id), self.connect_count, self.restored.get(panel_id)))
+
+    def _register(self):
+        '''
+
+        Adds the sessions that finished logging in to the poll set.
+        Returns the number of logins handled.
+
+        '''
+        with self.logged_in_lock:
+            connected = self.logged_in
+            self.logged_in = []
+
+        now = monotonic()
+        for (panel_id, token, server) in connected:
+            if self.connecting.get(panel_id) != token:
+                # The panel was removed or changed while logging in
+                if server is not None and server.connection_state() == AdemcoServerConnection.STATE_CONNECTED:
+                    server.disconnect()
+                continue
+
+            del self.connecting[panel_id]
+            self.opened += 1
+            if server is None or server.connection_state() != AdemcoServerConnection.STATE_CONNECTED:
+                logger.warning("Could not log in to %s; retrying in %d s", panel_id, MONITOR_RECONNECT_INTERVAL)
+                self.retry_at[panel_id] = now + MONITOR_RECONNECT_INTERVAL
+                continue
+
+            fd = server.connection.sock.fileno()
+            self.servers[panel_id] = server
+            self.fds[fd] = panel_id
+            self.poller.register(fd, select.POLLIN)
+            self.restored.pop(panel_id, None)
+
+        return len(connected)
+
+    def _close(self, panel_id):
+        self.retry_at.pop(panel_id, None)
+        self.connecting.pop(panel_id, None)
+        self.restored.pop(panel_id, None)
+        server = self.servers.pop(panel_id, None)
+        if server is None:
+            return
+
+        fd = server.connection.sock.fileno()
+        if self.fds.get(fd) == panel_id:
+            del self.fds[fd]
+            self.poller.unregister(fd)
+        server.disconnect()
+        self.closed += 1
+
+    def _drop(self, fd):
+        # The panel ended the session; keep its last state and try again later
+        panel_id = self.fds.pop(fd)
+        self.poller.unregister(fd)
+        server = self.servers.pop(panel_id, None)
+        if server is not None and self.checkpoint is not None:
+            self.restored[panel_id] = server.checkpoint_state()
+        self.retry_at[panel_id] = monotonic() + MONITOR_RECONNECT_INTERVAL
+        logger.warning("Session to %s ended; retrying in %d s", panel_id, MONITOR_RECONNECT_INTERVAL)
+
+    def start(self, timeout=MONITOR_START_TIMEOUT):
+        '''
+
+        Logs in to every panel, waiting up to timeout seconds for the
+        logins to finish; the rest are picked up by run_once().
+
+        '''
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load()
+            self.restored = dict([(i, saved[i]) for i in self.inventory.order if i in saved])
+        self._open(list(self.inventory.order))
+
+        deadline = monotonic() + timeout
+        while len(self.connecting) > 0 and monotonic() < deadline:
+            with self.logged_in_lock:
+                if len(self.logged_in) == 0:
+                    self.logged_in_lock.wait(deadline - monotonic())
+            self._register()
+
+    def apply(self, inventory):
+        '''
+
+        Moves to inventory. Returns (added, removed, reconnect, updated)
+        as given by AdemcoInventory.diff.
+
+        '''
+        added, removed, reconnect, updated = self.inventory.diff(inventory)
+
+        for panel_id in removed + reconnect:
+            self._close(panel_id)
+
+        self.inventory = inventory
+
+        # Sessions that stay open pick up a changed code
+        for panel_id in updated:
+            if panel_id in self.servers:
+                self.servers[panel_id].code = inventory.get(panel_id).get("code")
+
+        self._open(added + reconnect)
+        return (added, removed, reconnect, updated)
+
+    def run_once(self, timeout=MONITOR_POLL_INTERVAL):
+        '''
+
+        Reads every session with data waiting, registers finished
+        logins, and reopens dropped sessions that are due. Returns the
+        number of sessions read.
+
+        '''
+        self._register()
+
+        try:
+            events = self.poller.poll(timeout * 1000)
+        except select.error as e:
+            # A signal (e.g. SIGUSR1) interrupted the wait
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+
+        for fd, event in events:
+            panel_id = self.fds.get(fd)
+            if panel_id is None:
+                continue
+
+            # The socket is readable, so the cycle does not wait
+            server = self.servers[panel_id]
+            server.process_connection()
+            server.process_queue()
+
+            if server.connection_state() == AdemcoServerConnection.STATE_DISCONNECTED:
+                self._drop(fd)
+
+        now = monotonic()
+        due = [i for (i, j) in self.retry_at.items()
+               if j <= now and self.inventory.get(i) is not None and i not in self.connecting]
+        if len(due) > 0:
+            self._open(due)
+
+        return len(events)
+
+    def check_staleness(self):
+        for server in self.servers.values():
+            server.check_staleness()
+
+    def snapshot(self, panels=None):
+        '''
+
+        Returns {id: state snapshot} for panels (default: all), with
+        "connected": False for panels without a session.
+
+        '''
+        panels = panels if panels is not None else self.inventory.panels()
+        snapshot = {}
+        for panel in panels:
+            server = self.servers.get(panel["id"])
+            if server is None:
+                snapshot[panel["id"]] = {"connected": False}
+                continue
+            state = server.state_snapshot()
+            state["connected"] = True
+            snapshot[panel["id"]] = state
+        return snapshot
+
+    def save_checkpoint(self):
+        '''
+
+        Saves the state of every panel in the inventory, whether or not
+        its session is open.
+
+        '''
+        if self.checkpoint is None:
+            return
+
+        panels = {}
+        for panel_id in self.inventory.order:
+            if panel_id in self.servers:
+                panels[panel_id] = self.servers[panel_id].checkpoint_state()
+            elif panel_id in self.restored:
+                panels[panel_id] = self.restored[panel_id]
+        self.checkpoint.save(panels)
+
+    def close(self):
+        for panel_id in list(self.servers) + list(self.connecting):
+            self._close(panel_id)
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self._register()
+
+
+def usage(exit_code):
+    print >> sys.stderr, "Usage: %s -i inventory_file [-r reload_interval] [-t tag] [-k checkpoint_file] [-v]" % sys.argv[0]
+    print >> sys.stderr, ""
+    print >> sys.stderr, "-i: JSON inventory of panels (id, host, port, password, code, partitions, tags)"
+    print >> sys.stderr, "-r: Seconds between checks of the inventory file for changes (default: %g)" % MONITOR_RELOAD_INTERVAL
+    print >> sys.stderr, "-t: With SIGUSR1, print only panels with this tag (repeatable)"
+    print >> sys.stderr, "-k: Save panel state to this file every %g s and on exit, and start from it" % CHECKPOINT_INTERVAL
+    print >> sys.stderr, "-v: Log sessions and reloads"
+    print >> sys.stderr, ""
+    print >> sys.stderr, "kill -USR1 <pid> prints the state of every panel as one JSON line."
+    sys.exit(exit_code)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:r:t:k:v")
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(1)
+
+    inventory_path = None
+    reload_interval = MONITOR_RELOAD_INTERVAL
+    tags = []
+    checkpoint = None
+    log_level = logging.WARNING
+
+    for option, value in opts:
+        if option == "-h":
+            usage(0)
+        elif option == "-i":
+            inventory_path = value
+        elif option == "-r":
+            reload_interval = float(value)
+        elif option == "-t":
+            tags.append(value)
+        elif option == "-k":
+            checkpoint = AdemcoCheckpoint(value)
+        elif option == "-v":
+            log_level = logging.INFO
+
+    if inventory_path is None:
+        usage(1)
+
+    logging.basicConfig(stream=sys.stderr, level=log_level, format="[%(levelname)s] %(message)s")
+
+    watcher = AdemcoInventoryWatcher(inventory_path)
+    try:
+        inventory = watcher.load()
+    except (IOError, ValueError) as e:
+        print >> sys.stderr, "Error: Failed to load %s: %s" % (inventory_path, e)
+        sys.exit(1)
+
+    monitor = AdemcoFleetMonitor(inventory, checkpoint=checkpoint)
+    monitor.start()
+    logger.info("Monitoring %d panels, %d connected", len(inventory), len(monitor.servers))
+
+    requested = []
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: requested.append(True))
+
+    # Deploys stop the monitor with SIGTERM; exit through the final checkpoint
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    next_reload = monotonic() + reload_interval
+    next_staleness_check = monotonic()
+    try:
+        while True:
+            monitor.run_once()
+
+            if monotonic() >= next_staleness_check:
+                next_staleness_check = monotonic() + MONITOR_STALENESS_INTERVAL
+                monitor.check_staleness()
+
+            if checkpoint is not None and checkpoint.due():
+                monitor.save_checkpoint()
+
+            if requested:
+                del requested[:]
+                print json.dumps(monitor.snapshot(monitor.inventory.tagged(*tags)), sort_keys=True)
+                sys.stdout.flush()
+
+            if monotonic() >= next_reload:
+                next_reload = monotonic() + reload_interval
+                try:
+                    changed = watcher.check()
+                except (IOError, ValueError) as e:
+                    logger.error("Keeping the current inventory; failed to load %s: %s", inventory_path, e)
+                    continue
+
+                if changed is not None:
+                    added, removed, reconnect, updated = monitor.apply(changed)
+                    logger.info("Reloaded inventory: %d added, %d removed, %d reconnected, %d updated",
+                                len(added), len(removed), len(reconnect), len(updated))
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.save_checkpoint()
+        monitor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import array
+import time
+
+from ademco.connection import AdemcoServerConnection
+from ademco.server import AdemcoServer
+from ademco.journal import AdemcoJournalReader, DIRECTION_RECEIVED
+from ademco.stats import summarize
+
+REPLAY_SPEED_MAX = None
+
+REPLAY_STAGES = ("read", "framing", "process")
+
+
+def parse_replay_speed(value):
+    '''
+
+    Parses a replay speed: "max" (as fast as possible), or a multiple of real time.
+
+    '''
+    if value in (None, "", "max"):
+        return REPLAY_SPEED_MAX
+
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise ValueError("Replay speed must be positive")
+    return speed
+
+
+class AdemcoReplayConnection(AdemcoServerConnection):
+
+    def __init__(self):
+        AdemcoServerConnection.__init__(self, None, None, None)
+        self.state = self.STATE_CONNECTED
+
+    def feed(self, data):
+        '''
+
+        Passes recorded bytes through the same framing as data read from the socket.
+
+        '''
+        self._receive_data(data)
+
+    def connection_cycle(self):
+        pass
+
+    def disconnect(self):
+        self.state = self.STATE_DISCONNECTED
+
+
+class AdemcoReplay:
+
+    def __init__(self, journal_path, speed=REPLAY_SPEED_MAX, server=None):
+        self.journal_path = journal_path
+        self.speed = speed
+
+        self.server = server if server is not None else AdemcoServer()
+        self.connection = AdemcoReplayConnection()
+        self.server.connection = self.connection
+
+        self.frames = 0
+        self.commands = 0
+        self.elapsed = 0.0
+        self.stage_times = dict([(i, array.array('d')) for i in REPLAY_STAGES])
+
+    def run(self, start=None, end=None):
+        '''
+
+        Feeds every received frame in [start, end) through the connection
+        framing and AdemcoServer.process_queue, pacing them by speed.
+
+        '''
+        reader = AdemcoJournalReader(self.journal_path)
+        records = reader.iter_records(start, end)
+        clock = time.time
+        first_record_time = None
+        began = clock()
+
+        try:
+            while True:
+                read_began = clock()
+                try:
+                    record = records.next()
+                except StopIteration:
+                    break
+
+                if record.direction != DIRECTION_RECEIVED:
+                    self.commands += 1
+                    continue
+
+                # A run-length encoded record stands for repeat + 1 frames
+                data = (record.frame() + '\r\n') * (record.repeat + 1)
+                read_time = clock() - read_began
+
+                if self.speed is not REPLAY_SPEED_MAX:
+                    if first_record_time is None:
+                        first_record_time = record.timestamp()
+                    due = began + (record.timestamp() - first_record_time) / self.speed
+                    delay = due - clock()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                framing_began = clock()
+                self.connection.feed(data)
+                process_began = clock()
+                self.server.process_queue()
+                process_ended = clock()
+
+                count = record.repeat + 1
+                self.frames += count
+                for i in xrange(count):
+                    self.stage_times["read"].append(read_time / count)
+                    self.stage_times["framing"].append((process_began - framing_began) / count)
+                    self.stage_times["process"].append((process_ended - process_began) / count)
+        finally:
+            reader.close()
+            self.elapsed = clock() - began
+
+        return self.report()
+
+    def report(self):
+        stages = dict([(i, summarize(self.stage_times[i], scale=1000000.0)) for i in REPLAY_STAGES])
+
+        return {
+            "frames": self.frames,
+            "commands": self.commands,
+            "elapsed-seconds": self.elapsed,
+            "frames-per-second": self.frames / self.elapsed if self.elapsed > 0 else None,
+            "stage-latency-us": stages,
+            "state-version": self.server.state_version,
+        }
@@ -1,5 +1,12 @@
 
-import sys
+import logging
+import time
+
+from ademco.metrics import METRICS
+from ademco.trace import TRACE, TRACE_REJECTED
+from ademco.alpha import ALPHA
+
+logger = logging.getLogger(__name__)
 
 def has_flag(bitfield, flag):
     return ((bitfield & flag) == flag)
@@ -44,6 +51,7 @@ class AdemcoResponse:
     UPDATE_FLAG_ARMED_STAY = 1 << 15
 
     # RESPONSE_ZONE_CHANGE
+    INDEX_ZONE_CHANGE_BITFIELD = 1
 
     # RESPONSE_PARTITION_STATE
     INDEX_PARTITION_STATE_VALUE = 1
@@ -59,15 +67,33 @@ class AdemcoResponse:
     PARTITION_STATE_ALARM = 8
     PARTITION_STATE_ALARM_IN_MEMORY = 9
 
+    PARTITION_STATE_NAMES = {
+        PARTITION_STATE_UNUSED: "unused",
+        PARTITION_STATE_READY: "ready",
+        PARTITION_STATE_READY_WITH_BYPASS: "ready-bypass",
+        PARTITION_STATE_NOTREADY: "not-ready",
+        PARTITION_STATE_ARMED_STAY: "armed-stay",
+        PARTITION_STATE_ARMED_AWAY: "armed-away",
+        PARTITION_STATE_ARMED_INSTANT: "armed-instant",
+        PARTITION_STATE_EXIT_DELAY: "exit-delay",
+        PARTITION_STATE_ALARM: "alarm",
+        PARTITION_STATE_ALARM_IN_MEMORY: "alarm-in-memory",
+    }
+
     # RESPONSE_CID_EVENT
 
     # RESPONSE_TIMER_DUMP
 
     LENGTH_UPDATE = 6
+    LENGTH_ZONE_CHANGE = 2
+    LENGTH_PARTITION_STATE = 2
 
     def __init__(self):
         self.response_data = None
 
+        # Monotonic time the frame was read from the socket
+        self.received_at = None
+
     def response_type(self):
         assert self.response_data is not None, "Method must be called after a successful -parse:"
 
@@ -114,6 +140,17 @@ class AdemcoResponse:
         assert self.response_type() == self.RESPONSE_UPDATE, "Method is only for update response types"
         return self.response_data[self.INDEX_UPDATE_ALPHA]
 
+    def update_alpha(self):
+        '''
+
+        Returns the alpha text classified into mode, zone, label, trouble
+        and countdown (see ademco.alpha.classify). The dict is shared and
+        must not be modified.
+
+        '''
+        assert self.response_type() == self.RESPONSE_UPDATE, "Method is only for update response types"
+        return ALPHA.classify(self.response_data[self.INDEX_UPDATE_ALPHA])
+
     def update_dict(self):
         assert self.response_type() == self.RESPONSE_UPDATE, "Method is only for update response types"
 
@@ -137,6 +174,7 @@ class AdemcoResponse:
             update_dict["arm-mode"] = "away"
             update_dict["armed"] = True
         elif has_flag(bitfield, self.UPDATE_FLAG_ARMED_STAY):
+            # Panels word night arming differently; any mention of NIGHT counts
             if "night" in self.update_text().lower():
                 update_dict["arm-mode"] = "night"
             else:
@@ -169,6 +207,41 @@ class AdemcoResponse:
 
         return update_dict
 
+    def zone_change_open_zones(self):
+        assert self.response_type() == self.RESPONSE_ZONE_CHANGE, "Method is only for zone change response types"
+
+        # Each byte of the field covers eight zones, least significant bit first
+        zone_field = self.response_data[self.INDEX_ZONE_CHANGE_BITFIELD]
+        open_zones = []
+
+        for byte_index in range(len(zone_field) / 2):
+            zone_byte = int(zone_field[byte_index * 2:byte_index * 2 + 2], 16)
+            for bit in range(8):
+                if has_flag(zone_byte, 1 << bit):
+                    open_zones.append(byte_index * 8 + bit + 1)
+
+        return open_zones
+
+    def partition_state_values(self):
+        assert self.response_type() == self.RESPONSE_PARTITION_STATE, "Method is only for partition state response types"
+
+        # Two hex digits per partition, partition 1 first
+        state_field = self.response_data[self.INDEX_PARTITION_STATE_VALUE]
+        states = {}
+
+        for index in range(len(state_field) / 2):
+            value = int(state_field[index * 2:index * 2 + 2], 16)
+            if value != self.PARTITION_STATE_UNUSED:
+                states[index + 1] = value
+
+        return states
+
+    def partition_state_dict(self):
+        assert self.response_type() == self.RESPONSE_PARTITION_STATE, "Method is only for partition state response types"
+
+        states = self.partition_state_values()
+        return dict([(str(i), self.PARTITION_STATE_NAMES.get(states[i], "unknown")) for i in states])
+
     def update_summary(self):
         assert self.response_type() == self.RESPONSE_UPDATE, "Method is only for update response types"
 
@@ -218,9 +291,26 @@ class AdemcoResponse:
 
     def parse(self, response_string):
 
+        if not METRICS.enabled:
+            return self._parse(response_string)
+
+        began = time.time()
+        parsed = self._parse(response_string)
+        elapsed = time.time() - began
+
+        if parsed:
+            METRICS.observe("ademco_parse_seconds", elapsed, type=self.response_data[self.INDEX_TYPE])
+        else:
+            METRICS.increment("ademco_parse_errors_total")
+
+        return parsed
+
+    def _parse(self, response_string):
+
         if not response_string.endswith('$') or not response_string.startswith('%'):
             if len(response_string) > 0:
-                print >> sys.stderr, "[Warning] Received invalid response: " + str(response_string)
+                logger.warning("Received invalid response: %r", response_string)
+                TRACE.record(TRACE_REJECTED, "invalid: %r", response_string)
             return False
 
         self.response_data = response_string[1:len(response_string) - 1].split(',')
@@ -229,29 +319,55 @@ class AdemcoResponse:
         if response_type == self.RESPONSE_UPDATE:
 
             # We have detected an update response. Ensure that it is the correct size.
-            if len(self.response_data) != self.LENGTH_UPDATE:
-                print >> sys.stderr, "[Warning] Received update, but invalid format: " + str(response_string)
+            try:
+                if len(self.response_data) != self.LENGTH_UPDATE:
+                    raise ValueError("unexpected field count")
+                self.bitfield_from_index(self.INDEX_UPDATE_STATE_BITFIELD)
+            except ValueError:
+                logger.warning("Received update, but invalid format: %r", response_string)
+                TRACE.record(TRACE_REJECTED, "update format: %r", response_string)
                 return False
 
-            print >> sys.stderr, "Update: " + self.update_text()
+            logger.debug("Update: %s", self.response_data[self.INDEX_UPDATE_ALPHA])
 
             return True
 
         elif response_type == self.RESPONSE_ZONE_CHANGE:
-            print >> sys.stderr, "Received zone change... but not handled yet"
+
+            try:
+                if len(self.response_data) != self.LENGTH_ZONE_CHANGE:
+                    raise ValueError("unexpected field count")
+                open_zones = self.zone_change_open_zones()
+            except ValueError:
+                logger.warning("Received zone change, but invalid format: %r", response_string)
+                TRACE.record(TRACE_REJECTED, "zone change format: %r", response_string)
+                return False
+
+            logger.debug("Zone change: open zones %s", open_zones)
             return True
 
         elif response_type == self.RESPONSE_PARTITION_STATE:
-            print >> sys.stderr, "Received partition state... but not handled yet"
+
+            try:
+                if len(self.response_data) != self.LENGTH_PARTITION_STATE:
+                    raise ValueError("unexpected field count")
+                partition_states = self.partition_state_dict()
+            except ValueError:
+                logger.warning("Received partition state, but invalid format: %r", response_string)
+                TRACE.record(TRACE_REJECTED, "partition state format: %r", response_string)
+                return False
+
+            logger.debug("Partition state: %s", partition_states)
             return True
 
         elif response_type == self.RESPONSE_CID_EVENT:
-            print >> sys.stderr, "Received CID event... but not handled yet"
+            logger.info("Received CID event... but not handled yet")
             return True
 
         elif response_type == self.RESPONSE_TIMER_DUMP:
-            print >> sys.stderr, "Received timer dump... but not handled yet"
+            logger.debug("Received timer dump... but not handled yet")
             return True
         else:
-            print >> sys.stderr, "[Warning] Received unknown response type: " + str(response_string)
+            logger.warning("Received unknown response type: %r", response_string)
+            TRACE.record(TRACE_REJECTED, "unknown type: %r", response_string)
             return False
\ No newline at end of file
@@ -0,0 +1,502 @@
+import collections
+import threading
+import logging
+import Queue
+import json
+import time
+import os
+
+from ademco.server import AdemcoServer
+from ademco.command import AdemcoCommandRun, status_dict, handler_update_received
+from ademco.command import EXIT_SUCCESS, EXIT_ALARM_NOT_READY, COMMAND_TIMEOUT
+from ademco.common import monotonic, RUNLOOP_INTERVAL_RAPID
+from ademco.response import AdemcoResponse
+from ezmobile.alarm import MobileAlarm, CommandNotDiscovered
+from ezmobile.cache import EZMobileDiscoveryCache, DISCOVERY_CACHE_PATH, DISCOVERY_CACHE_TTL
+import ezmobile.alarm
+
+logger = logging.getLogger(__name__)
+
+ROUTER_STATS_PATH = "envisakit-router-stats.json"
+
+# Outcomes kept per backend
+ROUTER_WINDOW = 32
+
+# A backend is unhealthy below this success rate, or after this many failures in a row...
+ROUTER_MIN_SUCCESS_RATE = 0.5
+ROUTER_MAX_CONSECUTIVE_FAILURES = 3
+
+# ... until it has rested this long, when it gets one more try
+ROUTER_RETRY_AFTER = 60.0
+
+STATUS_TIMEOUT = 15.0
+
+# How long a one-shot run waits for the losers of a status race, so their latency is recorded too
+ROUTER_SETTLE_TIMEOUT = 2.0
+
+BACKEND_TPI = "tpi"
+BACKEND_EZMOBILE = "ezmobile"
+
+# Every backend answers status with these keys, None where it cannot tell
+STATUS_FIELDS = ("ready", "armed", "arm-mode", "in_alarm", "alarm_in_memory", "fire", "chime", "faulted",
+                 "faulted-zone", "ac-present", "bypassed", "low-battery", "system-trouble", "stale", "provisional",
+                 "age-ms", "text")
+
+# Arm modes named in the EZMobile status text, checked in order
+EZMOBILE_ARM_MODES = ("night", "away", "stay", "instant", "max")
+
+
+def normalize_status(status):
+    return dict([(i, status.get(i)) for i in STATUS_FIELDS])
+
+
+class AdemcoBackendError(Exception):
+    '''
+
+    A backend failed to answer. issued is True if the command may have
+    reached the panel, in which case it must not be retried elsewhere.
+
+    '''
+
+    def __init__(self, message, issued=False):
+        Exception.__init__(self, message)
+        self.issued = issued
+
+
+class AdemcoPanelNotReady(AdemcoBackendError):
+    '''
+
+    The backend works, but the panel is not ready for the command. Other
+    backends would find the same panel, so it is not retried there.
+
+    '''
+    pass
+
+
+class AdemcoBackendStats:
+    '''
+
+    Rolling latency and success rate of one backend for one panel.
+    Latency is kept apart per operation ("status" or "command"), since a
+    confirmed command takes far longer than a status read; health counts
+    both.
+
+    '''
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.outcomes = collections.deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.last_failure = None
+
+    def record(self, ok, seconds, operation, now=None):
+        self.outcomes.append((bool(ok), seconds, operation))
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.last_failure = now if now is not None else time.time()
+
+    def success_rate(self):
+        if len(self.outcomes) == 0:
+            return None
+        return sum([1 for i in self.outcomes if i[0]]) / float(len(self.outcomes))
+
+    def latency(self, operation):
+        '''
+
+        Returns the mean latency of the recent successes of operation, or None.
+
+        '''
+        latencies = [i[1] for i in self.outcomes if i[0] and i[2] == operation]
+        if len(latencies) == 0:
+            return None
+        return sum(latencies) / len(latencies)
+
+    def is_healthy(self, now=None):
+        failing = self.consecutive_failures >= ROUTER_MAX_CONSECUTIVE_FAILURES or \
+            (self.success_rate() is not None and self.success_rate() < ROUTER_MIN_SUCCESS_RATE)
+        if not failing:
+            return True
+
+        now = now if now is not None else time.time()
+        return self.last_failure is None or now - self.last_failure >= ROUTER_RETRY_AFTER
+
+    def state(self):
+        return {
+            "outcomes": [list(i) for i in self.outcomes],
+            "consecutive-failures": self.consecutive_failures,
+            "last-failure": self.last_failure,
+        }
+
+    def restore(self, state):
+        try:
+            self.outcomes.extend([(bool(ok), float(seconds), str(operation)) for (ok, seconds, operation) in state["outcomes"]])
+            self.consecutive_failures = int(state["consecutive-failures"])
+            self.last_failure = state["last-failure"]
+        except (KeyError, TypeError, ValueError):
+            pass
+
+
+class AdemcoTPIBackend:
+    '''
+
+    The local Envisalink TPI. Each request holds the panel's single TPI
+    session only for as long as it takes.
+
+    '''
+
+    name = BACKEND_TPI
+
+    def __init__(self, host, port, password, journal=None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.journal = journal
+
+    def _run(self, command, code=None, parameter="", handler=None, timeout=None):
+        server = AdemcoServer()
+        server.code = code
+        server.config_param = parameter or ""
+        if self.journal is not None:
+            server.set_journal(self.journal)
+
+        server.connect(self.host, self.port, self.password)
+        run = AdemcoCommandRun(server, command, handler=handler, timeout=timeout)
+        try:
+            while run.step() is None:
+                time.sleep(RUNLOOP_INTERVAL_RAPID)
+        finally:
+            server.disconnect()
+
+        if run.result == EXIT_ALARM_NOT_READY and not run.issued:
+            raise AdemcoPanelNotReady(run.message)
+        if run.result != EXIT_SUCCESS:
+            raise AdemcoBackendError(run.message or "TPI exited with %d" % run.result, issued=run.issued)
+        return server
+
+    def status(self, timeout=STATUS_TIMEOUT):
+        server = self._run(AdemcoServer.COMMAND_STATUS, handler=handler_update_received, timeout=timeout)
+        status = status_dict(server)
+        status["text"] = server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE).update_text().strip()
+        return normalize_status(status)
+
+    def command(self, command, code, parameter="", timeout=COMMAND_TIMEOUT):
+        self._run(command, code, parameter, timeout=timeout)
+
+
+class AdemcoEZMobileBackend:
+    '''
+
+    The EZMOBILE web portal. Commands are confirmed by the portal
+    accepting the form, not by the panel.
+
+    '''
+
+    name = BACKEND_EZMOBILE
+
+    def __init__(self, url, mid, did, partition, discovery_cache=None):
+        self.alarm = MobileAlarm(url, mid, did, partition)
+        self.discovery_cache = discovery_cache
+        self.discovered = False
+        self.lock = threading.Lock()
+
+    def _discover(self):
+        with self.lock:
+            if self.discovered:
+                return
+
+            key = None
+            if self.discovery_cache is not None:
+                key = self.discovery_cache.key(self.alarm.url, self.alarm.mobileIdentifier,
+                                               self.alarm.deviceIdentifier, self.alarm.partition,
+                                               self.alarm.ignoreCommands)
+                if self.alarm.restore_discovery(self.discovery_cache.load(key)):
+                    self.discovered = True
+                    return
+
+            self.alarm.discover_all_commands()
+            if key is not None:
+                self.discovery_cache.store(key, self.alarm.discovery_state())
+            self.discovered = True
+
+    def status(self, timeout=STATUS_TIMEOUT):
+        try:
+            statuses = self.alarm._fetch_partition_page()
+        except Exception as e:
+            raise AdemcoBackendError("EZMobile status failed: %s" % e)
+
+        text = statuses.get(str(self.alarm.partition))
+        if text is None:
+            raise AdemcoBackendError("EZMobile has no partition %s" % self.alarm.partition)
+
+        armed = text.startswith("armed")
+        arm_mode = "disarmed"
+        if armed:
+            arm_mode = "armed"
+            for mode in EZMOBILE_ARM_MODES:
+                if mode in text:
+                    arm_mode = mode
+                    break
+
+        return normalize_status({
+            "armed": armed,
+            "arm-mode": arm_mode,
+            "ready": not armed and "ready" in text and "not ready" not in text,
+            "text": text,
+        })
+
+    def command(self, command, code, parameter="", timeout=COMMAND_TIMEOUT):
+        ezmobile_command = EZMOBILE_COMMAND_IDS.get(command)
+        if ezmobile_command is None:
+            raise AdemcoBackendError("EZMobile does not support command %d" % command)
+
+        try:
+            self._discover()
+        except Exception as e:
+            raise AdemcoBackendError("EZMobile discovery failed: %s" % e)
+
+        # The PIN goes into the pin field; a parameter fills whatever other field the form has
+        fields = {"pin": code}
+        if parameter:
+            for slot in self.alarm.commandFormSlots.get(ezmobile_command, []):
+                fields.setdefault(slot, parameter)
+
+        try:
+            response = self.alarm.issue(ezmobile_command, **fields)
+        except CommandNotDiscovered as e:
+            raise AdemcoBackendError(str(e))
+        except Exception as e:
+            raise AdemcoBackendError("EZMobile command failed: %s" % e, issued=True)
+
+        if response is None:
+            raise AdemcoBackendError("EZMobile command form could not be filled")
+
+
+# AdemcoServer command ID -> EZMobile command ID
+EZMOBILE_COMMAND_IDS = {
+    AdemcoServer.COMMAND_ARM_AWAY: ezmobile.alarm.COMMAND_ARM_AWAY,
+    AdemcoServer.COMMAND_ARM_STAY: ezmobile.alarm.COMMAND_ARM_STAY,
+    AdemcoServer.COMMAND_ARM_INSTANT: ezmobile.alarm.COMMAND_ARM_INSTANT,
+    AdemcoServer.COMMAND_ARM_MAX: ezmobile.alarm.COMMAND_ARM_MAX,
+    AdemcoServer.COMMAND_DISARM: ezmobile.alarm.COMMAND_DISARM,
+    AdemcoServer.COMMAND_BYPASS: ezmobile.alarm.COMMAND_BYPASS,
+    AdemcoServer.COMMAND_TOGGLE_CHIME: ezmobile.alarm.COMMAND_TOGGLE_CHIME,
+    AdemcoServer.COMMAND_TEST: ezmobile.alarm.COMMAND_TEST,
+}
+
+
+class AdemcoRouter:
+    '''
+
+    Sends status requests for one panel to the fastest healthy backend,
+    and commands to the first healthy backend in the order given,
+    falling back to the others when one fails before the command could
+    have reached the panel. Status, which is safe to send anywhere,
+    tries each backend with no latency on record first, in the order
+    given. Command latencies are not compared: the TPI waits for the
+    panel to confirm, while EZMobile only waits for the portal.
+
+    With race_status, status is asked of every healthy backend at once
+    and the first answer wins. panel names the panel in the saved stats.
+
+    '''
+
+    def __init__(self, backends, race_status=False, panel="default"):
+        self.backends = list(backends)
+        self.panel = panel
+        self.race_status = race_status
+        self.lock = threading.Lock()
+        self.stats = dict([(i.name, AdemcoBackendStats()) for i in self.backends])
+        self.racers = []
+
+    def ranked_backends(self, operation, now=None):
+        '''
+
+        Returns the backends, healthy ones first; for status the fastest
+        first, for commands in the order given.
+
+        '''
+        with self.lock:
+            ranks = []
+            for (index, backend) in enumerate(self.backends):
+                stats = self.stats[backend.name]
+                if operation == "status":
+                    latency = stats.latency(operation)
+                    ranks.append((not stats.is_healthy(now), latency is not None, latency, index, backend))
+                else:
+                    ranks.append((not stats.is_healthy(now), False, None, index, backend))
+
+        return [i[-1] for i in sorted(ranks)]
+
+    def _call(self, backend, method, *args):
+        began = monotonic()
+        try:
+            result = getattr(backend, method)(*args)
+        except AdemcoPanelNotReady:
+            self._record(backend, method, True, monotonic() - began)
+            raise
+        except AdemcoBackendError:
+            self._record(backend, method, False, monotonic() - began)
+            raise
+        except Exception as e:
+            self._record(backend, method, False, monotonic() - began)
+            raise AdemcoBackendError("%s failed: %s" % (backend.name, e))
+
+        self._record(backend, method, True, monotonic() - began)
+        return result
+
+    def _record(self, backend, operation, ok, seconds):
+        with self.lock:
+            self.stats[backend.name].record(ok, seconds, operation)
+        logger.info("%s %s %s in %.3f s", backend.name, operation, "answered" if ok else "failed", seconds)
+
+    def status(self, timeout=STATUS_TIMEOUT):
+        '''
+
+        Returns the panel status as a dict, with "backend" naming the
+        backend that answered. Raises AdemcoBackendError if none did.
+
+        '''
+        if self.race_status:
+            return self._race_status(timeout)
+
+        errors = []
+        for backend in self.ranked_backends("status"):
+            try:
+                status = self._call(backend, "status", timeout)
+            except AdemcoBackendError as e:
+                errors.append("%s: %s" % (backend.name, e))
+                continue
+            status["backend"] = backend.name
+            return status
+
+        raise AdemcoBackendError("; ".join(errors) or "No backends")
+
+    def _race_status(self, timeout):
+        ranked = self.ranked_backends("status")
+        backends = [i for i in ranked if self.stats[i.name].is_healthy()] or ranked
+        answers = Queue.Queue()
+
+        def ask(backend):
+            try:
+                answers.put((backend, self._call(backend, "status", timeout), None))
+            except AdemcoBackendError as e:
+                answers.put((backend, None, e))
+
+        # The losers keep running in the background, so their latency is still recorded
+        for backend in backends:
+            thread = threading.Thread(target=ask, args=(backend,))
+            thread.daemon = True
+            thread.start()
+            self.racers.append(thread)
+
+        errors = []
+        deadline = monotonic() + timeout
+        for i in range(len(backends)):
+            try:
+                backend, status, error = answers.get(timeout=max(0.0, deadline - monotonic()))
+            except Queue.Empty:
+                errors.append("no answer within %g seconds" % timeout)
+                break
+
+            if error is None:
+                status["backend"] = backend.name
+                return status
+            errors.append("%s: %s" % (backend.name, error))
+
+        raise AdemcoBackendError("; ".join(errors))
+
+    def settle(self, timeout=ROUTER_SETTLE_TIMEOUT):
+        '''
+
+        Waits up to timeout seconds for status races still running.
+
+        '''
+        deadline = monotonic() + timeout
+        for thread in self.racers:
+            thread.join(max(0.0, deadline - monotonic()))
+        self.racers = [i for i in self.racers if i.is_alive()]
+
+    def command(self, command, code, parameter="", timeout=COMMAND_TIMEOUT):
+        '''
+
+        Issues command through the first healthy backend. Returns the
+        name of the backend that carried it out.
+
+        '''
+        errors = []
+        for backend in self.ranked_backends("command"):
+            try:
+                self._call(backend, "command", command, code, parameter, timeout)
+            except AdemcoPanelNotReady:
+                raise
+            except AdemcoBackendError as e:
+                errors.append("%s: %s" % (backend.name, e))
+                if e.issued:
+                    # The panel may have acted on it; repeating it elsewhere is not safe
+                    raise AdemcoBackendError("; ".join(errors), issued=True)
+                continue
+            return backend.name
+
+        raise AdemcoBackendError("; ".join(errors) or "No backends")
+
+    def stats_state(self):
+        with self.lock:
+            return dict([(i, j.state()) for (i, j) in self.stats.items()])
+
+    def restore_stats(self, state):
+        with self.lock:
+            for (name, stats) in self.stats.items():
+                if isinstance(state, dict) and name in state:
+                    stats.restore(state[name])
+
+    def _read_stats(self, path):
+        try:
+            with open(path) as stats_file:
+                panels = json.load(stats_file)
+        except (IOError, ValueError):
+            return {}
+
+        return panels if isinstance(panels, dict) else {}
+
+    def load_stats(self, path=ROUTER_STATS_PATH):
+        '''
+
+        Restores the stats saved by save_stats, so that one-shot CLI runs
+        route on the history of earlier ones.
+
+        '''
+        self.restore_stats(self._read_stats(path).get(self.panel))
+
+    def save_stats(self, path=ROUTER_STATS_PATH):
+        panels = self._read_stats(path)
+        panels[self.panel] = self.stats_state()
+
+        temporary_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(temporary_path, "w") as stats_file:
+                json.dump(panels, stats_file)
+            os.rename(temporary_path, path)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save router stats to %s: %s", path, e)
+
+
+def build_router(host, port, password, ezmobile_config=None, race_status=False, journal=None):
+    '''
+
+    Builds a router over the TPI at host:port and, if ezmobile_config is
+    given, the EZMobile portal it describes ("mobile-url", "mid", "did",
+    "partition" and optionally "discovery-cache" and "discovery-ttl").
+
+    '''
+    backends = [AdemcoTPIBackend(host, port, password, journal)]
+
+    if ezmobile_config:
+        cache = None
+        cache_path = ezmobile_config.get("discovery-cache", DISCOVERY_CACHE_PATH)
+        if cache_path:
+            cache = EZMobileDiscoveryCache(cache_path, ezmobile_config.get("discovery-ttl", DISCOVERY_CACHE_TTL))
+        backends.append(AdemcoEZMobileBackend(ezmobile_config["mobile-url"], ezmobile_config["mid"],
+                                              ezmobile_config["did"], ezmobile_config["partition"], cache))
+
+    return AdemcoRouter(backends, race_status, panel="%s:%s" % (host, port))
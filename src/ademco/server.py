@@ -1,5 +1,16 @@
+import threading
+import logging
+import time
+
 from ademco.response import AdemcoResponse
 from ademco.connection import AdemcoServerConnection
+from ademco.metrics import METRICS
+from ademco.cadence import AdemcoUpdateCadence
+from ademco.alpha import AdemcoZoneDirectory
+from ademco.common import monotonic
+from ademco.trace import TRACE, TRACE_STATE, TRACE_EVENT
+
+logger = logging.getLogger(__name__)
 
 
 class AdemcoServer:
@@ -18,7 +29,10 @@ class AdemcoServer:
     COMMAND_ARM_MAX = 104
 
     COMMAND_STATUS = 200
+    COMMAND_SERVE = 201
     COMMAND_HELP = 202
+    COMMAND_HISTORY = 203
+    COMMAND_REPLAY = 204
     
     # Command ID, CLI command, Keypad command, Requires Parameter, Requires Ready
     ADEMCO_COMMANDS = (
@@ -33,25 +47,70 @@ class AdemcoServer:
         (COMMAND_ARM_INSTANT, "instant", "7", False, True),
         (COMMAND_ARM_MAX, "max", "4", False, True),
         (COMMAND_STATUS, "status", None, False, False),
+        (COMMAND_SERVE, "serve", None, False, False),
+        (COMMAND_HISTORY, "history", None, False, False),
+        (COMMAND_REPLAY, "replay", None, False, False),
         (COMMAND_HELP, "help", None, False, False),
     )
 
+    RESPONSE_HISTORY_LIMIT = 16
+
+    # Unsent commands older than this are not sent again after a restart
+    RESTORED_COMMAND_MAX_AGE = 20.0
+
     def __init__(self):
         self.code = None
         self.config_force = False
         self.config_use_json = False
         self.config_param = ""
+        self.config_confirm_exit_delay = True
+        self.journal = None
         self.responses = {}
         self.clear_responses()
 
+        # Decoded panel state, shared with readers on other threads
+        self.state_condition = threading.Condition()
+        self.state_version = 0
+        self.state_update = None
+        self.state_zones = []
+        self.state_partitions = {}
+        self.state_observers = []
+
+        # Zone labels learned from the keypad text
+        self.zone_labels = AdemcoZoneDirectory()
+        self.event_dispatcher = None
+
+        # Keypad updates arrive on a steady cadence; a long silence makes the state stale
+        self.update_cadence = AdemcoUpdateCadence()
+        self.state_stale = False
+
+        # State restored from a checkpoint stays provisional until a live keypad update arrives
+        self.state_provisional = False
+        self.restored_commands = []
+
+        # Stage start times, only tracked while metrics are enabled
+        self.first_update_since = None
+        self.command_pending = None
+
     def clear_responses(self):
         for rtype in AdemcoResponse.RESPONSE_TYPES:
             self.responses[rtype] = []
 
     def connect(self, host, port, password):
-        self.connection = AdemcoServerConnection(host, port, password)
+        self.connection = AdemcoServerConnection(host, port, password, journal=self.journal)
+        self.connection.command_sent = self.command_sent
         self.connection.connect()
 
+        if self.restored_commands and self.code is not None and \
+                self.connection.connection_state() == AdemcoServerConnection.STATE_CONNECTED:
+            for keys in self.restored_commands:
+                self.connection.add_command(self.code + keys)
+            TRACE.record(TRACE_EVENT, "requeued %d restored commands", len(self.restored_commands))
+            self.restored_commands = []
+
+        if METRICS.enabled and self.connection.connection_state() == AdemcoServerConnection.STATE_CONNECTED:
+            self.first_update_since = time.time()
+
     def disconnect(self):
         self.connection.disconnect()
 
@@ -65,6 +124,15 @@ class AdemcoServer:
     def set_code(self, code):
         self.code = code
 
+    def set_journal(self, journal):
+        '''
+
+        Records every received frame and sent command to journal.
+        Must be called before connect.
+
+        '''
+        self.journal = journal
+
     def connection_state(self):
         return self.connection.connection_state()
 
@@ -72,24 +140,350 @@ class AdemcoServer:
         if self.code is None:
             raise Exception("Alarm code not specified")
 
+        if self.journal is not None:
+            self.journal.add_secret(self.code)
+        TRACE.add_secret(self.code)
+
         commands = dict([(i[0], i[2]) for i in self.ADEMCO_COMMANDS])
-        self.connection.add_command(self.code + commands[command_id] + parameter)
+        keys = self.code + commands[command_id] + parameter
+        self.connection.add_command(keys)
+        TRACE.record(TRACE_EVENT, "issued command %d %s", command_id, parameter)
+
+        if METRICS.enabled and command_id in CONFIRMED_COMMANDS:
+            names = dict([(i[0], i[1]) for i in self.ADEMCO_COMMANDS])
+            chime = None
+            if self.state_update is not None:
+                chime = self.state_update.update_has_flags(AdemcoResponse.UPDATE_FLAG_CHIME)
+            self.command_pending = {"id": command_id, "name": names[command_id], "keys": keys,
+                                    "chime": chime, "sent_at": None}
+
+    def command_sent(self, keys):
+        '''
+
+        Called by the connection once keys have gone out to the panel;
+        the confirmation time of a pending command starts here.
+
+        '''
+        pending = self.command_pending
+        if pending is not None and pending["keys"] == keys and pending["sent_at"] is None:
+            pending["sent_at"] = monotonic()
 
     def process_connection(self):
         self.connection.connection_cycle()
 
     def process_queue(self):
         response_queue = self.connection.pop_responses()
+        received_at = self.connection.received_at
         for response in response_queue:
-            self._process_response(response)
+            self._process_response(response, received_at)
+
+    def _process_response(self, response, received_at=None):
 
-    def _process_response(self, response):
+        began = time.time() if METRICS.enabled else None
 
         response_obj = AdemcoResponse()
         if not response_obj.parse(response):
             return
 
-        self.responses[response_obj.response_type()].insert(0, response_obj)
+        response_obj.received_at = received_at if received_at is not None else monotonic()
+
+        # Only recent responses are kept; long-running modes would otherwise grow without bound
+        rtlist = self.responses[response_obj.response_type()]
+        rtlist.insert(0, response_obj)
+        del rtlist[self.RESPONSE_HISTORY_LIMIT:]
+
+        self._update_state(response_obj)
+
+        if began is not None:
+            METRICS.observe("ademco_process_seconds", time.time() - began, type=response_obj.response_type())
+
+    def _update_state(self, response_obj):
+
+        response_type = response_obj.response_type()
+        changed = False
+
+        with self.state_condition:
+
+            if response_type == AdemcoResponse.RESPONSE_UPDATE:
+                # Keypad updates repeat every few seconds; only a different frame is a change
+                if self.state_update is None or self.state_update.response_data != response_obj.response_data:
+                    changed = True
+                self.state_update = response_obj
+
+                if self.zone_labels.learn(response_obj.update_alpha()):
+                    changed = True
+
+                gap = self.update_cadence.observe(response_obj.received_at)
+                if gap is not None and METRICS.enabled:
+                    METRICS.observe("ademco_update_interval_seconds", gap)
+
+                if self.state_stale:
+                    self.state_stale = False
+                    changed = True
+
+                if self.state_provisional:
+                    self.state_provisional = False
+                    changed = True
+
+            elif response_type == AdemcoResponse.RESPONSE_ZONE_CHANGE:
+                open_zones = response_obj.zone_change_open_zones()
+                if open_zones != self.state_zones:
+                    self.state_zones = open_zones
+                    changed = True
+
+            elif response_type == AdemcoResponse.RESPONSE_PARTITION_STATE:
+                partitions = response_obj.partition_state_dict()
+                if partitions != self.state_partitions:
+                    self.state_partitions = partitions
+                    changed = True
+
+            if changed:
+                self.state_version += 1
+                self.state_condition.notify_all()
+
+            version = self.state_version
+
+        if METRICS.enabled:
+            self._observe_state_metrics(response_obj, changed)
+
+        if changed:
+            TRACE.record(TRACE_STATE, "version %d after %s", version, response_type)
+            self._notify_state_observers(version)
+
+    def _notify_state_observers(self, version):
+        # Observers run outside the lock so they may take a snapshot
+        for observer in self.state_observers:
+            try:
+                observer(version)
+            except Exception as e:
+                # A failing observer must not take the runloop down with it
+                logger.warning("State observer failed: %s", e, exc_info=True)
+
+    def check_staleness(self, now=None):
+        '''
+
+        Marks the state stale once keypad updates have been missing for
+        longer than the learned threshold. Call this from the runloop; a
+        silent panel produces no frames that would trigger it. Returns
+        True if the state is stale.
+
+        '''
+        with self.state_condition:
+            if self.state_stale or not self.update_cadence.is_stale(now):
+                return self.state_stale
+
+            self.state_stale = True
+            self.state_version += 1
+            self.state_condition.notify_all()
+            version = self.state_version
+
+        logger.warning("No keypad update for %.1f s; panel state is stale", self.update_cadence.age(now))
+        TRACE.record(TRACE_STATE, "version %d stale", version)
+        self._notify_state_observers(version)
+        return True
+
+    def update_age_ms(self, now=None):
+        '''
+
+        Returns the milliseconds since the last keypad update, or None.
+
+        '''
+        age = self.update_cadence.age(now)
+        return int(age * 1000) if age is not None else None
+
+    def _confirms_command(self, pending, response_obj):
+        '''
+
+        Returns True if response_obj shows the effect the command's
+        handler waits for: armed (or the start of the exit delay),
+        disarmed, bypassed, or the chime flipped.
+
+        '''
+        command_id = pending["id"]
+        response_type = response_obj.response_type()
+
+        if response_type == AdemcoResponse.RESPONSE_PARTITION_STATE:
+            return command_id in ARM_COMMANDS and self.config_confirm_exit_delay and \
+                AdemcoResponse.PARTITION_STATE_EXIT_DELAY in response_obj.partition_state_values().values()
+
+        if response_type != AdemcoResponse.RESPONSE_UPDATE:
+            return False
+
+        if command_id in ARM_COMMANDS:
+            return response_obj.update_is_armed()
+        elif command_id == self.COMMAND_DISARM:
+            return not response_obj.update_is_armed()
+        elif command_id == self.COMMAND_BYPASS:
+            return response_obj.update_is_bypass()
+        elif command_id == self.COMMAND_TOGGLE_CHIME:
+            return response_obj.update_has_flags(AdemcoResponse.UPDATE_FLAG_CHIME) != pending["chime"]
+        return False
+
+    def _observe_state_metrics(self, response_obj, changed):
+        response_type = response_obj.response_type()
+        now = time.time()
+
+        if response_type == AdemcoResponse.RESPONSE_UPDATE and self.first_update_since is not None:
+            METRICS.observe("ademco_first_update_seconds", now - self.first_update_since)
+            self.first_update_since = None
+
+        if changed:
+            METRICS.increment("ademco_state_changes_total", type=response_type)
+
+        # Timed from the send to the first frame received afterwards that shows the command took effect
+        pending = self.command_pending
+        if pending is not None and pending["sent_at"] is not None and \
+                response_obj.received_at >= pending["sent_at"] and self._confirms_command(pending, response_obj):
+            METRICS.observe("ademco_command_confirm_seconds", response_obj.received_at - pending["sent_at"],
+                            command=pending["name"])
+            self.command_pending = None
+
+    def add_state_observer(self, observer):
+        '''
+
+        Registers a callable that is invoked with the new state version
+        each time the decoded state changes. Observers run on the runloop,
+        so they must return quickly.
+
+        '''
+        self.state_observers.append(observer)
+
+    def add_event_callback(self, callback, **options):
+        '''
+
+        Registers a callable that is invoked with each AdemcoStateEvent on
+        a worker thread, so it may block. Keyword options are passed on to
+        AdemcoEventDispatcher.add_callback. Returns the callback's queue,
+        which reports its stats.
+
+        '''
+        if self.event_dispatcher is None:
+            # Imported on first use; the CLI never registers callbacks
+            from ademco.dispatch import AdemcoEventDispatcher
+            self.event_dispatcher = AdemcoEventDispatcher(self)
+            self.event_dispatcher.start()
+        return self.event_dispatcher.add_callback(callback, **options)
+
+    def state_snapshot(self):
+        '''
+
+        Returns the decoded panel state as a dict, along with the state
+        version it corresponds to. Safe to call from any thread.
+
+        '''
+        with self.state_condition:
+            if self.state_update is not None:
+                update = self.state_update.update_dict()
+                alpha = dict(self.state_update.update_alpha())
+            else:
+                update = None
+                alpha = None
+
+            return {
+                "version": self.state_version,
+                "update": update,
+                "alpha": alpha,
+                "zone-labels": self.zone_labels.state(),
+                "zones": {"open": list(self.state_zones)},
+                "partitions": dict(self.state_partitions),
+                "stale": self.state_stale,
+                "provisional": self.state_provisional,
+                "age-ms": self.update_age_ms(),
+            }
+
+    def checkpoint_state(self):
+        '''
+
+        Returns the decoded state and the commands not yet sent, as a dict
+        that can be written as JSON and passed to restore_checkpoint. The
+        keypad update is kept as its raw frame; the keypad code is left
+        out of the commands.
+
+        '''
+        pending = list(self.restored_commands)
+        connection = getattr(self, "connection", None)
+        if connection is not None and self.code is not None:
+            # The connection sends from the end of its list
+            pending += [i[len(self.code):] for i in reversed(connection.commands) if i.startswith(self.code)]
+
+        with self.state_condition:
+            if self.state_update is not None:
+                update = "%" + ",".join(self.state_update.response_data) + "$"
+            else:
+                update = None
+
+            return {
+                "saved-at": time.time(),
+                "update": update,
+                "update-age": self.update_cadence.age(),
+                "zones": list(self.state_zones),
+                "partitions": dict(self.state_partitions),
+                "zone-labels": self.zone_labels.state(),
+                "cadence": self.update_cadence.state(),
+                "commands": pending,
+            }
+
+    def restore_checkpoint(self, state):
+        '''
+
+        Loads what checkpoint_state returned, before connect. The state is
+        served as provisional until the first live keypad update replaces
+        it; it never counts as a response, so readiness checks and command
+        confirmations still wait for the panel. Restored zones and
+        partitions are kept until the panel reports them again.
+
+        '''
+        downtime = max(0.0, time.time() - state.get("saved-at", time.time()))
+
+        update = None
+        if state.get("update"):
+            update = AdemcoResponse()
+            if not update.parse(str(state["update"])) or update.response_type() != AdemcoResponse.RESPONSE_UPDATE:
+                update = None
+
+        with self.state_condition:
+            self.update_cadence.restore(state.get("cadence"))
+            self.zone_labels.restore(state.get("zone-labels"))
+
+            if update is not None:
+                age = (state.get("update-age") or 0.0) + downtime
+                update.received_at = monotonic() - age
+                self.update_cadence.last_update = update.received_at
+                self.state_update = update
+
+            self.state_zones = list(state.get("zones", []))
+            self.state_partitions = dict(state.get("partitions", {}))
+            self.state_provisional = True
+            self.state_version += 1
+            self.state_condition.notify_all()
+            version = self.state_version
+
+        if downtime <= self.RESTORED_COMMAND_MAX_AGE:
+            self.restored_commands = [str(i) for i in state.get("commands", [])]
+        elif state.get("commands"):
+            logger.warning("Dropping %d unsent commands from a checkpoint %.0f s old",
+                           len(state["commands"]), downtime)
+
+        TRACE.record(TRACE_STATE, "version %d restored from checkpoint", version)
+        self._notify_state_observers(version)
+
+    def wait_for_state_change(self, version, timeout):
+        '''
+
+        Blocks until the state version differs from version, or until
+        timeout seconds have passed. Returns the current state version.
+
+        '''
+        deadline = time.time() + timeout
+
+        with self.state_condition:
+            while self.state_version == version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.state_condition.wait(remaining)
+
+            return self.state_version
 
     def command_requires_parameter(self, command):
         requires_ready = dict([(i[0], i[3]) for i in self.ADEMCO_COMMANDS])
@@ -108,12 +502,10 @@ class AdemcoServer:
         else:
             return True
 
-            
-
-
-
-
-
-
 
+ARM_COMMANDS = (AdemcoServer.COMMAND_ARM_AWAY, AdemcoServer.COMMAND_ARM_STAY, AdemcoServer.COMMAND_ARM_NIGHT,
+                AdemcoServer.COMMAND_ARM_INSTANT, AdemcoServer.COMMAND_ARM_MAX)
 
+# Commands whose effect shows in the panel state, and so can be timed to confirmation
+CONFIRMED_COMMANDS = ARM_COMMANDS + (AdemcoServer.COMMAND_DISARM, AdemcoServer.COMMAND_BYPASS,
+                                     AdemcoServer.COMMAND_TOGGLE_CHIME)
@@ -0,0 +1,616 @@
+#!/usr/bin/env python
+
+import threading
+import getopt
+import heapq
+import random
+import select
+import socket
+import errno
+import time
+import sys
+
+from ademco.response import AdemcoResponse
+
+SIMULATOR_DEFAULT_HOST = "127.0.0.1"
+SIMULATOR_DEFAULT_PORT = 4025
+SIMULATOR_DEFAULT_PASSWORD = "user"
+SIMULATOR_DEFAULT_CODE = "1234"
+SIMULATOR_UPDATE_INTERVAL = 10.0
+SIMULATOR_SPLIT_INTERVAL = 0.005
+SIMULATOR_ZONE_COUNT = 64
+
+ALPHA_LENGTH = 32
+
+MALFORMED_LINES = (
+    "%00,01,ZZZZ,08,00,****DISARMED****  Ready to Arm  $",
+    "%00,01,1C08$",
+    "%01,ZZ$",
+    "%99,00$",
+    "00,01,1C08,08,00,no leading percent",
+    "\x00\xff garbage",
+)
+
+
+def alpha_text(top, bottom=""):
+    return (top.ljust(ALPHA_LENGTH / 2)[:ALPHA_LENGTH / 2] + bottom.ljust(ALPHA_LENGTH / 2))[:ALPHA_LENGTH]
+
+
+class AdemcoSimulatorFaults:
+
+    def __init__(self, latency=0.0, split=0, drop_after=None, malformed_rate=0.0, seed=None):
+        # Delay added before each outgoing line, in seconds
+        self.latency = latency
+        # Split each outgoing line into segments of this many bytes (0 disables)
+        self.split = split
+        # Close the connection after this many frames (None disables)
+        self.drop_after = drop_after
+        # Probability of sending a malformed line in place of a real frame
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+
+
+class AdemcoSimulatorPanel:
+
+    # Keypad command suffixes (after the code) and the arm state they select
+    ARM_COMMANDS = {
+        "2": AdemcoResponse.PARTITION_STATE_ARMED_AWAY,
+        "3": AdemcoResponse.PARTITION_STATE_ARMED_STAY,
+        "33": AdemcoResponse.PARTITION_STATE_ARMED_STAY,
+        "7": AdemcoResponse.PARTITION_STATE_ARMED_INSTANT,
+        "4": AdemcoResponse.PARTITION_STATE_ARMED_AWAY,
+    }
+
+    def __init__(self, code=SIMULATOR_DEFAULT_CODE, exit_delay=0.0):
+        self.code = code
+        self.exit_delay = exit_delay
+
+        self.ac_present = True
+        self.low_battery = False
+        self.chime = False
+        self.in_alarm = False
+        self.alarm_in_memory = False
+        self.open_zones = set()
+        self.bypassed_zones = set()
+
+        self.arm_state = None
+        self.arm_night = False
+        self.exit_delay_ends = None
+
+    def tick(self, now):
+        '''
+
+        Advances timed state. Returns True if the state changed.
+
+        '''
+        if self.exit_delay_ends is not None and now >= self.exit_delay_ends:
+            self.exit_delay_ends = None
+            return True
+        return False
+
+    def is_armed(self):
+        return self.arm_state is not None and self.exit_delay_ends is None
+
+    def is_ready(self):
+        return self.arm_state is None and len(self.open_zones - self.bypassed_zones) == 0
+
+    def handle_command(self, command, now):
+        '''
+
+        Applies a keypad command. Returns True if it changed the panel state.
+
+        '''
+        if not command.startswith(self.code):
+            return False
+
+        key = command[len(self.code):]
+
+        if key == "1":
+            self.arm_state = None
+            self.exit_delay_ends = None
+            self.in_alarm = False
+            self.bypassed_zones = set()
+            return True
+
+        elif key in self.ARM_COMMANDS:
+            if not self.is_ready():
+                return False
+            self.arm_state = self.ARM_COMMANDS[key]
+            self.arm_night = (key == "33")
+            if self.exit_delay > 0:
+                self.exit_delay_ends = now + self.exit_delay
+            return True
+
+        elif key.startswith("6") and len(key) > 1:
+            try:
+                self.bypassed_zones.add(int(key[1:]))
+            except ValueError:
+                return False
+            return True
+
+        elif key == "9":
+            self.chime = not self.chime
+            return True
+
+        return False
+
+    def bitfield(self):
+        bitfield = 0
+
+        if self.is_ready():
+            bitfield |= AdemcoResponse.UPDATE_FLAG_READY
+        if self.ac_present:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_AC_PRESENT
+        if self.low_battery:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_LOWBAT
+        if self.chime:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_CHIME
+        if self.in_alarm:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_IN_ALARM
+        if self.alarm_in_memory:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_ALARM_IN_MEMORY
+        if len(self.bypassed_zones) > 0:
+            bitfield |= AdemcoResponse.UPDATE_FLAG_BYPASS
+
+        if self.is_armed():
+            if self.arm_state == AdemcoResponse.PARTITION_STATE_ARMED_STAY:
+                bitfield |= AdemcoResponse.UPDATE_FLAG_ARMED_STAY
+            elif self.arm_state == AdemcoResponse.PARTITION_STATE_ARMED_AWAY:
+                bitfield |= AdemcoResponse.UPDATE_FLAG_ARMED_AWAY
+            else:
+                bitfield |= AdemcoResponse.UPDATE_FLAG_ARMED
+
+        return bitfield
+
+    def alpha(self, now):
+        if self.in_alarm:
+            return alpha_text("ALARM %02d" % min(self.open_zones or [0]))
+
+        if self.exit_delay_ends is not None:
+            remaining = int(self.exit_delay_ends - now + 0.999)
+            return alpha_text("ARMED ***AWAY***", "May Exit Now  %02d" % remaining)
+
+        if self.is_armed():
+            if self.arm_night:
+                return alpha_text("ARMED ***NIGHT**", "You may exit now")
+            elif self.arm_state == AdemcoResponse.PARTITION_STATE_ARMED_STAY:
+                return alpha_text("ARMED ***STAY***", "You may exit now")
+            return alpha_text("ARMED ***AWAY***", "You may exit now")
+
+        faulted = sorted(self.open_zones - self.bypassed_zones)
+        if len(faulted) > 0:
+            return alpha_text("FAULT %02d ZONE %d" % (faulted[0], faulted[0]))
+
+        if not self.ac_present:
+            return alpha_text("****DISARMED****", "AC LOSS")
+
+        return alpha_text("****DISARMED****", "  Ready to Arm")
+
+    def update_zone(self):
+        faulted = sorted(self.open_zones - self.bypassed_zones)
+        return faulted[0] if len(faulted) > 0 else 8
+
+    def partition_state(self):
+        if self.in_alarm:
+            return AdemcoResponse.PARTITION_STATE_ALARM
+        if self.exit_delay_ends is not None:
+            return AdemcoResponse.PARTITION_STATE_EXIT_DELAY
+        if self.arm_state is not None:
+            return self.arm_state
+        if self.alarm_in_memory:
+            return AdemcoResponse.PARTITION_STATE_ALARM_IN_MEMORY
+        if not self.is_ready():
+            return AdemcoResponse.PARTITION_STATE_NOTREADY
+        if len(self.bypassed_zones) > 0:
+            return AdemcoResponse.PARTITION_STATE_READY_WITH_BYPASS
+        return AdemcoResponse.PARTITION_STATE_READY
+
+    def update_frame(self, now):
+        return '%%00,01,%04X,%02d,00,%s$' % (self.bitfield(), self.update_zone(), self.alpha(now))
+
+    def zone_frame(self):
+        zone_bytes = [0] * (SIMULATOR_ZONE_COUNT / 8)
+        for zone in self.open_zones:
+            zone_bytes[(zone - 1) / 8] |= 1 << ((zone - 1) % 8)
+        return '%01,' + ''.join(['%02X' % i for i in zone_bytes]) + '$'
+
+    def partition_frame(self):
+        return '%%02,%02X00000000000000$' % self.partition_state()
+
+
+class AdemcoSimulatorSession:
+
+    STATE_LOGIN = 0
+    STATE_CONNECTED = 1
+    STATE_CLOSED = 2
+
+    def __init__(self, simulator, sock, now):
+        self.simulator = simulator
+        self.sock = sock
+        self.state = self.STATE_LOGIN
+        self.input_buffer = ''
+        self.outbox = []
+        self.scheduled = []
+        self.scheduled_count = 0
+        self.frames_sent = 0
+        self.next_update = now
+
+    def queue_line(self, line, now, frame=True):
+        faults = self.simulator.faults
+
+        if frame:
+            if faults.drop_after is not None and self.frames_sent >= faults.drop_after:
+                self.close()
+                return
+            self.frames_sent += 1
+
+            if faults.malformed_rate > 0 and faults.random.random() < faults.malformed_rate:
+                line = faults.random.choice(MALFORMED_LINES)
+
+        data = line + '\r\n'
+        due = now + faults.latency
+
+        # Push the line out in separate segments so the reader sees partial frames
+        if faults.split > 0:
+            for offset in range(0, len(data), faults.split):
+                self.outbox.append((due, data[offset:offset + faults.split]))
+                due += SIMULATOR_SPLIT_INTERVAL
+        else:
+            self.outbox.append((due, data))
+
+    def schedule(self, line, due):
+        # Kept apart from the outbox, so a line due later never holds back the ones queued after it
+        heapq.heappush(self.scheduled, (due, self.scheduled_count, line))
+        self.scheduled_count += 1
+
+    def release(self, now):
+        while len(self.scheduled) > 0 and self.scheduled[0][0] <= now and self.state == self.STATE_CONNECTED:
+            due, count, line = heapq.heappop(self.scheduled)
+            self.queue_line(self.simulator.script_frame(line, now), now)
+
+    def flush(self, now):
+        while len(self.outbox) > 0 and self.outbox[0][0] <= now and self.state != self.STATE_CLOSED:
+            due, data = self.outbox[0]
+            try:
+                sent = self.sock.send(data)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                self.close()
+                return
+
+            if sent < len(data):
+                self.outbox[0] = (due, data[sent:])
+                return
+            self.outbox.pop(0)
+
+    def handle_readable(self, now):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+
+        if len(data) == 0:
+            self.close()
+            return
+
+        lines = (self.input_buffer + data).split('\n')
+        self.input_buffer = lines.pop()
+
+        for line in lines:
+            self.handle_line(line.strip(), now)
+
+        # Answer straight away rather than on the next tick
+        self.flush(now)
+
+    def handle_line(self, line, now):
+        if self.state == self.STATE_LOGIN:
+            if line == self.simulator.password:
+                self.queue_line("OK", now, frame=False)
+                self.state = self.STATE_CONNECTED
+                self.simulator.session_logged_in(self, now)
+            else:
+                self.queue_line("FAILED", now, frame=False)
+                self.flush(now)
+                self.close()
+
+        elif self.state == self.STATE_CONNECTED and len(line) > 0:
+            self.simulator.handle_command(line, now)
+
+    def close(self):
+        if self.state != self.STATE_CLOSED:
+            self.state = self.STATE_CLOSED
+            self.simulator.session_closed(self)
+            self.sock.close()
+
+
+class AdemcoSimulator:
+
+    def __init__(self, host=SIMULATOR_DEFAULT_HOST, port=0, password=SIMULATOR_DEFAULT_PASSWORD,
+                 panel=None, faults=None, update_interval=SIMULATOR_UPDATE_INTERVAL, max_sessions=1):
+        self.password = password
+        self.panel = panel if panel is not None else AdemcoSimulatorPanel()
+        self.faults = faults if faults is not None else AdemcoSimulatorFaults()
+        self.update_interval = update_interval
+        self.max_sessions = max_sessions
+
+        self.sessions = []
+        self.script = []
+        self.commands = []
+        self.loop = None
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(128)
+        self.listener.setblocking(0)
+        self.address = self.listener.getsockname()
+
+    def add_script(self, delay, line):
+        '''
+
+        Schedules a line to be sent delay seconds after each login. A line of
+        "update", "zones" or "partitions" sends the corresponding current frame.
+
+        '''
+        self.script.append((delay, line))
+
+    def broadcast(self, line, now=None):
+        now = now if now is not None else time.time()
+        for session in list(self.sessions):
+            if session.state == session.STATE_CONNECTED:
+                session.queue_line(line, now)
+
+    def broadcast_state(self, now=None):
+        now = now if now is not None else time.time()
+        self.broadcast(self.panel.update_frame(now), now)
+        self.broadcast(self.panel.zone_frame(), now)
+        self.broadcast(self.panel.partition_frame(), now)
+
+    def handle_command(self, command, now):
+        self.commands.append(command)
+        if self.panel.handle_command(command, now):
+            self.broadcast_state(now)
+        else:
+            # The panel still answers with its current keypad state
+            self.broadcast(self.panel.update_frame(now), now)
+
+    def handle_accept(self, now):
+        try:
+            sock, address = self.listener.accept()
+        except socket.error:
+            return
+
+        # The Envisalink only offers a single TPI session
+        connected = len([i for i in self.sessions if i.state != i.STATE_CLOSED])
+        if connected >= self.max_sessions:
+            sock.close()
+            return
+
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = AdemcoSimulatorSession(self, sock, now)
+        self.sessions.append(session)
+        if self.loop is not None:
+            self.loop.register(session.sock, session)
+        session.queue_line("Login:", now, frame=False)
+        session.flush(now)
+
+    def script_frame(self, line, now):
+        frame = {
+            "update": lambda: self.panel.update_frame(now),
+            "zones": self.panel.zone_frame,
+            "partitions": self.panel.partition_frame,
+        }.get(line)
+        return frame() if frame is not None else line
+
+    def session_logged_in(self, session, now):
+        for (delay, line) in self.script:
+            session.schedule(line, now + delay)
+        session.release(now)
+        session.next_update = now + min(self.update_interval, 0.05)
+
+    def session_closed(self, session):
+        if session in self.sessions:
+            self.sessions.remove(session)
+        if self.loop is not None:
+            self.loop.unregister(session.sock)
+
+    def tick(self, now):
+        if self.panel.tick(now):
+            self.broadcast_state(now)
+
+        for session in list(self.sessions):
+            session.release(now)
+            if session.state == session.STATE_CONNECTED and now >= session.next_update:
+                session.queue_line(self.panel.update_frame(now), now)
+                session.next_update = now + self.update_interval
+            session.flush(now)
+
+    def start(self):
+        '''
+
+        Serves this simulator on a background thread. Returns the loop.
+
+        '''
+        loop = AdemcoSimulatorLoop()
+        loop.add(self)
+        loop.start()
+        return loop
+
+    def close(self):
+        for session in list(self.sessions):
+            session.close()
+        if self.loop is not None:
+            self.loop.unregister(self.listener)
+        self.listener.close()
+
+
+class AdemcoSimulatorLoop:
+
+    TICK_INTERVAL = 0.005
+
+    def __init__(self, tick_interval=TICK_INTERVAL):
+        self.tick_interval = tick_interval
+        self.last_tick = 0
+        self.poller = select.poll()
+        self.handlers = {}
+        self.simulators = []
+        self.running = False
+        self.thread = None
+        self.lock = threading.RLock()
+
+    def add(self, simulator):
+        with self.lock:
+            simulator.loop = self
+            self.simulators.append(simulator)
+            self.register(simulator.listener, simulator)
+
+    def register(self, sock, handler):
+        with self.lock:
+            self.handlers[sock.fileno()] = (sock, handler)
+            self.poller.register(sock.fileno(), select.POLLIN)
+
+    def unregister(self, sock):
+        with self.lock:
+            for fd, (registered, handler) in self.handlers.items():
+                if registered is sock:
+                    del self.handlers[fd]
+                    try:
+                        self.poller.unregister(fd)
+                    except KeyError:
+                        pass
+
+    def run_once(self, timeout=None):
+        timeout = timeout if timeout is not None else self.tick_interval
+        events = self.poller.poll(timeout * 1000)
+        now = time.time()
+
+        with self.lock:
+            for fd, event in events:
+                try:
+                    sock, handler = self.handlers[fd]
+                except KeyError:
+                    continue
+
+                if isinstance(handler, AdemcoSimulator):
+                    handler.handle_accept(now)
+                else:
+                    handler.handle_readable(now)
+
+            if now - self.last_tick >= self.tick_interval:
+                self.last_tick = now
+                for simulator in list(self.simulators):
+                    simulator.tick(now)
+
+    def run(self, duration=None):
+        self.running = True
+        deadline = time.time() + duration if duration is not None else None
+
+        while self.running and (deadline is None or time.time() < deadline):
+            self.run_once()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ademco-simulator")
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        with self.lock:
+            for simulator in list(self.simulators):
+                simulator.close()
+
+
+def load_script(simulator, path):
+    '''
+
+    Loads "DELAY LINE" pairs (seconds after login, then the line to send).
+
+    '''
+    with open(path) as script_file:
+        for line in script_file:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            delay, frame = line.split(None, 1)
+            simulator.add_script(float(delay), frame)
+
+
+def usage(exit_code):
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Usage: %(script)s [-l [host:]port] [-P password] [-p PIN] [-u update_interval] [-e exit_delay]" % {'script': sys.argv[0]}
+    print >> sys.stderr, "       [-s script_file] [--latency=SECONDS] [--split=BYTES] [--drop-after=FRAMES] [--malformed=RATE] [--seed=N]"
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Runs a local Envisalink TPI stand-in for testing and benchmarks."
+    sys.exit(exit_code)
+
+
+def main():
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hl:P:p:u:e:s:", ["latency=", "split=", "drop-after=", "malformed=", "seed="])
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(1)
+
+    host, port = SIMULATOR_DEFAULT_HOST, SIMULATOR_DEFAULT_PORT
+    password = SIMULATOR_DEFAULT_PASSWORD
+    panel = AdemcoSimulatorPanel()
+    faults = AdemcoSimulatorFaults()
+    update_interval = SIMULATOR_UPDATE_INTERVAL
+    script_path = None
+
+    try:
+        for option, value in opts:
+            if option == "-l":
+                if ':' in value:
+                    host, value = value.rsplit(':', 1)
+                port = int(value)
+            elif option == "-P":
+                password = value
+            elif option == "-p":
+                panel.code = value
+            elif option == "-u":
+                update_interval = float(value)
+            elif option == "-e":
+                panel.exit_delay = float(value)
+            elif option == "-s":
+                script_path = value
+            elif option == "--latency":
+                faults.latency = float(value)
+            elif option == "--split":
+                faults.split = int(value)
+            elif option == "--drop-after":
+                faults.drop_after = int(value)
+            elif option == "--malformed":
+                faults.malformed_rate = float(value)
+            elif option == "--seed":
+                faults.random.seed(int(value))
+            else:
+                usage(1)
+    except ValueError as e:
+        print >> sys.stderr, "Error: " + str(e)
+        usage(1)
+
+    simulator = AdemcoSimulator(host, port, password, panel, faults, update_interval)
+    if script_path is not None:
+        load_script(simulator, script_path)
+
+    print >> sys.stderr, "Simulating Envisalink TPI on %s:%d" % simulator.address
+
+    loop = AdemcoSimulatorLoop()
+    loop.add(simulator)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        loop.stop()
+
+
+if __name__ == "__main__":
+    main()
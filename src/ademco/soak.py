@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+import collections
+import resource
+import getopt
+import random
+import array
+import json
+import time
+import sys
+import gc
+import os
+
+from ademco.server import AdemcoServer
+from ademco.replay import AdemcoReplayConnection
+from ademco.events import AdemcoEventBroker
+from ademco.simulator import AdemcoSimulatorPanel
+from ademco.stats import summarize
+from ademco.common import QuietStderr
+
+SOAK_UPDATE_INTERVAL = 10.0
+SOAK_SECONDS_PER_DAY = 86400
+
+# Average seconds between random panel events in simulated time
+SOAK_EVENT_INTERVAL = 600.0
+
+SOAK_WARMUP_FRACTION = 0.25
+SOAK_RSS_TOLERANCE = 2 * 1024 * 1024
+SOAK_OBJECT_TOLERANCE = 2000
+SOAK_LATENCY_TOLERANCE = 0.5
+
+
+def resident_memory():
+    '''
+
+    Returns the resident set size in bytes.
+
+    '''
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        # Peak rather than current, but still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def object_counts():
+    counts = collections.defaultdict(int)
+    for obj in gc.get_objects():
+        counts[type(obj).__name__] += 1
+    return counts
+
+
+def slope(values):
+    '''
+
+    Least-squares slope of values against their index.
+
+    '''
+    count = len(values)
+    if count < 2:
+        return 0.0
+
+    mean_x = (count - 1) / 2.0
+    mean_y = float(sum(values)) / count
+    numerator = sum([(i - mean_x) * (values[i] - mean_y) for i in range(count)])
+    denominator = sum([(i - mean_x) ** 2 for i in range(count)])
+    return numerator / denominator
+
+
+class AdemcoTrafficGenerator:
+
+    def __init__(self, seed=None, update_interval=SOAK_UPDATE_INTERVAL, event_interval=SOAK_EVENT_INTERVAL):
+        self.random = random.Random(seed)
+        self.panel = AdemcoSimulatorPanel()
+        self.update_interval = update_interval
+        self.event_interval = event_interval
+
+    def _random_event(self, now):
+        panel = self.panel
+        choice = self.random.random()
+
+        if choice < 0.3:
+            zone = self.random.randint(1, 16)
+            if zone in panel.open_zones:
+                panel.open_zones.discard(zone)
+            else:
+                panel.open_zones.add(zone)
+        elif choice < 0.5:
+            panel.handle_command(panel.code + ("1" if panel.arm_state is not None else "2"), now)
+        elif choice < 0.6:
+            panel.ac_present = not panel.ac_present
+        elif choice < 0.65:
+            panel.low_battery = not panel.low_battery
+        elif choice < 0.7:
+            return ['%%03,%d%03d%02d%03d$' % (1, 602, 0, 0)]
+        else:
+            panel.handle_command(panel.code + "9", now)
+
+        return [panel.zone_frame(), panel.partition_frame()]
+
+    def frames(self, duration):
+        '''
+
+        Yields (simulated time, frames) for duration simulated seconds: a
+        keypad update every update_interval plus random panel activity.
+
+        '''
+        now = 0.0
+        while now < duration:
+            frames = []
+            if self.random.random() < self.update_interval / self.event_interval:
+                frames.extend(self._random_event(now))
+            self.panel.tick(now)
+            frames.append(self.panel.update_frame(now))
+            yield now, frames
+            now += self.update_interval
+
+
+class AdemcoSoak:
+
+    def __init__(self, days, samples=20, seed=1):
+        self.duration = days * SOAK_SECONDS_PER_DAY
+        self.sample_count = samples
+        self.generator = AdemcoTrafficGenerator(seed)
+
+        self.server = AdemcoServer()
+        self.connection = AdemcoReplayConnection()
+        self.server.connection = self.connection
+
+        # A subscriber that is only drained at each sample stands in for a slow client
+        self.broker = AdemcoEventBroker(self.server)
+        self.subscriber = self.broker.subscribe()
+
+        self.samples = []
+
+    def _sample(self, simulated, frames, latencies):
+        gc.collect()
+        counts = object_counts()
+
+        while self.subscriber.pop(0) is not None:
+            pass
+
+        sample = {
+            "simulated-hours": simulated / 3600.0,
+            "frames": frames,
+            "rss": resident_memory(),
+            "objects": sum(counts.values()),
+            "object-types": counts,
+            "latency-us": summarize(latencies, scale=1000000.0),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def run(self):
+        clock = time.time
+        sample_every = self.duration / self.sample_count
+        next_sample = sample_every
+        latencies = array.array('d')
+        frames = 0
+        began = clock()
+
+        with QuietStderr():
+            for simulated, batch in self.generator.frames(self.duration):
+                data = ''.join([i + '\r\n' for i in batch])
+
+                frame_began = clock()
+                self.connection.feed(data)
+                self.server.process_queue()
+                latencies.append((clock() - frame_began) / len(batch))
+                frames += len(batch)
+
+                if simulated >= next_sample:
+                    self._sample(simulated, frames, latencies)
+                    latencies = array.array('d')
+                    next_sample += sample_every
+
+        self.frames = frames
+        self.elapsed = clock() - began
+        return self.report()
+
+    def report(self):
+        evaluated = self.samples[int(len(self.samples) * SOAK_WARMUP_FRACTION):]
+        failures = []
+
+        rss = [i["rss"] for i in evaluated]
+        rss_growth = slope(rss) * (len(rss) - 1)
+        if rss_growth > max(SOAK_RSS_TOLERANCE, rss[0] * 0.05 if rss else 0):
+            failures.append("RSS grows by %d bytes over the run" % rss_growth)
+
+        objects = [i["objects"] for i in evaluated]
+        object_growth = slope(objects) * (len(objects) - 1)
+        if object_growth > SOAK_OBJECT_TOLERANCE:
+            failures.append("Object count grows by %d over the run" % object_growth)
+
+        p99 = [i["latency-us"].get("p99", 0.0) for i in evaluated]
+        p99_median = sorted(p99)[len(p99) / 2] if p99 else 0.0
+        p99_growth = slope(p99) * (len(p99) - 1)
+        if p99_median > 0 and p99_growth / p99_median > SOAK_LATENCY_TOLERANCE:
+            failures.append("p99 frame latency grows by %.1f us (median %.1f us)" % (p99_growth, p99_median))
+
+        # The types whose counts moved the most between the first and last evaluated sample
+        growing = []
+        if len(evaluated) >= 2:
+            first, last = evaluated[0]["object-types"], evaluated[-1]["object-types"]
+            growing = sorted([(last[i] - first.get(i, 0), i) for i in last], reverse=True)[:10]
+
+        return {
+            "simulated-days": self.duration / float(SOAK_SECONDS_PER_DAY),
+            "elapsed-seconds": self.elapsed,
+            "frames": self.frames,
+            "rss-growth-bytes": rss_growth,
+            "object-growth": object_growth,
+            "p99-growth-us": p99_growth,
+            "growing-types": [{"type": i[1], "growth": i[0]} for i in growing],
+            "samples": [dict([(k, v) for (k, v) in i.items() if k != "object-types"]) for i in self.samples],
+            "failures": failures,
+        }
+
+
+def usage(exit_code):
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Usage: %(script)s [-d days] [-s samples] [-S seed] [-o report.json]" % {'script': sys.argv[0]}
+    print >> sys.stderr, ""
+    print >> sys.stderr, "Drives an AdemcoServer with days of synthetic TPI traffic in compressed time and"
+    print >> sys.stderr, "fails (exit 1) if memory, object counts or p99 frame latency trend upward."
+    sys.exit(exit_code)
+
+
+def main():
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hd:s:S:o:")
+    except getopt.GetoptError as err:
+        print >> sys.stderr, str(err)
+        usage(2)
+
+    days = 7.0
+    samples = 20
+    seed = 1
+    output_path = None
+
+    try:
+        for option, value in opts:
+            if option == "-d":
+                days = float(value)
+            elif option == "-s":
+                samples = int(value)
+            elif option == "-S":
+                seed = int(value)
+            elif option == "-o":
+                output_path = value
+            else:
+                usage(2)
+    except ValueError as e:
+        print >> sys.stderr, "Error: " + str(e)
+        usage(2)
+
+    report = AdemcoSoak(days, samples, seed).run()
+
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    print "Simulated %.1f days (%d frames) in %.1f s" % (report["simulated-days"], report["frames"], report["elapsed-seconds"])
+    print "RSS growth: %d bytes, object growth: %d, p99 growth: %.1f us" % (
+        report["rss-growth-bytes"], report["object-growth"], report["p99-growth-us"])
+
+    for failure in report["failures"]:
+        print >> sys.stderr, "[Failure] " + failure
+
+    sys.exit(1 if len(report["failures"]) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+def percentile(sorted_values, fraction):
+    '''
+
+    Returns the value at fraction (0.0 - 1.0) of an already sorted sequence,
+    or None if it is empty.
+
+    '''
+    if len(sorted_values) == 0:
+        return None
+
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(values, scale=1.0):
+    '''
+
+    Returns count, mean and percentile statistics for a sequence of samples,
+    each multiplied by scale (e.g. 1000.0 to report seconds as milliseconds).
+
+    '''
+    ordered = sorted(values)
+    count = len(ordered)
+
+    if count == 0:
+        return {"count": 0}
+
+    return {
+        "count": count,
+        "mean": sum(ordered) / count * scale,
+        "p50": percentile(ordered, 0.50) * scale,
+        "p90": percentile(ordered, 0.90) * scale,
+        "p99": percentile(ordered, 0.99) * scale,
+        "max": ordered[-1] * scale,
+    }
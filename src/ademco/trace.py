@@ -0,0 +1,87 @@
+import collections
+import threading
+import logging
+import time
+import sys
+
+TRACE_BUFFER_SIZE = 1024
+
+# Each connection also keeps its own short ring, so a failure shows only that panel's traffic
+TRACE_SESSION_SIZE = 128
+
+TRACE_RECEIVED = "recv"
+TRACE_SENT = "sent"
+TRACE_REJECTED = "reject"
+TRACE_STATE = "state"
+TRACE_EVENT = "event"
+
+
+class AdemcoTrace:
+    '''
+
+    A fixed-size ring of recent raw frames and decisions. Recording only
+    appends a tuple; nothing is formatted until the ring is dumped, so
+    text may be a %-format string with its arguments passed separately.
+
+    '''
+
+    def __init__(self, size=TRACE_BUFFER_SIZE, secrets=None):
+        self.records = collections.deque(maxlen=size)
+        self.secrets = secrets if secrets is not None else set()
+        self.dump_lock = threading.Lock()
+
+    def add_secret(self, secret):
+        '''
+
+        Masks secret (e.g. the alarm code) wherever it appears in a dump.
+
+        '''
+        if secret:
+            self.secrets.add(secret)
+
+    def record(self, kind, text, *args):
+        self.records.append((time.time(), kind, text, args))
+
+    def clear(self):
+        self.records.clear()
+
+    def mask(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, '*' * len(secret))
+        return text
+
+    def lines(self):
+        lines = []
+        for (timestamp, kind, text, args) in list(self.records):
+            text = self.mask(text % args if args else str(text))
+            lines.append("%s.%03d %-6s %s" % (time.strftime("%H:%M:%S", time.localtime(timestamp)),
+                                               int(timestamp * 1000) % 1000, kind, text))
+        return lines
+
+    def dump(self, stream=None, reason=None):
+        '''
+
+        Writes the ring to stream (stderr by default), oldest first.
+
+        '''
+        stream = stream if stream is not None else sys.stderr
+        with self.dump_lock:
+            stream.write("--- Trace: %d records%s ---\n" % (len(self.records), (" (%s)" % reason) if reason else ""))
+            for line in self.lines():
+                stream.write(line + "\n")
+            stream.write("--- End of trace ---\n")
+            stream.flush()
+
+    def log(self, logger, reason, level=logging.ERROR):
+        '''
+
+        Writes the ring to logger as a single record at level.
+
+        '''
+        if not logger.isEnabledFor(level):
+            return
+        logger.log(level, "Trace (%s), %d records:\n%s", reason, len(self.records), "\n".join(self.lines()))
+
+
+# Shared by the connection, parser and server
+TRACE = AdemcoTrace()
@@ -1,364 +1,55 @@
 #!/usr/bin/env python
 
-from BeautifulSoup import BeautifulSoup
-import urllib
-import urllib2
 import sys
 import getopt
 import json
 
-#
-# Recognized Command IDs
-#
-
-COMMAND_UNKNOWN = 0
-COMMAND_DISARM = 1
-COMMAND_BYPASS = 2
-COMMAND_TOGGLE_CHIME = 3
-COMMAND_TEST = 4
-COMMAND_CODE = 5
-COMMAND_CUSTOM = 6
-COMMAND_ARM_AWAY = 100
-COMMAND_ARM_STAY = 101
-COMMAND_ARM_INSTANT = 102
-COMMAND_ARM_MAX = 103
-
-COMMAND_BUILTINS = 500
-COMMAND_GETSTATUS = 501
-COMMAND_HELP = 502
-
-STATUS_UNKNOWN = "unknown"
-
-#
-# EZMOBILE commands to ignore
-#
-
-EZMOBILE_COMMANDS_IGNORE = [
-    "cancel",
-]
-
-#
-# Supported EZMOBILE commands
-#
-# Format: (EZMobile Name, Command ID, CLI Command, CLI Help String)
-#
-
-EZMOBILE_COMMANDS = (
-    ("away arm", COMMAND_ARM_AWAY, "arm", "Arms the entire partition"),
-    ("stay arm", COMMAND_ARM_STAY, "partial", "Arms the perimeter of the partition"),
-    ("instant arm", COMMAND_ARM_INSTANT, "instantarm", "Unknown"),
-    ("max", COMMAND_ARM_MAX, "maxarm", "Unknown"),
-    ("off", COMMAND_DISARM, "disarm", "Disarms the entire partition"),
-    ("bypass", COMMAND_BYPASS, "bypass", "Bypasses a zone"),
-    ("toggle chime", COMMAND_TOGGLE_CHIME, "togglechime", "Unknown"),
-    ("test", COMMAND_TEST, "test", "Tests the partition"),
-    ("code", COMMAND_CODE, "code", "Configure a code"),
-    ("custom", COMMAND_CUSTOM, "sequence", "Enter a custom sequence"),
-)
-
-#
-# Commands supported by the script
-#
-# Format: (CLI Command, Command ID, CLI Help String)
-#
-
-BUILTIN_COMMANDS = (
-    ("status", COMMAND_GETSTATUS, "Gets the status of the partition"),
-    ("help", COMMAND_HELP, "Lists all possible commands"),
-)
-
-
-class MobileAlarm:
-
-    def __init__(self, url, mid, did, partition):
-
-        self.url = url
-        self.mobileIdentifier = mid
-        self.deviceIdentifier = did
-        self.partition = partition
-
-        self.discoveredCommands = []
-        self.commandActions = {}
-        self.commandMethods = {}
-        self.commandFormData = {}
-        self.commandFormSlots = {}
-        self.ignoreCommands = list(EZMOBILE_COMMANDS_IGNORE)
-
-    @classmethod
-    def _fetch_page_dom(self, url):
-        '''
-
-        Fetches the specified URL (HTTP GET) and returns the response
-        in a BeautifulSoup HTML DOM object.
-
-        '''
-        response = urllib2.urlopen(url)
-        html = response.read()
-        dom = BeautifulSoup(html)
-        return dom
-
-    @classmethod
-    def _post_page(self, url, method, data):
-        '''
-
-        Fetches the specified URL (HTTP GET) and returns the response
-        in a urllib2 response object.
-
-        '''
-        data = urllib.urlencode(data)
-        headers = {}
-        request = urllib2.Request(url, data, headers)
-        response = urllib2.urlopen(request)
-        return response
-
-    def _fetch_command_page(self):
-        '''
-
-        Fetches the EZMOBILE command page and returns the response
-        in a BeautifulSoup HTML DOM object.
-
-        '''
-        url = '%(url)s?mid=%(mid)s&did=%(did)s&part=%(partition)s&action=partcommands' % {
-            'url': self.url,
-            'mid': self.mobileIdentifier,
-            'did': self.deviceIdentifier,
-            'partition': self.partition, 
-        }
-        return MobileAlarm._fetch_page_dom(url=url)
-
-    def _fetch_arm_page(self):
-        '''
-
-        Fetches the EZMOBILE arm command page and returns the response
-        in a BeautifulSoup HTML DOM object.
-
-        '''
-        url = '%(url)s?mid=%(mid)s&did=%(did)s&part=%(partition)s&action=armconfirm' % {
-            'url': self.url,
-            'mid': self.mobileIdentifier,
-            'did': self.deviceIdentifier,
-            'partition': self.partition,
-        }
-        return MobileAlarm._fetch_page_dom(url=url)
+from ezmobile.cache import EZMobileDiscoveryCache, DISCOVERY_CACHE_PATH, DISCOVERY_CACHE_TTL
+from ezmobile.alarm import MobileAlarm, CommandFormRejected, CommandNotDiscovered, EZMOBILE_COMMANDS, EZMOBILE_COMMANDS_IGNORE
+from ezmobile.alarm import COMMAND_UNKNOWN, COMMAND_BUILTINS, COMMAND_HELP, COMMAND_GETSTATUS, COMMAND_GETSTATUS_ALL, STATUS_UNKNOWN
 
-    def _fetch_partition_page(self):
-        '''
 
-        Fetches the EZMOBILE arm command page and returns the response
-        in a BeautifulSoup HTML DOM object.
-
-        '''
-        url = '%(url)s?mid=%(mid)s&did=%(did)s&action=s' % {
-            'url': self.url,
-            'mid': self.mobileIdentifier,
-            'did': self.deviceIdentifier,
-        }
-        return MobileAlarm._fetch_page_dom(url=url)
-
-    def _discover_command_form(self, url, command_id):
-        '''
-
-        Fetches the command form at the specified URL and associates
-        the form at the URL with the specified command_id.
-
-        Populates the command action, method, and inputs for the command.
-
-        '''
-
-        # Get the DOM of the link href
-        command_dom = self._fetch_page_dom(url=url)
-
-        # Look into form
-        form = command_dom.find('form')
-
-        # Get form action & method
-        self.commandActions[command_id] = form.get('action')
-        self.commandMethods[command_id] = form.get('method')
-
-        # Add this command to our discovered commands
-        self.discoveredCommands += [command_id]
-
-        # Get all hidden inputs and non-hidden inputs
-        inputs = form.findAll('input')
-
-        # Look at the inputs
-        hidden_inputs = []
-        slots = []
-        for input_field in inputs:
-            if "hidden".lower() in input_field.get('type').lower():
-                hidden_input = (input_field.get('name'), input_field.get('value'))
-                hidden_inputs += [hidden_input]
-            else:
-                slots += [input_field.get('name')]
-
-        self.commandFormData[command_id] = hidden_inputs
-        self.commandFormSlots[command_id] = slots
-
-    def _discover_commands_in_dom(self, dom):
-        '''
-
-        Fetches the EZMOBILE command page and discovers actions available.
-
-        '''
-        links = dom.findAll('a')
-
-        # Link strings that we should be matching against
-        match_strings = [i[0].lower() for i in EZMOBILE_COMMANDS]
-
-        # Map from link names to command IDs
-        command_ids = dict([(i[0], i[1]) for i in EZMOBILE_COMMANDS])
-
-        for link in links:
-            link_string = link.string.lower()
-
-            if link_string in self.ignoreCommands:
-                continue
-
-            if link_string in match_strings:
-                command_id = command_ids[link_string]
-                self._discover_command_form(url=link.get('href'), command_id=command_id)
-            else:
-                print "[Warning] Discovered unknown command = " + link.string.lower()
-
-    def discover_arm_commands(self):
-        '''
-
-        Discovers all ARM commands from the EZMOBILE portal.
-        You must run this method before attempting to execute an ARM command.
-
-        '''
-
-        dom = self._fetch_arm_page()
-        self._discover_commands_in_dom(dom)
-
-    def discover_commands(self):
-        '''
-
-        Discovers all standard commands from the EZMOBILE portal.
-        You must run this method before attempting to execute a standard command.
-
-        '''
-
-        dom = self._fetch_command_page()
-        self._discover_commands_in_dom(dom)
-
-    def determine_command(self, command_argument):
-        '''
-
-        Provides a command ID for the specified CLI command argument.
+def discover(ma):
+    '''
 
-        '''
-        commands = dict([(i[2], i[1]) for i in EZMOBILE_COMMANDS])
-        builtins = dict([(i[0], i[1]) for i in BUILTIN_COMMANDS])
+    Discovers the standard and arm command forms from the portal.
 
-        try:
-            return commands[command_argument]
-        except KeyError:
-            try:
-                return builtins[command_argument]
-            except KeyError:
-                return COMMAND_UNKNOWN
-
-    def discovered_command_help_and_labels(self):
-        '''
-
-        Provides a list of all discovered CLI commands and a help string (list of tuples).
-
-        '''
-        script_commands = dict([(i[1], i[2]) for i in EZMOBILE_COMMANDS])
-        script_command_help = dict([(i[1], i[3]) for i in EZMOBILE_COMMANDS])
-        items = [(i[0], i[2]) for i in BUILTIN_COMMANDS]
-        items += [(script_commands[i], script_command_help[i]) for i in self.discoveredCommands]
-        return items
-
-    def _determine_status(self):
-        try:
-            partition_page = self._fetch_partition_page()
-        except:
-            return STATUS_UNKNOWN
+    '''
+    print "Detecting commands and arm types..."
+    ma.discover_all_commands()
 
-        partition_headers = partition_page.findAll('h3')
-        status_header_parent = None
 
-        for header in partition_headers:
-            if header.string.lower().strip() == "partition " + str(self.partition):
-                status_header_parent = header.parent
-                break
+def issue_builtin(ma, command_id):
+    '''
 
-        if status_header_parent is None:
-            return STATUS_UNKNOWN
+    Runs one of the commands built into the script, and exits.
 
-        status = status_header_parent.find('p').string.lower().strip()
-        return status
+    '''
 
-    def _issue_builtin(self, command_id, **kwargs):
+    if command_id == COMMAND_HELP:
+        help(ma)
+        exit(0)
 
-        if command_id == COMMAND_HELP:
-            help(self)
+    elif command_id == COMMAND_GETSTATUS:
+        status = ma._determine_status()
+        print status
+        if status != STATUS_UNKNOWN:
             exit(0)
-
-        elif command_id == COMMAND_GETSTATUS:
-            status = self._determine_status()
-            print status
-            if status != STATUS_UNKNOWN:
-                exit(0)
-            else:
-                exit(1)
-
         else:
-            print "bad command"
-
-    def issue(self, command_id, **kwargs):
-        '''
-
-        Issues the specified alarm command. 
-        Specify additional form fields through kwargs.
-
-        '''
+            exit(1)
 
-        # Do not process the command if it is unknown
-        if command_id == COMMAND_UNKNOWN:
-            print "[Error] Cannot issue unknown command"
-            return None
-
-        if command_id > COMMAND_BUILTINS:
-            return self._issue_builtin(command_id, **kwargs)
-
-        # Get the request method and action from the discovery cache
-        try:
-            command_url = self.commandActions[command_id]
-            command_method = self.commandMethods[command_id]
-        except KeyError:
-            print "Error: could not find the requested command. Did you ignore this command in your config file?"
-            sys.exit(1)
-
-        # Our form data
-        command_form = {}
-
-        # List of all of the required form fields for the selected action
-        required_slots = self.commandFormSlots[command_id]
-
-        # Include all hidden fields from the discovery cache into our new form data
-        for hidden_field in self.commandFormData[command_id]:
-            command_form[hidden_field[0]] = hidden_field[1]
-
-        # Add any custom arguments which are required for the form
-        for (key, value) in kwargs.iteritems():
-            if key in required_slots:
-                command_form[key] = value
-
-        # List of all form fields which have been met with the information we have
-        filled_slots = command_form.keys()
+    elif command_id == COMMAND_GETSTATUS_ALL:
+        statuses = ma.determine_statuses()
+        print json.dumps(statuses, sort_keys=True)
+        if len(statuses) > 0:
+            exit(0)
+        else:
+            exit(1)
 
-        # If we're missing any form fields, we cannot continue
-        for required_slot in required_slots:
-            if required_slot not in filled_slots:
-                print "[Error] Missing required field: " + required_slot
-                return None
+    else:
+        print "bad command"
 
-        # Issue the command request
-        print "Issuing command..."
-        MobileAlarm._post_page(command_url, command_method, command_form)
+    sys.exit(1)
 
 
 def help(ma=None):
@@ -498,19 +189,53 @@ def main():
         help(ma)
         exit(1)
 
+    # Discovered forms are cached; "discovery-cache": false in the config turns this off
+    cache = None
+    cache_key = None
+    cache_path = config.get("discovery-cache", DISCOVERY_CACHE_PATH)
+    if cache_path:
+        cache = EZMobileDiscoveryCache(cache_path, config.get("discovery-ttl", DISCOVERY_CACHE_TTL))
+        cache_key = cache.key(CONFIG_URL, CONFIG_MID, CONFIG_DID, CONFIG_PARTITION, ma.ignoreCommands)
+
     # If the command is within EZMOBILE_COMMANDS, then we need to discover before issuing.
+    from_cache = False
     if command_id in [i[1] for i in EZMOBILE_COMMANDS] or command_id == COMMAND_HELP:
 
-        # Discover alarm commands
-        print "Detecting commands..."
-        ma.discover_commands()
+        if cache is not None:
+            from_cache = ma.restore_discovery(cache.load(cache_key))
+
+        if not from_cache:
+            discover(ma)
+            if cache is not None:
+                cache.store(cache_key, ma.discovery_state())
 
-        # Discover arming commands
-        print "Detecting arm types..."
-        ma.discover_arm_commands()
+    if command_id > COMMAND_BUILTINS:
+        issue_builtin(ma, command_id)
 
     # Issue the command!
-    ma.issue(command_id, **extra_fields)
+    try:
+        ma.issue(command_id, **extra_fields)
+    except CommandNotDiscovered:
+        print "Error: could not find the requested command. Did you ignore this command in your config file?"
+        exit(1)
+    except CommandFormRejected as e:
+        if not from_cache:
+            print "[Error] " + str(e)
+            exit(1)
+
+        # The portal has changed since the forms were cached; discover again and retry once
+        print "Cached command form was rejected, rediscovering..."
+        cache.invalidate(cache_key)
+        ma.reset_discovery()
+        discover(ma)
+        cache.store(cache_key, ma.discovery_state())
+
+        try:
+            ma.issue(command_id, **extra_fields)
+        except CommandFormRejected as e:
+            print "[Error] " + str(e)
+            exit(1)
+
     exit(0)
 
 
@@ -0,0 +1,458 @@
+from multiprocessing.pool import ThreadPool
+import urllib
+
+from ezmobile.pool import EZMobileConnectionPool, EZMobileHTTPError
+from ezmobile.extract import extract, EZMobileLinkExtractor, EZMobileFormExtractor, EZMobilePartitionExtractor
+
+#
+# Recognized Command IDs
+#
+
+COMMAND_UNKNOWN = 0
+COMMAND_DISARM = 1
+COMMAND_BYPASS = 2
+COMMAND_TOGGLE_CHIME = 3
+COMMAND_TEST = 4
+COMMAND_CODE = 5
+COMMAND_CUSTOM = 6
+COMMAND_ARM_AWAY = 100
+COMMAND_ARM_STAY = 101
+COMMAND_ARM_INSTANT = 102
+COMMAND_ARM_MAX = 103
+
+COMMAND_BUILTINS = 500
+COMMAND_GETSTATUS = 501
+COMMAND_HELP = 502
+COMMAND_GETSTATUS_ALL = 503
+
+STATUS_UNKNOWN = "unknown"
+
+# Upper bound on concurrent page fetches during discovery
+DISCOVERY_WORKERS = 8
+
+PARTITION_PAGE_URL = '%(url)s?mid=%(mid)s&did=%(did)s&action=s'
+
+
+def partition_page_url(url, mid, did):
+    return PARTITION_PAGE_URL % {'url': url, 'mid': mid, 'did': did}
+
+#
+# EZMOBILE commands to ignore
+#
+
+EZMOBILE_COMMANDS_IGNORE = [
+    "cancel",
+]
+
+#
+# Supported EZMOBILE commands
+#
+# Format: (EZMobile Name, Command ID, CLI Command, CLI Help String)
+#
+
+EZMOBILE_COMMANDS = (
+    ("away arm", COMMAND_ARM_AWAY, "arm", "Arms the entire partition"),
+    ("stay arm", COMMAND_ARM_STAY, "partial", "Arms the perimeter of the partition"),
+    ("instant arm", COMMAND_ARM_INSTANT, "instantarm", "Unknown"),
+    ("max", COMMAND_ARM_MAX, "maxarm", "Unknown"),
+    ("off", COMMAND_DISARM, "disarm", "Disarms the entire partition"),
+    ("bypass", COMMAND_BYPASS, "bypass", "Bypasses a zone"),
+    ("toggle chime", COMMAND_TOGGLE_CHIME, "togglechime", "Unknown"),
+    ("test", COMMAND_TEST, "test", "Tests the partition"),
+    ("code", COMMAND_CODE, "code", "Configure a code"),
+    ("custom", COMMAND_CUSTOM, "sequence", "Enter a custom sequence"),
+)
+
+#
+# Commands supported by the script
+#
+# Format: (CLI Command, Command ID, CLI Help String)
+#
+
+BUILTIN_COMMANDS = (
+    ("status", COMMAND_GETSTATUS, "Gets the status of the partition"),
+    ("statusall", COMMAND_GETSTATUS_ALL, "Gets the status of every partition as JSON"),
+    ("help", COMMAND_HELP, "Lists all possible commands"),
+)
+
+
+class CommandFormRejected(Exception):
+    '''
+
+    The portal refused a submitted command form, e.g. because the form
+    it was discovered from has changed.
+
+    '''
+    pass
+
+
+class CommandNotDiscovered(Exception):
+    '''
+
+    The command was not found on the portal, or was ignored in the
+    configuration.
+
+    '''
+    pass
+
+
+class MobileAlarm:
+
+    # Shared keep-alive connections to the portal
+    connection_pool = EZMobileConnectionPool()
+
+    def __init__(self, url, mid, did, partition):
+
+        self.url = url
+        self.mobileIdentifier = mid
+        self.deviceIdentifier = did
+        self.partition = partition
+
+        self.reset_discovery()
+        self.ignoreCommands = list(EZMOBILE_COMMANDS_IGNORE)
+
+    def reset_discovery(self):
+        self.discoveredCommands = []
+        self.commandActions = {}
+        self.commandMethods = {}
+        self.commandFormData = {}
+        self.commandFormSlots = {}
+
+    def discovery_state(self):
+        '''
+
+        Returns the discovered command forms as JSON-serializable data.
+
+        '''
+        return [{
+            "command": i,
+            "action": self.commandActions[i],
+            "method": self.commandMethods[i],
+            "data": [list(j) for j in self.commandFormData[i]],
+            "slots": list(self.commandFormSlots[i]),
+        } for i in self.discoveredCommands]
+
+    def restore_discovery(self, discovery):
+        '''
+
+        Loads command forms saved by discovery_state instead of discovering
+        them. Returns False (and loads nothing) if discovery is not usable.
+
+        '''
+        if not discovery:
+            return False
+
+        try:
+            forms = [(int(i["command"]), i["action"], i["method"],
+                      [tuple(j) for j in i["data"]], list(i["slots"])) for i in discovery]
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        self.reset_discovery()
+        for (command_id, action, method, data, slots) in forms:
+            self.discoveredCommands += [command_id]
+            self.commandActions[command_id] = action
+            self.commandMethods[command_id] = method
+            self.commandFormData[command_id] = data
+            self.commandFormSlots[command_id] = slots
+
+        return True
+
+    @classmethod
+    def _fetch_page(self, url, extractor):
+        '''
+
+        Fetches the specified URL (HTTP GET) and returns what extractor
+        finds in it. The page is parsed as it is read, and only until the
+        extractor has what it needs.
+
+        '''
+        response = self.connection_pool.request("GET", url)
+        return extract(response, extractor)
+
+    @classmethod
+    def _post_page(self, url, method, data):
+        '''
+
+        Submits data to the specified URL (HTTP POST) and returns the
+        response body.
+
+        '''
+        data = urllib.urlencode(data)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        response = self.connection_pool.request("POST", url, data, headers)
+        return response.read()
+
+    def _fetch_command_page(self):
+        '''
+
+        Fetches the EZMOBILE command page and returns its links
+        as (href, text) tuples.
+
+        '''
+        url = '%(url)s?mid=%(mid)s&did=%(did)s&part=%(partition)s&action=partcommands' % {
+            'url': self.url,
+            'mid': self.mobileIdentifier,
+            'did': self.deviceIdentifier,
+            'partition': self.partition, 
+        }
+        return MobileAlarm._fetch_page(url, EZMobileLinkExtractor())
+
+    def _fetch_arm_page(self):
+        '''
+
+        Fetches the EZMOBILE arm command page and returns its links
+        as (href, text) tuples.
+
+        '''
+        url = '%(url)s?mid=%(mid)s&did=%(did)s&part=%(partition)s&action=armconfirm' % {
+            'url': self.url,
+            'mid': self.mobileIdentifier,
+            'did': self.deviceIdentifier,
+            'partition': self.partition,
+        }
+        return MobileAlarm._fetch_page(url, EZMobileLinkExtractor())
+
+    def _fetch_partition_page(self):
+        '''
+
+        Fetches the EZMOBILE partition page and returns the status of
+        each partition, keyed by partition number (as a string).
+
+        '''
+        url = partition_page_url(self.url, self.mobileIdentifier, self.deviceIdentifier)
+        return MobileAlarm._fetch_page(url, EZMobilePartitionExtractor())
+
+    @classmethod
+    def _fetch_command_form(self, url):
+        '''
+
+        Fetches the command form at the specified URL and returns its
+        action, method, hidden inputs and input slots.
+
+        Only reads shared state, so it can run on a worker thread.
+
+        '''
+
+        # Get the form at the link href
+        form = self._fetch_page(url, EZMobileFormExtractor())
+        if form is None:
+            raise Exception("No command form at " + url)
+
+        action, method, inputs = form
+
+        # Look at the inputs
+        hidden_inputs = []
+        slots = []
+        for input_field in inputs:
+            if "hidden".lower() in (input_field.get('type') or '').lower():
+                hidden_input = (input_field.get('name'), input_field.get('value'))
+                hidden_inputs += [hidden_input]
+            else:
+                slots += [input_field.get('name')]
+
+        return (action, method, hidden_inputs, slots)
+
+    def _add_command_form(self, command_id, form):
+        '''
+
+        Associates a form returned by _fetch_command_form with command_id.
+
+        '''
+        action, method, hidden_inputs, slots = form
+
+        self.commandActions[command_id] = action
+        self.commandMethods[command_id] = method
+        self.commandFormData[command_id] = hidden_inputs
+        self.commandFormSlots[command_id] = slots
+
+        # Add this command to our discovered commands
+        if command_id not in self.discoveredCommands:
+            self.discoveredCommands += [command_id]
+
+    def _discover_command_forms(self, links):
+        '''
+
+        Fetches the command forms for a list of (url, command_id) links
+        concurrently and adds them in link order.
+
+        '''
+        if len(links) == 0:
+            return
+
+        pool = ThreadPool(min(len(links), DISCOVERY_WORKERS))
+        try:
+            forms = pool.map(self._fetch_command_form, [i[0] for i in links])
+        finally:
+            pool.close()
+            pool.join()
+
+        for ((url, command_id), form) in zip(links, forms):
+            self._add_command_form(command_id, form)
+
+    def _command_links(self, links):
+        '''
+
+        Returns (url, command_id) for every recognized command link.
+
+        '''
+        command_links = []
+
+        # Link strings that we should be matching against
+        match_strings = [i[0].lower() for i in EZMOBILE_COMMANDS]
+
+        # Map from link names to command IDs
+        command_ids = dict([(i[0], i[1]) for i in EZMOBILE_COMMANDS])
+
+        for (href, text) in links:
+            link_string = text.lower()
+
+            if link_string in self.ignoreCommands:
+                continue
+
+            if link_string in match_strings:
+                command_links += [(href, command_ids[link_string])]
+            else:
+                print "[Warning] Discovered unknown command = " + link_string
+
+        return command_links
+
+    def discover_arm_commands(self):
+        '''
+
+        Discovers all ARM commands from the EZMOBILE portal.
+        You must run this method before attempting to execute an ARM command.
+
+        '''
+
+        links = self._fetch_arm_page()
+        self._discover_command_forms(self._command_links(links))
+
+    def discover_commands(self):
+        '''
+
+        Discovers all standard commands from the EZMOBILE portal.
+        You must run this method before attempting to execute a standard command.
+
+        '''
+
+        links = self._fetch_command_page()
+        self._discover_command_forms(self._command_links(links))
+
+    def discover_all_commands(self):
+        '''
+
+        Discovers the standard and ARM commands together: both command
+        pages are fetched at once, then every command form at once.
+
+        '''
+        pool = ThreadPool(2)
+        try:
+            command_page = pool.apply_async(self._fetch_command_page)
+            arm_page = pool.apply_async(self._fetch_arm_page)
+            pages = [command_page.get(), arm_page.get()]
+        finally:
+            pool.close()
+            pool.join()
+
+        links = []
+        for page_links in pages:
+            links += self._command_links(page_links)
+        self._discover_command_forms(links)
+
+    def determine_command(self, command_argument):
+        '''
+
+        Provides a command ID for the specified CLI command argument.
+
+        '''
+        commands = dict([(i[2], i[1]) for i in EZMOBILE_COMMANDS])
+        builtins = dict([(i[0], i[1]) for i in BUILTIN_COMMANDS])
+
+        try:
+            return commands[command_argument]
+        except KeyError:
+            try:
+                return builtins[command_argument]
+            except KeyError:
+                return COMMAND_UNKNOWN
+
+    def discovered_command_help_and_labels(self):
+        '''
+
+        Provides a list of all discovered CLI commands and a help string (list of tuples).
+
+        '''
+        script_commands = dict([(i[1], i[2]) for i in EZMOBILE_COMMANDS])
+        script_command_help = dict([(i[1], i[3]) for i in EZMOBILE_COMMANDS])
+        items = [(i[0], i[2]) for i in BUILTIN_COMMANDS]
+        items += [(script_commands[i], script_command_help[i]) for i in self.discoveredCommands]
+        return items
+
+    def determine_statuses(self):
+        '''
+
+        Returns the status of every partition, keyed by partition number,
+        from a single fetch of the partition page. Empty if it failed.
+
+        '''
+        try:
+            return self._fetch_partition_page()
+        except:
+            return {}
+
+    def _determine_status(self):
+        return self.determine_statuses().get(str(self.partition), STATUS_UNKNOWN)
+
+    def issue(self, command_id, **kwargs):
+        '''
+
+        Issues the specified alarm command. 
+        Specify additional form fields through kwargs.
+
+        '''
+
+        # Do not process the command if it is unknown
+        if command_id == COMMAND_UNKNOWN:
+            print "[Error] Cannot issue unknown command"
+            return None
+
+        # Get the request method and action from the discovery cache
+        try:
+            command_url = self.commandActions[command_id]
+            command_method = self.commandMethods[command_id]
+        except KeyError:
+            raise CommandNotDiscovered("Command %d was not discovered" % command_id)
+
+        # Our form data
+        command_form = {}
+
+        # List of all of the required form fields for the selected action
+        required_slots = self.commandFormSlots[command_id]
+
+        # Include all hidden fields from the discovery cache into our new form data
+        for hidden_field in self.commandFormData[command_id]:
+            command_form[hidden_field[0]] = hidden_field[1]
+
+        # Add any custom arguments which are required for the form
+        for (key, value) in kwargs.iteritems():
+            if key in required_slots:
+                command_form[key] = value
+
+        # List of all form fields which have been met with the information we have
+        filled_slots = command_form.keys()
+
+        # If we're missing any form fields, we cannot continue
+        for required_slot in required_slots:
+            if required_slot not in filled_slots:
+                print "[Error] Missing required field: " + required_slot
+                return None
+
+        # Issue the command request
+        print "Issuing command..."
+        try:
+            return MobileAlarm._post_page(command_url, command_method, command_form)
+        except EZMobileHTTPError as e:
+            if 400 <= e.code < 500:
+                raise CommandFormRejected("Command form rejected: HTTP %d" % e.code)
+            raise
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import time
+import os
+
+DISCOVERY_CACHE_PATH = "ezmobile-discovery-cache.json"
+DISCOVERY_CACHE_TTL = 7 * 24 * 3600
+
+
+class EZMobileDiscoveryCache:
+    '''
+
+    Persists the forms discovered on the EZMOBILE portal, so that a
+    command does not have to crawl the command and arm pages first.
+
+    Entries are keyed by portal URL, mid, did and partition (plus the
+    ignored commands, which limit what is discovered) and expire after
+    ttl seconds.
+
+    '''
+
+    def __init__(self, path=DISCOVERY_CACHE_PATH, ttl=DISCOVERY_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    @classmethod
+    def key(cls, url, mid, did, partition, ignore_commands=()):
+        ignored = ",".join(sorted(set(ignore_commands)))
+        identity = "|".join([str(url), str(mid), str(did), str(partition), ignored])
+        return hashlib.sha1(identity).hexdigest()
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def _write(self, entries):
+        # Write to a temporary file and rename, so concurrent runs never read a partial file
+        temporary_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temporary_path, 'w') as cache_file:
+            json.dump(entries, cache_file)
+        os.rename(temporary_path, self.path)
+
+    def load(self, key, now=None):
+        '''
+
+        Returns the discovery stored under key, or None if there is none
+        or it has expired.
+
+        '''
+        now = now if now is not None else time.time()
+        entry = self._read().get(key)
+
+        if entry is None or now - entry.get("time", 0) > self.ttl:
+            return None
+
+        return entry.get("discovery")
+
+    def store(self, key, discovery, now=None):
+        now = now if now is not None else time.time()
+        entries = self._read()
+
+        # Drop expired entries on the way, so the file does not keep every portal ever seen
+        entries = dict([(i, j) for (i, j) in entries.items() if now - j.get("time", 0) <= self.ttl])
+        entries[key] = {"time": now, "discovery": discovery}
+
+        try:
+            self._write(entries)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def invalidate(self, key):
+        entries = self._read()
+        if key in entries:
+            del entries[key]
+            try:
+                self._write(entries)
+            except (IOError, OSError):
+                pass
@@ -0,0 +1,161 @@
+import HTMLParser
+
+EXTRACT_CHUNK_SIZE = 4096
+
+
+class EZMobileExtractor(HTMLParser.HTMLParser):
+    '''
+
+    Base class for the EZMOBILE page extractors. Subclasses look for only
+    the elements they need and set done once they have them, so the rest
+    of the page is never parsed.
+
+    '''
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.done = False
+
+    def handle_entityref(self, name):
+        self.handle_data(self.unescape("&%s;" % name))
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape("&#%s;" % name))
+
+    def result(self):
+        return None
+
+
+class EZMobileLinkExtractor(EZMobileExtractor):
+    '''
+
+    Collects (href, text) for every <a> on the page.
+
+    '''
+
+    def __init__(self):
+        EZMobileExtractor.__init__(self)
+        self.links = []
+        self.link_href = None
+        self.link_text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.link_href = dict(attrs).get('href')
+            self.link_text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self.link_text is not None:
+            self.links.append((self.link_href, ''.join(self.link_text).strip()))
+            self.link_href = None
+            self.link_text = None
+
+    def handle_data(self, data):
+        if self.link_text is not None:
+            self.link_text.append(data)
+
+    def result(self):
+        return self.links
+
+
+class EZMobileFormExtractor(EZMobileExtractor):
+    '''
+
+    Collects the action, method and <input> attributes of the first
+    <form> on the page, and stops at its end.
+
+    '''
+
+    def __init__(self):
+        EZMobileExtractor.__init__(self)
+        self.form = None
+        self.inputs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'form' and self.form is None:
+            self.form = dict(attrs)
+        elif tag == 'input' and self.form is not None:
+            self.inputs.append(dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self.form is not None:
+            self.done = True
+
+    def result(self):
+        if self.form is None:
+            return None
+        return (self.form.get('action'), self.form.get('method'), self.inputs)
+
+
+class EZMobilePartitionExtractor(EZMobileExtractor):
+    '''
+
+    Collects the status of every partition on the partition page: each
+    <h3>Partition N</h3> header is followed by a <p> holding its status.
+
+    '''
+
+    PARTITION_PREFIX = "partition "
+
+    def __init__(self):
+        EZMobileExtractor.__init__(self)
+        self.statuses = {}
+        self.text = None
+        self.text_tag = None
+        self.partition = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'h3' or (tag == 'p' and self.partition is not None):
+            self.text_tag = tag
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag != self.text_tag:
+            return
+
+        text = ''.join(self.text).lower().strip()
+        self.text = None
+        self.text_tag = None
+
+        if tag == 'h3':
+            if text.startswith(self.PARTITION_PREFIX):
+                self.partition = text[len(self.PARTITION_PREFIX):].strip()
+            else:
+                self.partition = None
+
+        elif self.partition is not None:
+            self.statuses[self.partition] = text
+            self.partition = None
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def result(self):
+        return self.statuses
+
+
+def extract(response, extractor, chunk_size=EXTRACT_CHUNK_SIZE):
+    '''
+
+    Feeds response to extractor as it arrives and returns the result.
+    Reading stops as soon as the extractor is done.
+
+    '''
+    try:
+        while not extractor.done:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                extractor.close()
+                break
+            extractor.feed(chunk)
+    except HTMLParser.HTMLParseError:
+        # Keep what was found before the markup went bad
+        pass
+    finally:
+        response.finish()
+
+    return extractor.result()
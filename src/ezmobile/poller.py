@@ -0,0 +1,278 @@
+from multiprocessing.pool import ThreadPool
+import threading
+import getopt
+import json
+import time
+import sys
+
+from ezmobile.pool import EZMobileConnectionPool, EZMobileHTTPError
+from ezmobile.extract import extract, EZMobilePartitionExtractor
+from ezmobile.alarm import partition_page_url
+
+POLL_TTL = 5.0
+POLL_WORKERS = 16
+
+
+class EZMobileFlight:
+    '''
+
+    A fetch in progress, which callers arriving meanwhile wait on
+    instead of issuing their own.
+
+    '''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class EZMobilePageCache:
+    '''
+
+    Keeps each fetched page's extracted result for ttl seconds, per page
+    and extractor class. Callers asking for a page that is being fetched
+    wait for that fetch rather than issuing another. Once an entry expires, it is fetched again with
+    If-None-Match / If-Modified-Since, and a 304 keeps the old result.
+
+    '''
+
+    def __init__(self, connection_pool, ttl=POLL_TTL):
+        self.connection_pool = connection_pool
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.flights = {}
+        self.fetches = 0
+        self.not_modified = 0
+        self.hits = 0
+
+    def get(self, url, extractor_class):
+        '''
+
+        Returns what extractor_class finds on the page at url, from the
+        cache if it is fresh enough.
+
+        '''
+        key = (url, extractor_class)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["fetched-at"] < self.ttl:
+                self.hits += 1
+                return entry["value"]
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = EZMobileFlight()
+                self.flights[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._fetch(url, extractor_class, entry)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+        return flight.value
+
+    def _fetch(self, url, extractor_class, entry):
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last-modified"]:
+                headers["If-Modified-Since"] = entry["last-modified"]
+
+        response = self.connection_pool.request("GET", url, headers=headers)
+
+        if response.status == 304:
+            response.finish()
+            if entry is None:
+                raise EZMobileHTTPError(response.status, url)
+            value = entry["value"]
+            with self.lock:
+                self.not_modified += 1
+        else:
+            etag = response.getheader("etag")
+            last_modified = response.getheader("last-modified")
+            value = extract(response, extractor_class())
+            entry = {"etag": etag, "last-modified": last_modified}
+            with self.lock:
+                self.fetches += 1
+
+        with self.lock:
+            entry = dict(entry, value=value)
+            entry["fetched-at"] = time.time()
+            self.entries[(url, extractor_class)] = entry
+
+        return value
+
+    def invalidate(self, url=None):
+        with self.lock:
+            if url is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == url]:
+                    del self.entries[key]
+
+
+class EZMobilePoller:
+    '''
+
+    Polls the partition statuses of several EZMOBILE devices at once, on
+    a bounded number of worker threads. A full poll takes about as long
+    as the slowest device.
+
+    Devices are dicts with "name", "mobile-url", "mid" and "did".
+
+    '''
+
+    def __init__(self, devices, ttl=POLL_TTL, workers=POLL_WORKERS, connection_pool=None):
+        self.devices = devices
+        self.workers = workers
+        self.connection_pool = connection_pool if connection_pool is not None else EZMobileConnectionPool()
+        self.page_cache = EZMobilePageCache(self.connection_pool, ttl)
+
+    def poll_device(self, device):
+        '''
+
+        Returns the status of every partition of device, keyed by
+        partition number.
+
+        '''
+        url = partition_page_url(device["mobile-url"], device["mid"], device["did"])
+        return dict(self.page_cache.get(url, EZMobilePartitionExtractor))
+
+    def _poll_device_safely(self, device):
+        try:
+            return (self.poll_device(device), None)
+        except Exception as e:
+            return (None, str(e))
+
+    def poll(self):
+        '''
+
+        Returns ({name: statuses}, {name: error}) for every device.
+
+        '''
+        if len(self.devices) == 0:
+            return ({}, {})
+
+        pool = ThreadPool(min(self.workers, len(self.devices)))
+        try:
+            results = pool.map(self._poll_device_safely, self.devices)
+        finally:
+            pool.close()
+            pool.join()
+
+        statuses = {}
+        errors = {}
+        for device, (status, error) in zip(self.devices, results):
+            if error is None:
+                statuses[device["name"]] = status
+            else:
+                errors[device["name"]] = error
+
+        return (statuses, errors)
+
+    def close(self):
+        self.connection_pool.close()
+
+
+def load_devices(config):
+    '''
+
+    Reads the "devices" list from an EZMobile configuration. Each device
+    falls back to the top-level "mobile-url", and a configuration with no
+    list is taken as a single device.
+
+    '''
+    devices = []
+    for (index, device) in enumerate(config.get("devices", [config])):
+        device = dict(device)
+        device.setdefault("mobile-url", config.get("mobile-url"))
+        device.setdefault("name", "%s/%s" % (device.get("mid"), device.get("did")))
+        if not device.get("mobile-url") or "mid" not in device or "did" not in device:
+            raise ValueError("Device %d needs mobile-url, mid and did" % index)
+        devices.append(device)
+    return devices
+
+
+def usage():
+    print "Usage: %s [-c config_file] [-t ttl] [-w workers] [-i interval]" % sys.argv[0]
+    print ""
+    print "-c: EZMobile configuration file (default: envisalink-config.json)"
+    print "-t: Seconds a fetched partition page is reused (default: %s)" % POLL_TTL
+    print "-w: Devices polled at once (default: %d)" % POLL_WORKERS
+    print "-i: Poll again every interval seconds, printing one JSON line per poll"
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hc:t:w:i:")
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    config_file_name = "envisalink-config.json"
+    ttl = None
+    workers = None
+    interval = None
+
+    for option, value in opts:
+        if option == "-h":
+            usage()
+            sys.exit(0)
+        elif option == "-c":
+            config_file_name = value
+        elif option == "-t":
+            ttl = float(value)
+        elif option == "-w":
+            workers = int(value)
+        elif option == "-i":
+            interval = float(value)
+
+    try:
+        config = json.load(open(config_file_name))
+        devices = load_devices(config)
+    except (IOError, ValueError) as e:
+        print "Error: %s" % e
+        sys.exit(1)
+
+    poller = EZMobilePoller(devices,
+                            ttl=ttl if ttl is not None else config.get("poll-ttl", POLL_TTL),
+                            workers=workers if workers is not None else config.get("poll-workers", POLL_WORKERS))
+
+    errors = {}
+    try:
+        while True:
+            statuses, errors = poller.poll()
+            for name in sorted(errors):
+                sys.stderr.write("[Error] %s: %s\n" % (name, errors[name]))
+            print json.dumps(statuses, sort_keys=True)
+            sys.stdout.flush()
+
+            if interval is None:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        poller.close()
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
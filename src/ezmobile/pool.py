@@ -0,0 +1,184 @@
+import threading
+import urlparse
+import httplib
+import socket
+
+POOL_MAX_IDLE_PER_HOST = 8
+POOL_TIMEOUT = 30
+POOL_MAX_REDIRECTS = 5
+
+# Unread body left when a reader stops early is drained up to this size to keep the connection
+POOL_DRAIN_LIMIT = 65536
+
+REDIRECT_CODES = (301, 302, 303, 307)
+
+# Methods that may be sent again after the portal could already have received them
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class EZMobileHTTPError(Exception):
+
+    def __init__(self, code, url):
+        Exception.__init__(self, "HTTP %d for %s" % (code, url))
+        self.code = code
+        self.url = url
+
+
+class EZMobilePooledResponse:
+    '''
+
+    A response whose connection goes back to the pool once the body has
+    been read to the end. Closing it early closes the connection instead,
+    since the unread rest of the body would otherwise be taken as the
+    next response.
+
+    '''
+
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amount=None):
+        data = self.response.read(amount) if amount is not None else self.response.read()
+        if self.response.isclosed():
+            self._release()
+        return data
+
+    def finish(self, drain_limit=POOL_DRAIN_LIMIT):
+        '''
+
+        Ends reading. A small unread remainder is drained so that the
+        connection can be reused; a larger one closes the connection.
+
+        '''
+        while self.connection is not None and drain_limit > 0:
+            data = self.read(min(drain_limit, 8192))
+            if not data:
+                break
+            drain_limit -= len(data)
+
+        self.close()
+
+    def close(self):
+        if self.connection is None:
+            return
+        if not self.response.isclosed():
+            self.connection.close()
+            self.connection = None
+        self._release()
+
+    def _release(self):
+        if self.connection is not None:
+            self.pool._release(self.key, self.connection, self.response.will_close)
+            self.connection = None
+
+
+class EZMobileConnectionPool:
+    '''
+
+    Keeps HTTP/HTTPS connections to the portal open between requests, so
+    that each request after the first skips the TCP and TLS handshakes.
+    Safe to use from several threads; each request gets a connection of
+    its own.
+
+    '''
+
+    def __init__(self, max_idle_per_host=POOL_MAX_IDLE_PER_HOST, timeout=POOL_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.connections_opened = 0
+
+    def _acquire(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        connection_class = httplib.HTTPSConnection if scheme == "https" else httplib.HTTPConnection
+        with self.lock:
+            self.connections_opened += 1
+        return connection_class(host, port, timeout=self.timeout), False
+
+    def _release(self, key, connection, will_close):
+        if will_close:
+            connection.close()
+            return
+
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def _send(self, method, url, body, headers):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        # A reused connection may have been closed by the server while idle; retry once on a new one.
+        # Once the request is out, only idempotent methods are retried: a command could run twice.
+        for attempt in range(2):
+            connection, reused = self._acquire(key)
+            sent = False
+            try:
+                connection.request(method, path, body, headers or {})
+                sent = True
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                retry = reused and attempt == 0 and not isinstance(e, socket.timeout)
+                if retry and (not sent or method in IDEMPOTENT_METHODS):
+                    continue
+                raise
+            return EZMobilePooledResponse(self, key, connection, response, url)
+
+    def request(self, method, url, body=None, headers=None):
+        '''
+
+        Issues a request and returns an EZMobilePooledResponse, following
+        redirects. Raises EZMobileHTTPError for 4xx and 5xx responses.
+
+        '''
+        for redirect in range(POOL_MAX_REDIRECTS + 1):
+            response = self._send(method, url, body, headers)
+
+            if response.status in REDIRECT_CODES and response.getheader("location"):
+                response.read()
+                url = urlparse.urljoin(url, response.getheader("location"))
+                if response.status != 307:
+                    method, body, headers = "GET", None, None
+                continue
+
+            if response.status >= 400:
+                response.read()
+                raise EZMobileHTTPError(response.status, url)
+
+            return response
+
+        raise EZMobileHTTPError(response.status, url)
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
@@ -0,0 +1,28 @@
+UPDATE_DISARMED = '%00,01,1C08,08,00,****DISARMED****  Ready to Arm  $'
+UPDATE_ARMED_AWAY = '%00,01,8C04,08,00,ARMED ***AWAY***               $'
+
+
+class StubConnection:
+
+    def __init__(self):
+        self.responses = []
+        self.commands = []
+        self.received_at = None
+
+    def receive(self, *lines):
+        self.responses.extend(lines)
+
+    def add_command(self, command):
+        self.commands.insert(0, command)
+
+    def send(self):
+        # What the connection cycle does, one command at a time
+        while len(self.commands) > 0:
+            command = self.commands.pop()
+            if getattr(self, "command_sent", None) is not None:
+                self.command_sent(command)
+
+    def pop_responses(self):
+        responses = list(self.responses)
+        self.responses = []
+        return responses
@@ -0,0 +1,100 @@
+import unittest
+
+from tests.helpers import StubConnection, UPDATE_DISARMED
+
+from ademco.alpha import classify, AdemcoAlphaClassifier, AdemcoZoneDirectory
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.simulator import alpha_text
+from ademco.common import QuietStderr
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_modes(self):
+        self.assertEqual(classify(alpha_text("****DISARMED****", "  Ready to Arm"))["mode"], "disarmed")
+        self.assertEqual(classify(alpha_text("ARMED ***AWAY***", "You may exit now"))["mode"], "away")
+        self.assertEqual(classify(alpha_text("ARMED ***STAY***", "You may exit now"))["mode"], "stay")
+        self.assertEqual(classify(alpha_text("ARMED ***NIGHT-STAY***"))["mode"], "night")
+        self.assertEqual(classify(alpha_text("ARMED *INSTANT*"))["mode"], "instant")
+        self.assertEqual(classify("SOMETHING ELSE")["mode"], None)
+
+    def test_zone_messages(self):
+        fault = classify(alpha_text("FAULT 05 FRONT", "DOOR"))
+        self.assertEqual((fault["mode"], fault["zone"], fault["label"]), ("fault", 5, "FRONT DOOR"))
+
+        bypass = classify(alpha_text("BYPAS 12 Garage"))
+        self.assertEqual((bypass["mode"], bypass["zone"], bypass["label"]), ("bypass", 12, "Garage"))
+
+        check = classify(alpha_text("CHECK 03 KITCHEN"))
+        self.assertEqual((check["mode"], check["trouble"]), ("check", "zone-trouble"))
+
+        self.assertEqual(classify(alpha_text("ALARM 07"))["label"], None)
+
+    def test_trouble_and_countdown(self):
+        self.assertEqual(classify(alpha_text("****DISARMED****", "AC LOSS"))["trouble"], "ac-loss")
+        self.assertEqual(classify(alpha_text("SYSTEM LO BAT"))["trouble"], "low-battery")
+
+        arming = classify(alpha_text("ARMED ***AWAY***", "May Exit Now  45"))
+        self.assertEqual((arming["mode"], arming["countdown"]), ("away", 45))
+        self.assertEqual(classify(alpha_text("ARMED ***AWAY***", "You may exit now"))["countdown"], None)
+
+
+class ClassifierCacheTest(unittest.TestCase):
+
+    def test_lru_is_bounded(self):
+        classifier = AdemcoAlphaClassifier(size=2)
+        first = classifier.classify("FAULT 01 A")
+        self.assertTrue(classifier.classify("FAULT 01 A") is first)
+
+        classifier.classify("FAULT 02 B")
+        classifier.classify("FAULT 01 A")
+        classifier.classify("FAULT 03 C")
+
+        # The least recently used text was evicted, the refreshed one kept
+        self.assertEqual(sorted(classifier.cache), ["FAULT 01 A", "FAULT 03 C"])
+        self.assertEqual(classifier.stats(), {"size": 2, "hits": 2, "misses": 3})
+
+
+class ZoneDirectoryTest(unittest.TestCase):
+
+    def test_learns_labels(self):
+        directory = AdemcoZoneDirectory()
+        self.assertTrue(directory.learn(classify("FAULT 05 FRONT DOOR")))
+        self.assertFalse(directory.learn(classify("BYPAS 05 FRONT DOOR")))
+        self.assertFalse(directory.learn(classify("****DISARMED****")))
+        self.assertEqual(directory.label(5), "FRONT DOOR")
+
+        restored = AdemcoZoneDirectory()
+        restored.restore(directory.state())
+        self.assertEqual(restored.label(5), "FRONT DOOR")
+
+    def test_server_learns_from_updates(self):
+        server = AdemcoServer()
+        server.connection = StubConnection()
+        server.connection.receive('%00,01,0008,05,00,' + alpha_text("FAULT 05", "FRONT DOOR") + '$', UPDATE_DISARMED)
+        with QuietStderr():
+            server.process_queue()
+
+        snapshot = server.state_snapshot()
+        self.assertEqual(snapshot["zone-labels"], {"5": "FRONT DOOR"})
+        self.assertEqual(snapshot["alpha"]["mode"], "disarmed")
+
+
+class UpdateDictTest(unittest.TestCase):
+
+    def test_night_from_alpha(self):
+        response = AdemcoResponse()
+        response.parse('%00,01,8008,08,00,' + alpha_text("ARMED ***NIGHT**", "You may exit now") + '$')
+        self.assertEqual(response.update_dict()["arm-mode"], "night")
+
+        # Not every panel puts ARMED first
+        response.parse('%00,01,8008,08,00,' + alpha_text("NIGHT-STAY", "** ARMED **") + '$')
+        self.assertEqual(response.update_dict()["arm-mode"], "night")
+
+        response.parse('%00,01,8008,08,00,' + alpha_text("ARMED ***STAY***", "You may exit now") + '$')
+        self.assertEqual(response.update_dict()["arm-mode"], "stay")
+
+
+if __name__ == '__main__':
+    unittest.main()
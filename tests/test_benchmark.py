@@ -0,0 +1,35 @@
+import unittest
+
+from ademco.benchmark import compare, result, benchmark_framing, benchmark_startup, BETTER_HIGHER
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_threshold_and_baseline_regressions(self):
+        results = {
+            "parse.us": result(10.0, "us"),
+            "framing.frames_per_second": result(500.0, "frames/s", BETTER_HIGHER),
+        }
+        baseline = {
+            "parse.us": result(5.0, "us"),
+            "framing.frames_per_second": result(1000.0, "frames/s", BETTER_HIGHER),
+        }
+
+        self.assertEqual(compare(results, {"parse.us": 20.0}, None, 0.25), [])
+        self.assertEqual(len(compare(results, {"parse.us": 5.0}, None, 0.25)), 1)
+        self.assertEqual(len(compare(results, {}, baseline, 0.25)), 2)
+        self.assertEqual(compare(results, {}, baseline, 2.0), [])
+
+    def test_framing_counts_every_frame(self):
+        results = benchmark_framing(1000)
+        self.assertTrue(results["framing.frames_per_second"]["value"] > 0)
+
+    def test_startup_is_measured(self):
+        results = benchmark_startup(1)
+        self.assertTrue(results["startup.help_ms"]["value"] > 0)
+        self.assertTrue("startup.import.ademco.cli_ms" in results)
+        self.assertTrue("startup.help_overhead_ms" in results)
+
+
+if __name__ == "__main__":
+    unittest.main()
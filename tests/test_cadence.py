@@ -0,0 +1,83 @@
+import unittest
+
+from tests.helpers import StubConnection, UPDATE_DISARMED
+
+from ademco.cadence import AdemcoUpdateCadence, STALE_THRESHOLD_DEFAULT, STALE_THRESHOLD_MINIMUM
+from ademco.events import compact_state
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+class UpdateCadenceTest(unittest.TestCase):
+
+    def test_default_threshold_until_learned(self):
+        cadence = AdemcoUpdateCadence()
+        self.assertFalse(cadence.is_stale(100.0))
+        cadence.observe(0.0)
+        self.assertEqual(cadence.threshold(), STALE_THRESHOLD_DEFAULT)
+        self.assertFalse(cadence.is_stale(STALE_THRESHOLD_DEFAULT))
+        self.assertTrue(cadence.is_stale(STALE_THRESHOLD_DEFAULT + 1))
+
+    def test_threshold_follows_cadence(self):
+        cadence = AdemcoUpdateCadence()
+        for i in range(100):
+            cadence.observe(i * 4.0)
+
+        # Gaps of 4 s fall in the 5 s bucket, so 10 s of silence is the limit
+        self.assertEqual(cadence.threshold(), 10.0)
+        self.assertFalse(cadence.is_stale(99 * 4.0 + 9))
+        self.assertTrue(cadence.is_stale(99 * 4.0 + 11))
+
+    def test_threshold_has_a_floor(self):
+        cadence = AdemcoUpdateCadence()
+        for i in range(100):
+            cadence.observe(i * 0.1)
+        self.assertEqual(cadence.threshold(), STALE_THRESHOLD_MINIMUM)
+
+
+class ServerStalenessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AdemcoServer()
+        self.server.connection = StubConnection()
+
+    def receive(self, received_at):
+        self.server.connection.receive(UPDATE_DISARMED)
+        self.server.connection.received_at = received_at
+        with QuietStderr():
+            self.server.process_queue()
+
+    def test_responses_carry_receive_time(self):
+        self.receive(12.5)
+        self.assertEqual(self.server.state_update.received_at, 12.5)
+
+    def test_silence_marks_state_stale_until_next_update(self):
+        changes = []
+        self.server.add_state_observer(changes.append)
+        self.receive(0.0)
+        version = self.server.state_version
+
+        self.assertFalse(self.server.check_staleness(10.0))
+        with QuietStderr():
+            self.assertTrue(self.server.check_staleness(STALE_THRESHOLD_DEFAULT + 1))
+            self.assertTrue(self.server.check_staleness(STALE_THRESHOLD_DEFAULT + 2))
+
+        self.assertEqual(self.server.state_version, version + 1)
+        self.assertEqual(len(changes), 2)
+        snapshot = self.server.state_snapshot()
+        self.assertTrue(snapshot["stale"])
+        self.assertTrue(compact_state(snapshot)["stale"])
+
+        # The same frame again is still a change, since it ends the staleness
+        self.receive(STALE_THRESHOLD_DEFAULT + 3)
+        self.assertFalse(self.server.state_stale)
+        self.assertEqual(self.server.state_version, version + 2)
+
+    def test_age_is_reported(self):
+        self.assertEqual(self.server.update_age_ms(5.0), None)
+        self.receive(1.0)
+        self.assertEqual(self.server.update_age_ms(3.5), 2500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from tests.helpers import StubConnection, UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.checkpoint import AdemcoCheckpoint, checkpoint_key
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def server(self, *lines):
+        server = AdemcoServer()
+        server.code = "1234"
+        server.connection = StubConnection()
+        server.connection.receive(*lines)
+        with QuietStderr():
+            server.process_queue()
+        return server
+
+    def restored(self, state):
+        server = AdemcoServer()
+        with QuietStderr():
+            server.restore_checkpoint(state)
+        return server
+
+    def test_state_survives_a_restart(self):
+        server = self.server(UPDATE_ARMED_AWAY, '%01,0500000000000000$', '%02,0100000000000000$')
+        server.connection.commands = ["12341"]
+
+        checkpoint = AdemcoCheckpoint(self.path)
+        checkpoint.save({checkpoint_key("panel", 4025): server.checkpoint_state()})
+        with open(self.path) as checkpoint_file:
+            self.assertFalse("1234" in checkpoint_file.read())
+
+        restored = self.restored(AdemcoCheckpoint(self.path).load()["panel:4025"])
+        snapshot = restored.state_snapshot()
+        self.assertEqual(snapshot["update"]["arm-mode"], "away")
+        self.assertEqual(snapshot["zones"]["open"], [1, 3])
+        self.assertEqual(snapshot["partitions"], {"1": "ready"})
+        self.assertTrue(snapshot["provisional"])
+        self.assertEqual(restored.restored_commands, ["1"])
+
+        # Restored state is never taken as the panel's answer
+        self.assertEqual(restored.is_ready_for_command(AdemcoServer.COMMAND_ARM_AWAY), None)
+
+    def test_live_update_confirms_restored_state(self):
+        restored = self.restored(self.server(UPDATE_ARMED_AWAY).checkpoint_state())
+        version = restored.state_version
+
+        restored.connection = StubConnection()
+        restored.connection.receive(UPDATE_DISARMED)
+        with QuietStderr():
+            restored.process_queue()
+
+        snapshot = restored.state_snapshot()
+        self.assertFalse(snapshot["provisional"])
+        self.assertEqual(snapshot["update"]["arm-mode"], "disarmed")
+        self.assertTrue(snapshot["version"] > version)
+
+    def test_downtime_counts_toward_age(self):
+        state = self.server(UPDATE_DISARMED).checkpoint_state()
+        state["saved-at"] -= 100
+        state["commands"] = ["2"]
+
+        restored = self.restored(state)
+        self.assertTrue(restored.update_age_ms() >= 100000)
+        self.assertTrue(restored.check_staleness())
+
+        # Commands from an old checkpoint are not sent again
+        self.assertEqual(restored.restored_commands, [])
+
+    def test_unusable_checkpoint_is_ignored(self):
+        self.assertEqual(AdemcoCheckpoint(self.path).load(), {})
+
+        with open(self.path, "w") as checkpoint_file:
+            checkpoint_file.write('{"format": 0, "panels": {"a": {}}}')
+        with QuietStderr():
+            self.assertEqual(AdemcoCheckpoint(self.path).load(), {})
+
+    def test_due_once_per_interval(self):
+        checkpoint = AdemcoCheckpoint(self.path, interval=10.0)
+        now = checkpoint.next_save
+        self.assertFalse(checkpoint.due(now - 1))
+        self.assertTrue(checkpoint.due(now))
+        self.assertFalse(checkpoint.due(now + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import subprocess
+import unittest
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+ENTRY_POINT = "from ademco.cli import main; main()"
+
+
+def run_cli(arguments, directory, **environment):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC
+    env.pop("ENVISAKIT_CONFIG", None)
+    env.update(environment)
+
+    process = subprocess.Popen([sys.executable, "-c", ENTRY_POINT] + arguments, cwd=directory, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return (process.returncode, err)
+
+
+class CLITest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_is_lazy(self):
+        # One-shot commands must not pay for the HTTP server, router, journal or history
+        loaded = subprocess.check_output([sys.executable, "-c",
+                                          "import sys, ademco.cli; print ' '.join(sorted(sys.modules))"],
+                                         env=dict(os.environ, PYTHONPATH=SRC)).split()
+        for module in ("ademco.httpapi", "ademco.router", "ademco.journal", "ademco.history", "ezmobile",
+                       "ademco.dispatch", "BaseHTTPServer"):
+            self.assertFalse(module in loaded, module)
+
+    def test_help_needs_no_configuration(self):
+        code, err = run_cli(["help"], self.directory)
+        self.assertEqual(code, 1)
+        self.assertTrue("Available commands" in err)
+
+    def test_configuration_from_environment(self):
+        code, err = run_cli(["status"], self.directory)
+        self.assertEqual(code, 1)
+        self.assertTrue("Failed to open" in err)
+
+        # Nothing listens on port 1, so the run ends with a network failure
+        path = os.path.join(self.directory, "panel.json")
+        with open(path, "w") as config_file:
+            json.dump({"host": "127.0.0.1", "port": 1, "password": "user"}, config_file)
+
+        code, err = run_cli(["status"], self.directory, ENVISAKIT_CONFIG=path)
+        self.assertEqual(code, 253)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import time
+import unittest
+
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorPanel
+from ademco.command import AdemcoCommandRun, AdemcoArmingWatch, arming_text
+from ademco.command import EXIT_SUCCESS, EXIT_ALARM_NOT_READY
+from ademco.common import RUNLOOP_INTERVAL_RAPID, QuietStderr
+
+EXIT_DELAY = 3.0
+
+
+class ArmingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = AdemcoSimulator(password="secret", update_interval=0.2,
+                                         panel=AdemcoSimulatorPanel(exit_delay=EXIT_DELAY))
+        self.loop = self.simulator.start()
+
+        self.server = AdemcoServer()
+        self.server.set_code("1234")
+        with QuietStderr():
+            self.server.connect("127.0.0.1", self.simulator.address[1], "secret")
+
+    def tearDown(self):
+        self.server.disconnect()
+        self.loop.stop()
+
+    def run_command(self, command):
+        run = AdemcoCommandRun(self.server, command)
+        with QuietStderr():
+            while run.step() is None:
+                time.sleep(RUNLOOP_INTERVAL_RAPID)
+        return run
+
+    def watch(self, arming):
+        reports = []
+        watch = AdemcoArmingWatch(self.server, arming, reports.append)
+        with QuietStderr():
+            while watch.step() is None:
+                time.sleep(RUNLOOP_INTERVAL_RAPID)
+        return (watch, reports)
+
+    def test_arm_is_confirmed_at_start_of_exit_delay(self):
+        run = self.run_command(AdemcoServer.COMMAND_ARM_AWAY)
+
+        self.assertEqual(run.result, EXIT_SUCCESS)
+        self.assertTrue(run.elapsed() < EXIT_DELAY, run.elapsed())
+        self.assertEqual(run.arming["state"], "arming")
+        self.assertTrue(0 < run.arming["remaining"] <= EXIT_DELAY, run.arming)
+        self.assertFalse(self.simulator.panel.is_armed())
+
+        watch, reports = self.watch(run.arming)
+        self.assertEqual(watch.result, EXIT_SUCCESS)
+        self.assertEqual(reports[-1], {"state": "armed"})
+        self.assertTrue(self.simulator.panel.is_armed())
+
+    def test_waits_for_armed_when_disabled(self):
+        self.server.config_confirm_exit_delay = False
+        run = self.run_command(AdemcoServer.COMMAND_ARM_AWAY)
+
+        self.assertEqual(run.result, EXIT_SUCCESS)
+        self.assertEqual(run.arming, {"state": "armed"})
+        self.assertTrue(self.simulator.panel.is_armed())
+
+    def test_disarm_during_exit_delay_ends_watch(self):
+        run = self.run_command(AdemcoServer.COMMAND_ARM_AWAY)
+        self.assertEqual(run.arming["state"], "arming")
+
+        self.server.issue_command(AdemcoServer.COMMAND_DISARM)
+        watch, reports = self.watch(run.arming)
+        self.assertEqual(watch.result, EXIT_ALARM_NOT_READY)
+        self.assertFalse(self.simulator.panel.is_armed())
+
+    def test_arming_text(self):
+        self.assertEqual(arming_text({"state": "arming", "remaining": 42}), "Arming, 42 seconds remaining")
+        self.assertEqual(arming_text({"state": "arming", "remaining": None}), "Arming")
+        self.assertEqual(arming_text({"state": "armed"}), "Armed")
+
+
+if __name__ == '__main__':
+    unittest.main()
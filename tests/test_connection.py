@@ -0,0 +1,30 @@
+import unittest
+
+from tests.helpers import UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco import connection
+from ademco.connection import AdemcoServerConnection
+
+
+class FramingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = AdemcoServerConnection(None, None, None)
+
+    def test_frames_split_across_reads(self):
+        data = UPDATE_DISARMED + '\r\n' + UPDATE_ARMED_AWAY + '\r\n'
+        for offset in range(0, len(data), 7):
+            self.connection._receive_data(data[offset:offset + 7])
+        self.assertEqual(self.connection.pop_responses(), [UPDATE_DISARMED, UPDATE_ARMED_AWAY])
+        self.assertEqual(self.connection.pop_responses(), [])
+
+    def test_queue_drops_oldest_past_limit(self):
+        lines = ['%%FF,%d$' % i for i in range(connection.RESPONSE_QUEUE_LIMIT + 10)]
+        self.connection._receive_data('\r\n'.join(lines) + '\r\n')
+        responses = self.connection.pop_responses()
+        self.assertEqual(len(responses), connection.RESPONSE_QUEUE_LIMIT)
+        self.assertEqual(responses[-1], lines[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import threading
+import unittest
+import time
+
+from tests.helpers import StubConnection, UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.dispatch import AdemcoEventDispatcher, DISPATCH_COMPACT, DISPATCH_DROP_OLDEST, DISPATCH_DROP_NEWEST
+from ademco.events import AdemcoStateEvent
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+ZONES = ['%01,0100000000000000$', '%01,0200000000000000$', '%01,0400000000000000$', '%01,0800000000000000$']
+
+
+def event(version):
+    return AdemcoStateEvent(version, {"zones": [version - 1]}, {"zones": [version]})
+
+
+class DispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AdemcoServer()
+        self.server.connection = StubConnection()
+
+    def receive(self, *lines):
+        self.server.connection.receive(*lines)
+        with QuietStderr():
+            self.server.process_queue()
+
+    def test_slow_callback_does_not_hold_up_the_runloop(self):
+        release = threading.Event()
+        seen = []
+        self.server.add_event_callback(lambda event: release.wait(5.0))
+        self.server.add_event_callback(lambda event: seen.append(event.state["arm-mode"]), name="fast")
+
+        began = time.time()
+        self.receive(UPDATE_DISARMED)
+        self.receive(UPDATE_ARMED_AWAY)
+        self.assertTrue(time.time() - began < 0.5)
+
+        # The fast callback is not stuck behind the slow one
+        deadline = time.time() + 5.0
+        while len(seen) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(seen, ["disarmed", "away"])
+
+        release.set()
+        self.assertTrue(self.server.event_dispatcher.wait_idle(5.0))
+        stats = self.server.event_dispatcher.stats()
+        self.assertEqual(stats["fast"]["calls"], 2)
+        self.assertEqual(stats["<lambda>"]["calls"], 2)
+
+    def test_callback_sees_events_in_order(self):
+        seen = []
+
+        def record(event):
+            time.sleep(0.001)
+            seen.append(event.state["zones"])
+
+        self.server.add_event_callback(record)
+        self.receive(UPDATE_DISARMED)
+        for line in ZONES * 5:
+            self.receive(line)
+        self.server.event_dispatcher.wait_idle(5.0)
+
+        self.assertEqual(len(seen), 21)
+        self.assertEqual(seen[-4:], [[1], [2], [3], [4]])
+
+    def test_failing_callback_is_counted(self):
+        queue = self.server.add_event_callback(lambda event: 1 / 0, name="broken")
+        with QuietStderr():
+            self.receive(UPDATE_DISARMED)
+            self.server.event_dispatcher.wait_idle(5.0)
+        self.assertEqual((queue.stats()["calls"], queue.stats()["failures"]), (1, 1))
+
+
+class OverflowTest(unittest.TestCase):
+
+    def push_while_stopped(self, policy):
+        # Without workers nothing is taken off the queue
+        dispatcher = AdemcoEventDispatcher(AdemcoServer(), workers=0)
+        seen = []
+        queue = dispatcher.add_callback(lambda event: seen.append(event), policy=policy, queue_limit=2)
+        for version in range(1, 5):
+            dispatcher.dispatch(event(version))
+
+        dispatcher.workers = 1
+        dispatcher.start()
+        dispatcher.stop(5.0)
+        return (queue.stats(), seen)
+
+    def test_compact_keeps_final_state(self):
+        stats, seen = self.push_while_stopped(DISPATCH_COMPACT)
+        self.assertEqual([i.version for i in seen], [1, 4])
+        self.assertEqual(seen[1].compacted, 2)
+        self.assertEqual(seen[1].previous, {"zones": [1]})
+        self.assertEqual(stats["compacted"], 2)
+
+    def test_drop_oldest(self):
+        stats, seen = self.push_while_stopped(DISPATCH_DROP_OLDEST)
+        self.assertEqual([i.version for i in seen], [3, 4])
+        self.assertEqual(stats["dropped"], 2)
+
+    def test_drop_newest(self):
+        stats, seen = self.push_while_stopped(DISPATCH_DROP_NEWEST)
+        self.assertEqual([i.version for i in seen], [1, 2])
+        self.assertEqual(stats["dropped"], 2)
+
+    def test_unknown_policy(self):
+        dispatcher = AdemcoEventDispatcher(AdemcoServer(), workers=0)
+        self.assertRaises(ValueError, dispatcher.add_callback, lambda event: None, policy="nope")
+
+
+if __name__ == '__main__':
+    unittest.main()
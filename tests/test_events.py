@@ -0,0 +1,76 @@
+import json
+import unittest
+
+from tests.helpers import UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.events import AdemcoEventBroker, AdemcoEventSubscriber, AdemcoStateEvent
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+def state(zones):
+    return {"arm-mode": "disarmed", "zones": zones}
+
+
+class SubscriberTest(unittest.TestCase):
+
+    def test_buffer_compacts_at_limit(self):
+        subscriber = AdemcoEventSubscriber(limit=4)
+        previous = state([])
+        for version in range(1, 11):
+            current = state([version])
+            subscriber.push(AdemcoStateEvent(version, previous, current))
+            previous = current
+
+        self.assertEqual(len(subscriber.events), 4)
+
+        # The merged head spans every dropped transition and ends where the next one starts
+        head = subscriber.pop(0).event_dict()
+        self.assertEqual(head["version"], 7)
+        self.assertEqual(head["compacted"], 6)
+        self.assertEqual(head["zones-opened"], [7])
+        self.assertEqual(head["zones-closed"], [])
+        self.assertEqual([subscriber.pop(0).version for i in range(3)], [8, 9, 10])
+        self.assertEqual(subscriber.pop(0), None)
+
+
+class BrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AdemcoServer()
+        self.broker = AdemcoEventBroker(self.server)
+
+    def receive(self, frame):
+        with QuietStderr():
+            self.server._process_response(frame)
+
+    def test_first_event_is_current_state(self):
+        self.receive(UPDATE_DISARMED)
+        subscriber = self.broker.subscribe()
+        event = subscriber.pop(0).event_dict()
+        self.assertEqual(event["state"]["arm-mode"], "disarmed")
+
+    def test_changes_are_delivered_in_order(self):
+        subscriber = self.broker.subscribe()
+        subscriber.pop(0)
+        self.receive(UPDATE_DISARMED)
+        self.receive('%01,0400000000000000$')
+        self.receive(UPDATE_ARMED_AWAY)
+
+        events = [json.loads(subscriber.pop(0).event_json()) for i in range(3)]
+        self.assertEqual(events[1]["zones-opened"], [3])
+        self.assertEqual(events[2]["state"]["arm-mode"], "away")
+        self.assertEqual(subscriber.pop(0), None)
+
+    def test_failing_observer_does_not_stop_processing(self):
+        def fail(version):
+            raise ValueError("observer failure")
+        self.server.add_state_observer(fail)
+        subscriber = self.broker.subscribe()
+        subscriber.pop(0)
+        self.receive(UPDATE_DISARMED)
+        self.assertEqual(subscriber.pop(0).state["arm-mode"], "disarmed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from ezmobile.cache import EZMobileDiscoveryCache
+
+DISCOVERY = [{"command": 100, "action": "https://portal/arm", "method": "post",
+              "data": [["mid", "1"], ["did", "2"]], "slots": ["pin"]}]
+
+
+class DiscoveryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = EZMobileDiscoveryCache(os.path.join(self.directory, "cache.json"), ttl=60)
+        self.key = EZMobileDiscoveryCache.key("https://portal", "1", "2", 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_file_is_a_miss(self):
+        self.assertEqual(self.cache.load(self.key), None)
+
+    def test_round_trip_until_expiry(self):
+        self.assertTrue(self.cache.store(self.key, DISCOVERY, now=1000))
+        self.assertEqual(self.cache.load(self.key, now=1030), DISCOVERY)
+        self.assertEqual(self.cache.load(self.key, now=1061), None)
+
+    def test_keys_separate_devices_and_ignore_lists(self):
+        keys = set([
+            self.key,
+            EZMobileDiscoveryCache.key("https://portal", "1", "3", 1),
+            EZMobileDiscoveryCache.key("https://portal", "1", "2", 2),
+            EZMobileDiscoveryCache.key("https://portal", "1", "2", 1, ["cancel"]),
+        ])
+        self.assertEqual(len(keys), 4)
+
+    def test_invalidate(self):
+        self.cache.store(self.key, DISCOVERY)
+        self.cache.invalidate(self.key)
+        self.assertEqual(self.cache.load(self.key), None)
+
+    def test_corrupt_file_is_a_miss(self):
+        with open(self.cache.path, 'w') as cache_file:
+            cache_file.write("{not json")
+        self.assertEqual(self.cache.load(self.key), None)
+        self.assertTrue(self.cache.store(self.key, DISCOVERY))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from ezmobile.extract import extract, EZMobileLinkExtractor, EZMobileFormExtractor, EZMobilePartitionExtractor
+
+
+class FakeResponse:
+
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+        self.finished = False
+
+    def read(self, amount=None):
+        amount = amount if amount is not None else len(self.body)
+        data = self.body[self.position:self.position + amount]
+        self.position += len(data)
+        return data
+
+    def finish(self):
+        self.finished = True
+
+
+COMMAND_PAGE = '''<html><body><ul>
+<li><a href="/m?c=1">Arm Away</a></li>
+<li><a href="/m?c=2"> Disarm </a></li>
+<li><a href="/m?c=3">Chime &amp; more</a></li>
+</ul></body></html>'''
+
+FORM_PAGE = '''<html><body>
+<form action="/submit/1" method="post">
+<input type="hidden" name="mid" value="abc">
+<input name="code" />
+</form>
+''' + "<p>filler</p>\n" * 2000 + '''</body></html>'''
+
+PARTITION_PAGE = '''<html><body>
+<div><h3>Partition 1</h3><p> Ready to Arm </p></div>
+<div><h3>Zones</h3><p>ignored</p></div>
+<div><h3>Partition 2</h3><p>Armed Away</p></div>
+</body></html>'''
+
+
+class ExtractTest(unittest.TestCase):
+
+    def test_links(self):
+        response = FakeResponse(COMMAND_PAGE)
+        links = extract(response, EZMobileLinkExtractor(), chunk_size=7)
+        self.assertEqual(links, [("/m?c=1", "Arm Away"), ("/m?c=2", "Disarm"), ("/m?c=3", "Chime & more")])
+        self.assertTrue(response.finished)
+
+    def test_form_stops_reading_at_end_of_form(self):
+        response = FakeResponse(FORM_PAGE)
+        action, method, inputs = extract(response, EZMobileFormExtractor(), chunk_size=64)
+        self.assertEqual((action, method), ("/submit/1", "post"))
+        self.assertEqual(inputs, [{"type": "hidden", "name": "mid", "value": "abc"}, {"name": "code"}])
+        self.assertTrue(response.position < 1024)
+        self.assertTrue(response.finished)
+
+    def test_missing_form(self):
+        self.assertEqual(extract(FakeResponse(COMMAND_PAGE), EZMobileFormExtractor()), None)
+
+    def test_partitions(self):
+        statuses = extract(FakeResponse(PARTITION_PAGE), EZMobilePartitionExtractor(), chunk_size=5)
+        self.assertEqual(statuses, {"1": "ready to arm", "2": "armed away"})
+
+    def test_bad_markup_keeps_what_was_found(self):
+        response = FakeResponse('<a href="/m?c=1">Arm Away</a><!DOCTYPE <<<\x00')
+        links = extract(response, EZMobileLinkExtractor())
+        self.assertEqual(links, [("/m?c=1", "Arm Away")])
+        self.assertTrue(response.finished)
+
+
+if __name__ == '__main__':
+    unittest.main()
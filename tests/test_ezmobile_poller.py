@@ -0,0 +1,147 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from ezmobile.pool import EZMobileConnectionPool, EZMobileHTTPError
+from ezmobile.extract import EZMobilePartitionExtractor, EZMobileLinkExtractor
+from ezmobile.alarm import partition_page_url
+from ezmobile.poller import EZMobilePoller, EZMobilePageCache, load_devices
+
+PORTAL_DELAY = 0.2
+
+PARTITION_PAGE = '''<html><body>
+<div><h3>Partition 1</h3><p>Ready to Arm</p></div>
+<div><h3>Partition 2</h3><p>%s</p></div>
+</body></html>'''
+
+
+class PortalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("If-None-Match")))
+        time.sleep(PORTAL_DELAY)
+
+        if "did=broken" in self.path:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = '"%d"' % server.version
+        if self.headers.get("If-None-Match") == etag or "did=stale" in self.path:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = PARTITION_PAGE % ("Armed Away" if server.version > 1 else "Disarmed")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PortalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class PollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PortalServer(("127.0.0.1", 0), PortalHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.version = 1
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d/m" % self.server.server_address[1]
+        self.pool = EZMobileConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_simultaneous_callers_share_one_fetch(self):
+        cache = EZMobilePageCache(self.pool, ttl=60)
+        url = partition_page_url(self.url, "1", "2")
+
+        workers = ThreadPool(8)
+        results = workers.map(lambda i: cache.get(url, EZMobilePartitionExtractor), range(8))
+        workers.close()
+        workers.join()
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(results, [{"1": "ready to arm", "2": "disarmed"}] * 8)
+
+        cache.get(url, EZMobilePartitionExtractor)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_expired_entry_is_revalidated(self):
+        cache = EZMobilePageCache(self.pool, ttl=0)
+        url = partition_page_url(self.url, "1", "2")
+
+        cache.get(url, EZMobilePartitionExtractor)
+        self.assertEqual(cache.get(url, EZMobilePartitionExtractor), {"1": "ready to arm", "2": "disarmed"})
+        self.assertEqual(self.server.requests[1][1], '"1"')
+        self.assertEqual((cache.fetches, cache.not_modified), (1, 1))
+
+        self.server.version = 2
+        self.assertEqual(cache.get(url, EZMobilePartitionExtractor), {"1": "ready to arm", "2": "armed away"})
+        self.assertEqual((cache.fetches, cache.not_modified), (2, 1))
+
+    def test_extractors_are_cached_separately(self):
+        cache = EZMobilePageCache(self.pool, ttl=60)
+        url = partition_page_url(self.url, "1", "2")
+
+        self.assertEqual(cache.get(url, EZMobilePartitionExtractor), {"1": "ready to arm", "2": "disarmed"})
+        self.assertEqual(cache.get(url, EZMobileLinkExtractor), [])
+        self.assertEqual(cache.fetches, 2)
+
+        cache.invalidate(url)
+        self.assertEqual(cache.entries, {})
+
+    def test_unexpected_not_modified_is_an_error(self):
+        cache = EZMobilePageCache(self.pool, ttl=60)
+        url = partition_page_url(self.url, "1", "stale")
+
+        self.assertRaises(EZMobileHTTPError, cache.get, url, EZMobilePartitionExtractor)
+        self.assertEqual(cache.entries, {})
+
+    def test_devices_are_polled_concurrently(self):
+        devices = load_devices({"mobile-url": self.url,
+                                "devices": [{"name": "device%d" % i, "mid": "1", "did": str(i)} for i in range(6)] +
+                                           [{"name": "broken", "mid": "1", "did": "broken"}]})
+        poller = EZMobilePoller(devices, connection_pool=self.pool)
+
+        started = time.time()
+        statuses, errors = poller.poll()
+        elapsed = time.time() - started
+
+        self.assertEqual(sorted(statuses), ["device%d" % i for i in range(6)])
+        self.assertEqual(statuses["device0"], {"1": "ready to arm", "2": "disarmed"})
+        self.assertEqual(list(errors), ["broken"])
+        self.assertTrue(elapsed < PORTAL_DELAY * 3, elapsed)
+
+    def test_load_devices(self):
+        self.assertEqual(load_devices({"mobile-url": "http://portal/m", "mid": "1", "did": "2", "partition": 1}),
+                         [{"mobile-url": "http://portal/m", "mid": "1", "did": "2", "partition": 1, "name": "1/2"}])
+        self.assertRaises(ValueError, load_devices, {"devices": [{"mid": "1", "did": "2"}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
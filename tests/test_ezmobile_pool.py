@@ -0,0 +1,107 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+import httplib
+
+from multiprocessing.pool import ThreadPool
+
+from ezmobile.pool import EZMobileConnectionPool, EZMobileHTTPError
+
+
+class PortalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, headers=()):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _hang_up(self):
+        # Takes the request, then drops the connection without answering
+        self.server.hang_ups += 1
+        self.close_connection = 1
+
+    def do_GET(self):
+        if self.path == "/hangup":
+            self._hang_up()
+        elif self.path == "/redirect":
+            self._send(302, "", [("Location", "/page?moved=1")])
+        elif self.path.startswith("/page"):
+            self._send(200, "<html>%s</html>" % self.path)
+        else:
+            self._send(404, "missing")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/hangup":
+            self._hang_up()
+        else:
+            self._send(200, "posted " + body)
+
+
+class PortalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    hang_ups = 0
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PortalServer(("127.0.0.1", 0), PortalHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.pool = EZMobileConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sequential_requests_share_one_connection(self):
+        for i in range(5):
+            self.assertEqual(self.pool.request("GET", self.url + "/page%d" % i).read(), "<html>/page%d</html>" % i)
+        self.assertEqual(self.pool.request("POST", self.url + "/form", "a=1").read(), "posted a=1")
+        self.assertEqual(self.pool.connections_opened, 1)
+
+    def test_redirects_are_followed(self):
+        self.assertEqual(self.pool.request("GET", self.url + "/redirect").read(), "<html>/page?moved=1</html>")
+
+    def test_errors_raise_with_code(self):
+        with self.assertRaises(EZMobileHTTPError) as context:
+            self.pool.request("GET", self.url + "/missing")
+        self.assertEqual(context.exception.code, 404)
+
+    def test_sent_command_is_not_retried(self):
+        self.pool.request("GET", self.url + "/page").read()
+        self.assertRaises(httplib.BadStatusLine, self.pool.request, "POST", self.url + "/hangup", "a=1")
+        self.assertEqual(self.server.hang_ups, 1)
+
+        # A page can be asked for again on a fresh connection
+        self.pool.request("GET", self.url + "/page").read()
+        self.assertRaises(httplib.BadStatusLine, self.pool.request, "GET", self.url + "/hangup")
+        self.assertEqual(self.server.hang_ups, 3)
+
+    def test_concurrent_requests(self):
+        workers = ThreadPool(4)
+        try:
+            pages = workers.map(lambda i: self.pool.request("GET", self.url + "/page%d" % i).read(), range(12))
+        finally:
+            workers.close()
+            workers.join()
+
+        self.assertEqual(pages, ["<html>/page%d</html>" % i for i in range(12)])
+        self.assertTrue(self.pool.connections_opened <= 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import tempfile
+import shutil
+import socket
+import json
+import os
+
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorLoop, AdemcoSimulatorPanel
+from ademco.fleet import AdemcoFleet, load_panels
+from ademco.common import QuietStderr
+
+PANEL_COUNT = 8
+EXIT_DELAY = 0.5
+
+
+def unused_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = AdemcoSimulatorLoop()
+        self.simulators = []
+        for i in range(PANEL_COUNT):
+            simulator = AdemcoSimulator(password="secret", update_interval=0.2,
+                                        panel=AdemcoSimulatorPanel(exit_delay=EXIT_DELAY))
+            self.loop.add(simulator)
+            self.simulators.append(simulator)
+        self.loop.start()
+
+        self.panels = [{"name": "site%d" % i, "host": "127.0.0.1", "port": j.address[1], "password": "secret"}
+                       for (i, j) in enumerate(self.simulators)]
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def test_arm_sweep_runs_concurrently(self):
+        results = []
+        with QuietStderr():
+            summary = AdemcoFleet(self.panels).run(AdemcoServer.COMMAND_ARM_AWAY, "1234", callback=results.append)
+
+        self.assertEqual(summary["results"], {"ok": PANEL_COUNT})
+        self.assertEqual(sorted([i["panel"] for i in results]), sorted([i["name"] for i in self.panels]))
+        self.assertTrue(all([i.panel.arm_state is not None for i in self.simulators]))
+
+        # Each panel is done once its exit delay starts, countdown included
+        self.assertTrue(all([i["arming"]["state"] in ("arming", "armed") for i in results]), results)
+        self.assertTrue(summary["seconds"] < EXIT_DELAY * 3, summary)
+
+    def test_arm_sweep_waits_for_exit_delay(self):
+        with QuietStderr():
+            summary = AdemcoFleet(self.panels, wait_armed=True).run(AdemcoServer.COMMAND_ARM_AWAY, "1234")
+
+        self.assertEqual(summary["results"], {"ok": PANEL_COUNT})
+        self.assertTrue(all([i.panel.is_armed() for i in self.simulators]))
+
+    def test_failures_are_reported_per_panel(self):
+        self.simulators[0].panel.open_zones.add(5)
+        panels = self.panels + [{"name": "unreachable", "host": "127.0.0.1", "port": unused_port(), "password": "x"}]
+
+        with QuietStderr():
+            summary = AdemcoFleet(panels, concurrency=3).run(AdemcoServer.COMMAND_ARM_AWAY, "1234")
+
+        self.assertEqual(summary["results"], {"ok": PANEL_COUNT - 1, "not-ready": 1, "network-failure": 1})
+        self.assertEqual(summary["failed"], ["site0", "unreachable"])
+
+    def test_deadline(self):
+        with QuietStderr():
+            result = AdemcoFleet(self.panels, deadline=EXIT_DELAY / 2, wait_armed=True).run_panel(
+                self.panels[0], AdemcoServer.COMMAND_ARM_AWAY, "1234")
+
+        self.assertEqual(result["result"], "timeout")
+        self.assertTrue(result["issued"])
+
+    def test_status(self):
+        with QuietStderr():
+            result = AdemcoFleet(self.panels).run_panel(self.panels[0], AdemcoServer.COMMAND_STATUS)
+        self.assertEqual(result["result"], "ok")
+        self.assertTrue(result["status"]["ready"])
+        self.assertEqual(self.simulators[0].commands, [])
+
+    def test_load_panels(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "fleet.json")
+            with open(path, "w") as fleet_file:
+                json.dump({"password": "secret", "panels": [{"host": "a", "tags": ["east"]}, {"host": "b", "port": 1}]},
+                          fleet_file)
+            self.assertEqual([(i["name"], i["port"], i["password"]) for i in load_panels(path)],
+                             [("a:4025", 4025, "secret"), ("b:1", 1, "secret")])
+            self.assertEqual([i["host"] for i in load_panels(path, ["east"])], ["a"])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
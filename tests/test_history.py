@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ademco import journal
+from ademco.history import AdemcoHistory, parse_history_time
+from ademco.journal import AdemcoJournal
+
+DISARMED = '%00,01,1C08,00,00,****DISARMED****  Ready to Arm  $'
+ARMED = '%00,01,8C04,00,00,ARMED ***AWAY***               $'
+AC_LOSS = '%00,01,1C00,00,00,****DISARMED****  AC LOSS       $'
+FAULT_7 = '%00,01,0C08,07,00,FAULT 07 BACK DOOR              $'
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "panel.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, entries):
+        writer = AdemcoJournal(self.path)
+        for (seconds, line) in entries:
+            writer.queue.put((seconds * 1000, journal.DIRECTION_RECEIVED, line))
+        writer.close()
+        return AdemcoHistory.from_journal(self.path)
+
+    def test_transitions_and_last_armed(self):
+        history = self.load([(10, DISARMED), (20, DISARMED), (30, ARMED), (40, ARMED), (50, DISARMED)])
+        self.assertEqual(history.transitions("armed"), [(10.0, False), (30.0, True), (50.0, False)])
+        self.assertEqual(history.last_transition("armed", True), 30.0)
+        self.assertEqual(history.transitions("armed", start=35), [(40.0, True), (50.0, False)])
+
+    def test_durations(self):
+        history = self.load([(0, DISARMED), (100, AC_LOSS), (400, DISARMED), (500, DISARMED)])
+        self.assertEqual(history.durations("ac-present"), {True: 200.0, False: 300.0})
+        self.assertEqual(history.durations("ac-present", start=200, end=450), {True: 50.0, False: 200.0})
+
+    def test_zone_faults_from_keypad(self):
+        history = self.load([(0, FAULT_7), (10, FAULT_7), (20, DISARMED), (30, FAULT_7)])
+        self.assertEqual(history.zone_fault_counts(), {7: 2})
+
+    def test_zone_faults_from_zone_changes(self):
+        history = self.load([(0, '%01,4000000000000000$'), (5, '%01,0000000000000000$'), (9, '%01,4000000000000000$')])
+        self.assertEqual(history.zone_fault_counts(), {7: 2})
+        self.assertEqual(history.zone_fault_counts(start=6), {7: 1})
+
+    def test_query(self):
+        history = self.load([(10, DISARMED), (30, ARMED)])
+        self.assertEqual(history.query("last:armed"), {"true": 30.0, "false": 10.0})
+        self.assertRaises(ValueError, history.query, "last:unknown")
+        self.assertRaises(ValueError, history.query, "unknown")
+
+    def test_parse_history_time(self):
+        self.assertEqual(parse_history_time("1500000000"), 1500000000.0)
+        self.assertEqual(parse_history_time("2020-01-02"), parse_history_time("2020-01-02T00:00"))
+        self.assertRaises(ValueError, parse_history_time, "yesterday")
+
+
+if __name__ == "__main__":
+    unittest.main()
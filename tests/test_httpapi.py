@@ -0,0 +1,77 @@
+import threading
+import json
+import unittest
+import urllib2
+
+from tests.helpers import UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.httpapi import AdemcoHTTPServer, parse_listen_address
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+class HTTPStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AdemcoServer()
+        self.receive(UPDATE_DISARMED)
+        self.http_server = AdemcoHTTPServer(("127.0.0.1", 0), self.server)
+        self.http_server.start()
+        self.url = "http://127.0.0.1:%d" % self.http_server.server_address[1]
+
+    def tearDown(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def receive(self, frame):
+        with QuietStderr():
+            self.server._process_response(frame)
+
+    def get(self, path, etag=None):
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.url + path, headers=headers), timeout=5)
+            return (response.getcode(), response.info().get("ETag"), response.read())
+        except urllib2.HTTPError as e:
+            return (e.code, e.info().get("ETag"), None)
+
+    def test_matching_etag_returns_not_modified(self):
+        code, etag, body = self.get("/status")
+        self.assertEqual(code, 200)
+        self.assertIn('"arm-mode": "disarmed"', body)
+        self.assertEqual(self.get("/status", etag)[0], 304)
+
+    def test_status_reports_age_and_staleness(self):
+        body = json.loads(self.get("/status")[2])
+        self.assertFalse(body["stale"])
+        self.assertTrue(body["age-ms"] >= 0)
+
+    def test_etag_changes_with_state(self):
+        etag = self.get("/status")[1]
+        self.receive(UPDATE_ARMED_AWAY)
+        code, new_etag, body = self.get("/status", etag)
+        self.assertEqual(code, 200)
+        self.assertNotEqual(etag, new_etag)
+
+    def test_wait_times_out_with_not_modified(self):
+        etag = self.get("/status")[1]
+        self.assertEqual(self.get("/status/wait?timeout=0.1", etag)[0], 304)
+
+    def test_wait_returns_on_change(self):
+        etag = self.get("/status")[1]
+        timer = threading.Timer(0.1, self.receive, (UPDATE_ARMED_AWAY,))
+        timer.start()
+        code, new_etag, body = self.get("/status/wait?timeout=5", etag)
+        timer.join()
+        self.assertEqual(code, 200)
+        self.assertIn('"arm-mode": "away"', body)
+
+    def test_parse_listen_address(self):
+        self.assertEqual(parse_listen_address("8080"), ("127.0.0.1", 8080))
+        self.assertEqual(parse_listen_address("0.0.0.0:9000"), ("0.0.0.0", 9000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+import tempfile
+import shutil
+import socket
+import json
+import time
+import os
+
+from tests.helpers import UPDATE_ARMED_AWAY
+
+from ademco.inventory import AdemcoInventory, AdemcoInventoryWatcher
+from ademco.monitor import AdemcoFleetMonitor
+from ademco.checkpoint import AdemcoCheckpoint
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorLoop
+from ademco.common import QuietStderr
+
+PANELS = [
+    {"id": "home", "host": "10.0.0.1", "password": "a", "tags": ["residential", "east"]},
+    {"id": "shop", "host": "10.0.0.2", "port": 4026, "password": "b", "tags": ["retail", "east"]},
+    {"id": "barn", "host": "10.0.0.3", "password": "c", "tags": ["residential"], "partitions": [1, 2]},
+]
+
+
+class InventoryTest(unittest.TestCase):
+
+    def test_index(self):
+        inventory = AdemcoInventory.from_dict({"code": "1234", "panels": PANELS})
+        self.assertEqual(len(inventory), 3)
+        self.assertEqual(inventory.get("shop")["port"], 4026)
+        self.assertEqual(inventory.get("home")["port"], 4025)
+        self.assertEqual(inventory.get("home")["code"], "1234")
+        self.assertEqual([i["id"] for i in inventory.tagged("residential")], ["home", "barn"])
+        self.assertEqual([i["id"] for i in inventory.tagged("residential", "east")], ["home"])
+        self.assertEqual(inventory.tagged("missing"), [])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, AdemcoInventory.from_dict, [{"host": "a"}])
+        self.assertRaises(ValueError, AdemcoInventory.from_dict, [{"id": "x", "host": "a", "password": "p"},
+                                                                  {"id": "x", "host": "b", "password": "p"}])
+
+    def test_diff(self):
+        old = AdemcoInventory.from_dict(PANELS)
+        panels = [dict(i) for i in PANELS[:2]] + [{"id": "mill", "host": "10.0.0.4", "password": "d"}]
+        panels[0]["tags"] = ["residential"]
+        panels[1]["password"] = "changed"
+
+        self.assertEqual(old.diff(AdemcoInventory.from_dict(panels)), (["mill"], ["barn"], ["shop"], ["home"]))
+        self.assertEqual(old.diff(AdemcoInventory.from_dict(PANELS)), ([], [], [], []))
+
+    def test_watcher_reloads_only_on_change(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "inventory.json")
+            with open(path, "w") as inventory_file:
+                json.dump(PANELS, inventory_file)
+
+            watcher = AdemcoInventoryWatcher(path)
+            self.assertEqual(len(watcher.check()), 3)
+            self.assertEqual(watcher.check(), None)
+
+            with open(path, "w") as inventory_file:
+                json.dump(PANELS[:1], inventory_file)
+            self.assertEqual(len(watcher.check()), 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_watcher_load_requires_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "inventory.json")
+            watcher = AdemcoInventoryWatcher(path)
+            self.assertRaises(IOError, watcher.load)
+
+            with open(path, "w") as inventory_file:
+                json.dump(PANELS, inventory_file)
+            self.assertEqual(len(watcher.load()), 3)
+            self.assertEqual(watcher.check(), None)
+        finally:
+            shutil.rmtree(directory)
+
+
+class FleetMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = AdemcoSimulatorLoop()
+        self.simulators = [AdemcoSimulator(password="secret", update_interval=0.1, max_sessions=2) for i in range(3)]
+        for simulator in self.simulators:
+            self.loop.add(simulator)
+        self.loop.start()
+
+    def tearDown(self):
+        self.monitor.close()
+        self.loop.stop()
+
+    def inventory(self, count, **changes):
+        panels = [{"id": "panel%d" % i, "host": "127.0.0.1", "port": j.address[1], "password": "secret"}
+                  for (i, j) in enumerate(self.simulators[:count])]
+        for (panel_id, change) in changes.items():
+            panels[int(panel_id[-1])].update(change)
+        return AdemcoInventory.from_dict(panels)
+
+    def run_for(self, seconds):
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            self.monitor.run_once(0.01)
+
+    def test_reload_touches_only_changed_sessions(self):
+        with QuietStderr():
+            self.monitor = AdemcoFleetMonitor(self.inventory(2))
+            self.monitor.start()
+            self.run_for(0.3)
+
+            kept = self.monitor.servers["panel0"]
+            version = kept.state_version
+            self.assertTrue(version > 0)
+
+            result = self.monitor.apply(self.inventory(3, panel0={"tags": ["new"]}, panel1={"password": "changed"}))
+            self.run_for(0.3)
+
+        self.assertEqual(result, (["panel2"], [], ["panel1"], ["panel0"]))
+        self.assertTrue(self.monitor.servers["panel0"] is kept)
+        self.assertTrue(kept.state_version >= version)
+        self.assertEqual((self.monitor.opened, self.monitor.closed), (4, 1))
+
+        # The simulators reject the changed password, so panel1 waits for a retry
+        snapshot = self.monitor.snapshot()
+        self.assertTrue(snapshot["panel0"]["connected"])
+        self.assertFalse(snapshot["panel1"]["connected"])
+        self.assertTrue(snapshot["panel2"]["update"]["ready"])
+
+    def test_slow_login_does_not_hold_up_sessions(self):
+        # Accepts connections but never sends the login prompt
+        silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        silent.bind(("127.0.0.1", 0))
+        silent.listen(1)
+        try:
+            with QuietStderr():
+                self.monitor = AdemcoFleetMonitor(self.inventory(1))
+                self.monitor.start()
+                self.run_for(0.2)
+
+                kept = self.monitor.servers["panel0"]
+                inventory = self.inventory(1).panels() + [
+                    {"id": "silent", "host": "127.0.0.1", "port": silent.getsockname()[1], "password": "secret"}]
+
+                began = time.time()
+                self.monitor.apply(AdemcoInventory.from_dict(inventory))
+                self.assertTrue(time.time() - began < 0.5)
+
+                # panel0 is still read while the other login hangs
+                self.run_for(0.5)
+                self.assertTrue(kept.update_age_ms() < 300, kept.update_age_ms())
+                self.assertFalse(self.monitor.snapshot()["silent"]["connected"])
+        finally:
+            silent.close()
+
+    def test_removed_panels_are_closed(self):
+        with QuietStderr():
+            self.monitor = AdemcoFleetMonitor(self.inventory(3))
+            self.monitor.start()
+            self.monitor.apply(self.inventory(1))
+
+        self.assertEqual(sorted(self.monitor.servers), ["panel0"])
+        self.assertEqual(self.monitor.closed, 2)
+
+    def test_sessions_start_from_checkpoint(self):
+        directory = tempfile.mkdtemp()
+        try:
+            saved = AdemcoServer()
+            saved.restore_checkpoint({"update": UPDATE_ARMED_AWAY})
+            checkpoint = AdemcoCheckpoint(os.path.join(directory, "checkpoint.json"))
+            checkpoint.save({"panel0": saved.checkpoint_state()})
+
+            with QuietStderr():
+                self.monitor = AdemcoFleetMonitor(self.inventory(2), checkpoint=checkpoint)
+                self.monitor.start()
+                self.assertEqual(self.monitor.snapshot()["panel0"]["update"]["arm-mode"], "away")
+                self.assertTrue(self.monitor.snapshot()["panel0"]["provisional"])
+
+                self.run_for(0.3)
+                self.monitor.save_checkpoint()
+
+            self.assertFalse(self.monitor.snapshot()["panel0"]["provisional"])
+            self.assertEqual(sorted(checkpoint.load()), ["panel0", "panel1"])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
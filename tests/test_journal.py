@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.helpers import UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco import journal
+from ademco.journal import AdemcoJournal, AdemcoJournalReader, encode_frame
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "panel.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, entries):
+        writer = AdemcoJournal(self.path)
+        for (time_ms, direction, line) in entries:
+            writer.queue.put((time_ms, direction, line))
+        writer.close()
+
+    def test_frames_round_trip(self):
+        for line in (UPDATE_DISARMED, '%01,0500000000000000$', '%02,0100000000000000$', '%FF,00$'):
+            record = journal.JournalRecord((0, 0, journal.DIRECTION_RECEIVED) + encode_frame(line)[:5] + (0,), encode_frame(line)[5])
+            self.assertEqual(record.frame(), line)
+
+    def test_malformed_lines_are_kept_raw(self):
+        for line in ('%00,01,ZZZZ,08,00,text$', 'garbage', '%100,00$'):
+            self.assertEqual(encode_frame(line), (journal.RECORD_TYPE_RAW, 0, 0, 0, 0, line))
+
+    def test_repeated_updates_are_run_length_encoded(self):
+        self.write([
+            (1000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (2000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (3000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (4000, journal.DIRECTION_RECEIVED, UPDATE_ARMED_AWAY),
+        ])
+
+        reader = AdemcoJournalReader(self.path)
+        records = list(reader.iter_records())
+        self.assertEqual([(r.time_ms, r.repeat) for r in records], [(1000, 0), (2000, 1), (4000, 0)])
+        self.assertEqual([r.frame() for r in records], [UPDATE_DISARMED, UPDATE_DISARMED, UPDATE_ARMED_AWAY])
+        self.assertEqual(os.path.getsize(self.path), 3 * journal.RECORD_SIZE)
+
+    def test_sent_commands_mask_the_code(self):
+        writer = AdemcoJournal(self.path)
+        writer.add_secret("1234")
+        writer.record_sent("12342")
+        writer.close()
+        record = AdemcoJournalReader(self.path).record(0)
+        self.assertEqual(record.frame(), "****2")
+
+    def test_seek_across_index_strides(self):
+        entries = []
+        for i in range(journal.INDEX_STRIDE * 3):
+            entries.append((1000 * i, journal.DIRECTION_RECEIVED, '%%01,%016X$' % i))
+        self.write(entries)
+
+        reader = AdemcoJournalReader(self.path)
+        self.assertEqual(len(reader), journal.INDEX_STRIDE * 3)
+        self.assertEqual(reader.seek(0), 0)
+        self.assertEqual(reader.seek(300.0), 300)
+        self.assertEqual(reader.seek(300.5), 301)
+        self.assertEqual(reader.seek(10 ** 6), len(reader))
+        self.assertEqual([r.time_ms for r in reader.iter_records(10.0, 13.0)], [10000, 11000, 12000])
+
+    def test_reopen_appends_and_keeps_string_ids(self):
+        self.write([(1000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED)])
+        self.write([(2000, journal.DIRECTION_RECEIVED, UPDATE_ARMED_AWAY), (3000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED)])
+
+        frames = [r.frame() for r in AdemcoJournalReader(self.path).iter_records()]
+        self.assertEqual(frames, [UPDATE_DISARMED, UPDATE_ARMED_AWAY, UPDATE_DISARMED])
+        self.assertEqual(len(journal.read_strings(self.path + '.str')), 2)
+
+    def test_reopen_repairs_torn_tail(self):
+        entries = [(1000 * i, journal.DIRECTION_RECEIVED, '%%01,%016X$' % i) for i in range(journal.INDEX_STRIDE * 3)]
+        self.write(entries)
+
+        # A crash mid-write: a torn record, a torn string, and an index that points past the records
+        kept = journal.INDEX_STRIDE + 10
+        with open(self.path, 'r+b') as records_file:
+            records_file.truncate(kept * journal.RECORD_SIZE + 7)
+        with open(self.path + '.str', 'ab') as strings_file:
+            strings_file.write('\x20\x00' + 'torn')
+
+        self.write([(10 ** 6, journal.DIRECTION_RECEIVED, UPDATE_DISARMED)])
+
+        reader = AdemcoJournalReader(self.path)
+        frames = [r.frame() for r in reader.iter_records()]
+        self.assertEqual(frames, [i[2] for i in entries[:kept]] + [UPDATE_DISARMED])
+        self.assertEqual(reader.index_count, 2)
+        self.assertEqual(reader.seek(1000.0), len(reader) - 1)
+        self.assertEqual(reader.seek(200.0), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
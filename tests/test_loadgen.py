@@ -0,0 +1,25 @@
+import unittest
+
+from ademco.response import AdemcoResponse
+from ademco.loadgen import AdemcoLoadGenerator, AdemcoLoadPanel, update_sent_time
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    def test_update_carries_send_time(self):
+        response = AdemcoResponse()
+        self.assertTrue(response.parse(AdemcoLoadPanel().update_frame(0)))
+        self.assertTrue(update_sent_time(response) > 0)
+
+    def test_curve_has_a_point_per_step(self):
+        curve = AdemcoLoadGenerator(steps=(2, 5), duration=1.0, update_interval=0.2).run()
+
+        self.assertEqual([i["panels"] for i in curve], [2, 5])
+        for point in curve:
+            self.assertEqual(point["disconnects"], 0)
+            self.assertTrue(point["frames"] > 0)
+            self.assertTrue(point["latency-ms"]["count"] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
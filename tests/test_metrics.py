@@ -0,0 +1,101 @@
+import unittest
+import urllib2
+
+from tests.helpers import StubConnection, UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.httpapi import AdemcoHTTPServer
+from ademco.metrics import METRICS, AdemcoMetrics
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        metrics = AdemcoMetrics()
+        metrics.observe("ademco_parse_seconds", 0.000003, type="00")
+        metrics.observe("ademco_parse_seconds", 2.0, type="00")
+        text = metrics.render()
+
+        self.assertIn('ademco_parse_seconds_bucket{type="00",le="5e-06"} 1', text)
+        self.assertIn('ademco_parse_seconds_bucket{type="00",le="+Inf"} 2', text)
+        self.assertIn('ademco_parse_seconds_count{type="00"} 2', text)
+        self.assertIn("# TYPE ademco_parse_seconds histogram", text)
+
+    def test_counter_renders_labels(self):
+        metrics = AdemcoMetrics()
+        metrics.increment("ademco_state_changes_total", type="01")
+        metrics.increment("ademco_state_changes_total", 2, type="01")
+        self.assertIn('ademco_state_changes_total{type="01"} 3', metrics.render())
+
+
+class MetricsHooksTest(unittest.TestCase):
+
+    def setUp(self):
+        METRICS.reset()
+        METRICS.enable()
+        self.server = AdemcoServer()
+        self.server.connection = StubConnection()
+
+    def tearDown(self):
+        METRICS.enable(False)
+        METRICS.reset()
+
+    def receive(self, *frames):
+        self.server.connection.receive(*frames)
+        with QuietStderr():
+            self.server.process_queue()
+
+    def test_parse_and_process_are_timed_per_type(self):
+        self.receive(UPDATE_DISARMED, '%01,0100000000000000$', '%01,ZZ$')
+
+        self.assertEqual(METRICS.histogram_count("ademco_parse_seconds", type="00"), 1)
+        self.assertEqual(METRICS.histogram_count("ademco_process_seconds", type="01"), 1)
+        self.assertEqual(METRICS.counter_value("ademco_parse_errors_total"), 1)
+        self.assertEqual(METRICS.counter_value("ademco_state_changes_total", type="00"), 1)
+
+    def test_command_confirmation_is_timed(self):
+        self.receive(UPDATE_DISARMED)
+        self.server.connection.command_sent = self.server.command_sent
+        self.server.set_code("1234")
+        self.server.issue_command(AdemcoServer.COMMAND_ARM_AWAY)
+
+        # Nothing counts until the command has gone out
+        self.receive(UPDATE_ARMED_AWAY)
+        self.assertEqual(METRICS.histogram_count("ademco_command_confirm_seconds", command="arm"), 0)
+
+        self.receive(UPDATE_DISARMED)
+        self.server.connection.send()
+
+        # Neither a repeated update nor an unrelated zone change is a confirmation
+        self.receive(UPDATE_DISARMED, '%01,0100000000000000$')
+        self.assertEqual(METRICS.histogram_count("ademco_command_confirm_seconds", command="arm"), 0)
+
+        self.receive(UPDATE_ARMED_AWAY)
+        self.assertEqual(METRICS.histogram_count("ademco_command_confirm_seconds", command="arm"), 1)
+
+    def test_disabled_records_nothing(self):
+        METRICS.enable(False)
+        self.receive(UPDATE_DISARMED)
+        with QuietStderr():
+            AdemcoResponse().parse(UPDATE_DISARMED)
+        self.assertEqual(METRICS.counters, {})
+        self.assertEqual(METRICS.histograms, {})
+
+    def test_metrics_endpoint(self):
+        self.receive(UPDATE_DISARMED)
+        http_server = AdemcoHTTPServer(("127.0.0.1", 0), self.server)
+        http_server.start()
+
+        try:
+            response = urllib2.urlopen("http://127.0.0.1:%d/metrics" % http_server.server_address[1], timeout=5)
+            self.assertTrue(response.info().get("Content-Type").startswith("text/plain"))
+            self.assertIn('ademco_parse_seconds_count{type="00"} 1', response.read())
+        finally:
+            http_server.shutdown()
+            http_server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.helpers import UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco import journal
+from ademco.journal import AdemcoJournal
+from ademco.replay import AdemcoReplay, parse_replay_speed
+from ademco.common import QuietStderr
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "panel.journal")
+
+        writer = AdemcoJournal(self.path)
+        entries = [
+            (1000, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (1100, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (1200, journal.DIRECTION_RECEIVED, UPDATE_DISARMED),
+            (1300, journal.DIRECTION_SENT, "****2"),
+            (1400, journal.DIRECTION_RECEIVED, UPDATE_ARMED_AWAY),
+        ]
+        for entry in entries:
+            writer.queue.put(entry)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay_reaches_final_state(self):
+        replay = AdemcoReplay(self.path)
+        with QuietStderr():
+            report = replay.run()
+
+        self.assertEqual(report["frames"], 4)
+        self.assertEqual(report["commands"], 1)
+        self.assertEqual(report["stage-latency-us"]["process"]["count"], 4)
+        self.assertEqual(replay.server.state_snapshot()["update"]["arm-mode"], "away")
+
+    def test_replay_is_paced_by_speed(self):
+        replay = AdemcoReplay(self.path, speed=2.0)
+        with QuietStderr():
+            report = replay.run()
+
+        # 0.4 s of recorded traffic at 2x
+        self.assertTrue(report["elapsed-seconds"] >= 0.19)
+
+    def test_parse_replay_speed(self):
+        self.assertEqual(parse_replay_speed("max"), None)
+        self.assertEqual(parse_replay_speed("10x"), 10.0)
+        self.assertRaises(ValueError, parse_replay_speed, "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
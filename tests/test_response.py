@@ -0,0 +1,48 @@
+import unittest
+
+from ademco.response import AdemcoResponse
+from ademco.common import QuietStderr
+
+
+def parse(frame):
+    response = AdemcoResponse()
+    with QuietStderr():
+        result = response.parse(frame)
+    return response, result
+
+
+class ZoneChangeTest(unittest.TestCase):
+
+    def test_first_byte_is_least_significant_bit_first(self):
+        response, result = parse('%01,0500000000000000$')
+        self.assertTrue(result)
+        self.assertEqual(response.zone_change_open_zones(), [1, 3])
+
+    def test_later_bytes_cover_later_zones(self):
+        response, result = parse('%01,0080000000000001$')
+        self.assertTrue(result)
+        self.assertEqual(response.zone_change_open_zones(), [16, 57])
+
+    def test_rejects_non_hex_field(self):
+        response, result = parse('%01,ZZ00000000000000$')
+        self.assertFalse(result)
+
+
+class PartitionStateTest(unittest.TestCase):
+
+    def test_decodes_used_partitions(self):
+        response, result = parse('%02,0100050000000000$')
+        self.assertTrue(result)
+        self.assertEqual(response.partition_state_values(), {1: 1, 3: 5})
+        self.assertEqual(response.partition_state_dict(), {"1": "ready", "3": "armed-away"})
+
+
+class UpdateTest(unittest.TestCase):
+
+    def test_rejects_non_hex_bitfield(self):
+        response, result = parse('%00,01,ZZZZ,08,00,****DISARMED****  Ready to Arm  $')
+        self.assertFalse(result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator
+from ademco.router import AdemcoRouter, AdemcoTPIBackend, AdemcoBackendStats, AdemcoBackendError, AdemcoPanelNotReady
+from ademco.router import AdemcoEZMobileBackend, ROUTER_MAX_CONSECUTIVE_FAILURES, ROUTER_RETRY_AFTER, STATUS_FIELDS
+from ademco.common import QuietStderr
+
+
+class FakeBackend:
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.commands = []
+
+    def status(self, timeout):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"text": "ready", "ready": True, "armed": False}
+
+    def command(self, command, code, parameter, timeout):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.commands.append(command)
+
+
+class BackendStatsTest(unittest.TestCase):
+
+    def test_latency_is_kept_per_operation(self):
+        stats = AdemcoBackendStats()
+        stats.record(True, 0.1, "status")
+        stats.record(True, 0.3, "status")
+        stats.record(True, 5.0, "command")
+        stats.record(False, 9.0, "status")
+        self.assertAlmostEqual(stats.latency("status"), 0.2)
+        self.assertAlmostEqual(stats.latency("command"), 5.0)
+        self.assertEqual(stats.success_rate(), 0.75)
+
+    def test_failing_backend_rests_then_gets_another_try(self):
+        stats = AdemcoBackendStats()
+        stats.record(True, 0.1, "status")
+        for i in range(ROUTER_MAX_CONSECUTIVE_FAILURES):
+            stats.record(False, 0.1, "status", now=1000.0)
+        self.assertFalse(stats.is_healthy(now=1001.0))
+        self.assertTrue(stats.is_healthy(now=1000.0 + ROUTER_RETRY_AFTER))
+
+
+class RouterTest(unittest.TestCase):
+
+    def test_fastest_backend_is_preferred_once_measured(self):
+        slow = FakeBackend("slow", delay=0.05)
+        fast = FakeBackend("fast")
+        router = AdemcoRouter([slow, fast])
+
+        # Status tries each unmeasured backend first, in the given order
+        self.assertEqual(router.status()["backend"], "slow")
+        self.assertEqual(router.status()["backend"], "fast")
+        self.assertEqual(router.status()["backend"], "fast")
+
+    def test_commands_follow_backend_order(self):
+        # A faster command elsewhere does not win: latencies are not comparable between backends
+        router = AdemcoRouter([FakeBackend("tpi", delay=0.05), FakeBackend("portal")])
+        router.stats["tpi"].record(True, 5.0, "command")
+        router.stats["portal"].record(True, 0.5, "command")
+        self.assertEqual(router.command(AdemcoServer.COMMAND_ARM_AWAY, "1234"), "tpi")
+
+        for i in range(ROUTER_MAX_CONSECUTIVE_FAILURES):
+            router.stats["tpi"].record(False, 1.0, "command")
+        self.assertEqual(router.command(AdemcoServer.COMMAND_ARM_AWAY, "1234"), "portal")
+
+    def test_status_falls_back_to_next_backend(self):
+        router = AdemcoRouter([FakeBackend("down", error=AdemcoBackendError("refused")), FakeBackend("up")])
+        self.assertEqual(router.status()["backend"], "up")
+        self.assertEqual(router.stats["down"].consecutive_failures, 1)
+
+    def test_command_is_not_repeated_once_issued(self):
+        up = FakeBackend("up")
+        router = AdemcoRouter([FakeBackend("flaky", error=AdemcoBackendError("no confirmation", issued=True)), up])
+        self.assertRaises(AdemcoBackendError, router.command, AdemcoServer.COMMAND_ARM_AWAY, "1234")
+        self.assertEqual(up.commands, [])
+
+        router = AdemcoRouter([FakeBackend("down", error=AdemcoBackendError("refused")), up])
+        self.assertEqual(router.command(AdemcoServer.COMMAND_ARM_AWAY, "1234"), "up")
+        self.assertEqual(up.commands, [AdemcoServer.COMMAND_ARM_AWAY])
+
+    def test_not_ready_is_not_retried_elsewhere(self):
+        up = FakeBackend("up")
+        router = AdemcoRouter([FakeBackend("tpi", error=AdemcoPanelNotReady("not ready")), up])
+        self.assertRaises(AdemcoPanelNotReady, router.command, AdemcoServer.COMMAND_ARM_AWAY, "1234")
+        self.assertEqual(up.commands, [])
+        self.assertTrue(router.stats["tpi"].is_healthy())
+
+    def test_race_takes_first_answer(self):
+        router = AdemcoRouter([FakeBackend("slow", delay=0.5), FakeBackend("fast", delay=0.01)], race_status=True)
+        started = time.time()
+        self.assertEqual(router.status()["backend"], "fast")
+        self.assertTrue(time.time() - started < 0.4)
+
+        router.settle()
+        self.assertEqual(len(router.stats["slow"].outcomes), 1)
+
+    def test_race_fails_only_when_every_backend_fails(self):
+        router = AdemcoRouter([FakeBackend("a", error=AdemcoBackendError("a down")),
+                               FakeBackend("b", error=AdemcoBackendError("b down"))], race_status=True)
+        self.assertRaises(AdemcoBackendError, router.status)
+
+    def test_stats_are_saved_per_panel(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats.json")
+            first = AdemcoRouter([FakeBackend("tpi")], panel="a")
+            first.status()
+            first.save_stats(path)
+            AdemcoRouter([FakeBackend("tpi")], panel="b").save_stats(path)
+
+            restored = AdemcoRouter([FakeBackend("tpi")], panel="a")
+            restored.load_stats(path)
+            self.assertEqual(len(restored.stats["tpi"].outcomes), 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+class EZMobileStatusTest(unittest.TestCase):
+
+    def test_status_has_tpi_schema(self):
+        backend = AdemcoEZMobileBackend("http://portal", "m", "d", 1)
+        backend.alarm._fetch_partition_page = lambda: {"1": "armed away"}
+
+        status = backend.status()
+        self.assertEqual(sorted(status), sorted(STATUS_FIELDS))
+        self.assertEqual((status["armed"], status["arm-mode"], status["ready"]), (True, "away", False))
+        self.assertEqual(status["chime"], None)
+
+
+class TPIBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = AdemcoSimulator(password="secret", update_interval=0.1, max_sessions=2)
+        self.loop = self.simulator.start()
+        self.backend = AdemcoTPIBackend("127.0.0.1", self.simulator.address[1], "secret")
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def test_status_and_command(self):
+        with QuietStderr():
+            status = self.backend.status()
+            self.assertEqual(status["text"], "****DISARMED****  Ready to Arm")
+            self.assertEqual(sorted(status), sorted(STATUS_FIELDS))
+            self.backend.command(AdemcoServer.COMMAND_ARM_AWAY, "1234")
+            self.assertTrue(self.backend.status()["armed"])
+            self.assertRaises(AdemcoPanelNotReady, self.backend.command, AdemcoServer.COMMAND_TEST, "1234")
+
+
+if __name__ == '__main__':
+    unittest.main()
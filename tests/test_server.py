@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+from tests.helpers import StubConnection, UPDATE_DISARMED, UPDATE_ARMED_AWAY
+
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.common import QuietStderr
+
+
+class ServerStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AdemcoServer()
+        self.server.connection = StubConnection()
+
+    def receive(self, *lines):
+        self.server.connection.receive(*lines)
+        with QuietStderr():
+            self.server.process_queue()
+
+    def test_batch_is_applied_in_arrival_order(self):
+        self.receive(UPDATE_DISARMED, UPDATE_ARMED_AWAY)
+        snapshot = self.server.state_snapshot()
+        self.assertEqual(snapshot["update"]["arm-mode"], "away")
+        self.assertEqual(snapshot["version"], 2)
+
+    def test_repeated_update_does_not_move_version(self):
+        self.receive(UPDATE_DISARMED)
+        self.receive(UPDATE_DISARMED)
+        self.assertEqual(self.server.state_version, 1)
+
+    def test_zones_and_partitions_in_snapshot(self):
+        self.receive('%01,0500000000000000$', '%02,0100000000000000$')
+        snapshot = self.server.state_snapshot()
+        self.assertEqual(snapshot["zones"]["open"], [1, 3])
+        self.assertEqual(snapshot["partitions"], {"1": "ready"})
+
+    def test_response_history_is_bounded(self):
+        for i in range(AdemcoServer.RESPONSE_HISTORY_LIMIT * 2):
+            self.receive(UPDATE_DISARMED)
+        updates = self.server.responses[AdemcoResponse.RESPONSE_UPDATE]
+        self.assertEqual(len(updates), AdemcoServer.RESPONSE_HISTORY_LIMIT)
+
+    def test_invalid_bitfield_is_ignored(self):
+        self.receive('%00,01,ZZZZ,08,00,****DISARMED****  Ready to Arm  $')
+        self.assertEqual(self.server.state_version, 0)
+        self.assertEqual(self.server.state_snapshot()["update"], None)
+
+    def test_wait_for_state_change_times_out(self):
+        self.assertEqual(self.server.wait_for_state_change(0, 0.05), 0)
+
+    def test_wait_for_state_change_wakes_up(self):
+        timer = threading.Timer(0.05, self.receive, (UPDATE_DISARMED,))
+        timer.start()
+        self.assertEqual(self.server.wait_for_state_change(0, 5.0), 1)
+        timer.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
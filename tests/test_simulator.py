@@ -0,0 +1,97 @@
+import time
+import unittest
+
+from ademco.connection import AdemcoServerConnection
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.simulator import AdemcoSimulator, AdemcoSimulatorFaults, AdemcoSimulatorPanel
+from ademco.common import QuietStderr
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def start(self, faults=None, **kwargs):
+        self.simulator = AdemcoSimulator(password="secret", faults=faults, update_interval=0.2, **kwargs)
+        self.loop = self.simulator.start()
+
+        self.server = AdemcoServer()
+        self.server.set_code("1234")
+        with QuietStderr():
+            self.server.connect("127.0.0.1", self.simulator.address[1], "secret")
+
+    def tearDown(self):
+        self.server.disconnect()
+        self.loop.stop()
+
+    def run_until(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        with QuietStderr():
+            while time.time() < deadline:
+                self.server.process_connection()
+                self.server.process_queue()
+                if condition():
+                    return True
+        return False
+
+    def last_update(self):
+        return self.server.last_response_of_type(AdemcoResponse.RESPONSE_UPDATE)
+
+    def test_login_and_arm_disarm(self):
+        self.start()
+        self.assertEqual(self.server.connection_state(), AdemcoServerConnection.STATE_CONNECTED)
+        self.assertTrue(self.run_until(lambda: self.last_update() is not None))
+        self.assertTrue(self.last_update().update_is_ready())
+
+        self.server.issue_command(AdemcoServer.COMMAND_ARM_AWAY)
+        self.assertTrue(self.run_until(lambda: self.server.state_snapshot()["partitions"] == {"1": "armed-away"}))
+        self.assertTrue(self.last_update().update_is_armed())
+        self.assertEqual(self.simulator.commands, ["12342"])
+
+        self.server.issue_command(AdemcoServer.COMMAND_DISARM)
+        self.assertTrue(self.run_until(lambda: not self.last_update().update_is_armed()))
+
+    def test_exit_delay(self):
+        self.start(panel=AdemcoSimulatorPanel(exit_delay=0.3))
+        self.server.issue_command(AdemcoServer.COMMAND_ARM_AWAY)
+        self.assertTrue(self.run_until(lambda: self.server.state_snapshot()["partitions"] == {"1": "exit-delay"}))
+        self.assertFalse(self.last_update().update_is_armed())
+        self.assertTrue(self.run_until(lambda: self.last_update().update_is_armed()))
+
+    def test_split_frames_are_reassembled(self):
+        self.start(AdemcoSimulatorFaults(split=5))
+        self.assertTrue(self.run_until(lambda: self.last_update() is not None))
+        self.assertEqual(self.last_update().update_text().strip(), "****DISARMED****  Ready to Arm")
+
+    def test_malformed_lines_are_skipped(self):
+        self.start(AdemcoSimulatorFaults(malformed_rate=0.5, seed=1))
+        self.assertTrue(self.run_until(lambda: len(self.server.responses[AdemcoResponse.RESPONSE_UPDATE]) >= 3))
+        self.assertEqual(self.server.connection_state(), AdemcoServerConnection.STATE_CONNECTED)
+
+    def test_dropped_connection(self):
+        self.start(AdemcoSimulatorFaults(drop_after=2))
+        self.assertTrue(self.run_until(
+            lambda: self.server.connection_state() == AdemcoServerConnection.STATE_DISCONNECTED))
+
+    def test_script_does_not_hold_back_updates(self):
+        self.simulator = AdemcoSimulator(password="secret", update_interval=0.2)
+        self.simulator.add_script(3.0, "%02,0100$")
+        self.loop = self.simulator.start()
+
+        self.server = AdemcoServer()
+        began = time.time()
+        with QuietStderr():
+            self.server.connect("127.0.0.1", self.simulator.address[1], "secret")
+        self.assertTrue(self.run_until(lambda: self.last_update() is not None, timeout=1.0))
+        self.assertTrue(time.time() - began < 1.0)
+
+    def test_wrong_password_is_rejected(self):
+        self.simulator = AdemcoSimulator(password="secret")
+        self.loop = self.simulator.start()
+        self.server = AdemcoServer()
+        with QuietStderr():
+            self.server.connect("127.0.0.1", self.simulator.address[1], "wrong")
+        self.assertEqual(self.server.connection_state(), AdemcoServerConnection.STATE_DISCONNECTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
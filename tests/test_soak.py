@@ -0,0 +1,25 @@
+import unittest
+
+from ademco.soak import AdemcoSoak, slope
+
+
+class SoakTest(unittest.TestCase):
+
+    def test_slope(self):
+        self.assertEqual(slope([1, 2, 3, 4]), 1.0)
+        self.assertEqual(slope([5, 5, 5]), 0.0)
+
+    def test_short_soak_is_stable(self):
+        report = AdemcoSoak(days=2, samples=8).run()
+        self.assertEqual(report["failures"], [])
+        self.assertTrue(report["frames"] > 2 * 8640)
+
+    def test_unbounded_history_is_detected(self):
+        soak = AdemcoSoak(days=2, samples=8)
+        soak.server.RESPONSE_HISTORY_LIMIT = 10 ** 9
+        report = soak.run()
+        self.assertTrue(any(["Object count" in i for i in report["failures"]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
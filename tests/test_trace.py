@@ -0,0 +1,108 @@
+import logging
+import unittest
+import StringIO
+import socket
+
+from tests.helpers import StubConnection, UPDATE_DISARMED
+
+from ademco.response import AdemcoResponse
+from ademco.server import AdemcoServer
+from ademco.connection import AdemcoServerConnection
+from ademco.trace import AdemcoTrace, TRACE, TRACE_REJECTED
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TraceTest(unittest.TestCase):
+
+    def test_ring_keeps_only_recent_records(self):
+        trace = AdemcoTrace(size=3)
+        for i in range(5):
+            trace.record("event", "number %d", i)
+        lines = trace.lines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith("number 2"))
+        self.assertTrue(lines[-1].endswith("number 4"))
+
+    def test_frames_are_not_formatted(self):
+        trace = AdemcoTrace()
+        trace.record("recv", UPDATE_DISARMED)
+        self.assertTrue(trace.lines()[0].endswith(UPDATE_DISARMED))
+
+    def test_secrets_are_masked(self):
+        trace = AdemcoTrace()
+        trace.add_secret("1234")
+        trace.record("sent", "12342")
+        output = StringIO.StringIO()
+        trace.dump(output, reason="test")
+        self.assertNotIn("1234", output.getvalue())
+        self.assertIn("****2", output.getvalue())
+
+
+class LoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger("ademco")
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        TRACE.clear()
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    def test_frames_are_not_logged_at_warning_level(self):
+        self.logger.setLevel(logging.WARNING)
+        server = AdemcoServer()
+        server.connection = StubConnection()
+        server.connection.receive(UPDATE_DISARMED, '%01,ZZ$')
+        server.process_queue()
+
+        self.assertEqual([i.levelno for i in self.handler.records], [logging.WARNING])
+        self.assertEqual(TRACE.records[-1][1], TRACE_REJECTED)
+
+    def failed_connection(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        # Another session's traffic shares the process-wide ring
+        other = AdemcoServerConnection("10.0.0.9", 4025, "user")
+        other._add_response(UPDATE_DISARMED)
+
+        connection = AdemcoServerConnection("127.0.0.1", port, "user")
+        connection.connect()
+        return connection
+
+    def test_failure_logs_only_its_session(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.failed_connection()
+
+        traces = [i for i in self.handler.records if i.getMessage().startswith("Trace")]
+        self.assertEqual([i.levelno for i in traces], [logging.DEBUG])
+        self.assertIn("connecting to 127.0.0.1", traces[0].getMessage())
+        self.assertNotIn(UPDATE_DISARMED, traces[0].getMessage())
+
+    def test_failure_trace_is_not_logged_at_warning_level(self):
+        self.logger.setLevel(logging.WARNING)
+        self.failed_connection()
+        self.assertEqual([i.levelno for i in self.handler.records], [logging.ERROR])
+
+    def test_frames_are_logged_at_debug_level(self):
+        self.logger.setLevel(logging.DEBUG)
+        AdemcoResponse().parse(UPDATE_DISARMED)
+        self.assertEqual(self.handler.records[0].getMessage(), "Update: ****DISARMED****  Ready to Arm  ")
+
+
+if __name__ == "__main__":
+    unittest.main()